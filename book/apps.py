@@ -5,3 +5,6 @@ class BookConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "book"
     verbose_name = "favorite books"
+
+    def ready(self) -> None:
+        import book.signals  # noqa: F401
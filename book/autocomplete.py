@@ -0,0 +1,232 @@
+import logging
+import threading
+from bisect import bisect_left, insort
+from typing import Iterable, Optional
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import QuerySet
+
+from book.cache import get_book_changes, get_book_feed_position, record_book_changes
+from book.models import Book
+
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+# more changes than this are cheaper to rebuild from than to apply
+MAX_INDEX_CHANGES = 500
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def index_keys(title: str, author: str) -> set[str]:
+    """Every word start of the title and author, so "pot" finds "Harry Potter" """
+
+    keys = set()
+    for text in (title, author):
+        words = normalize(text).split(" ")
+        for position in range(len(words)):
+            keys.add(" ".join(words[position:]))
+    keys.discard("")
+    return keys
+
+
+class BookPrefixIndex:
+    """In-process sorted-array index for title/author prefix lookups.
+
+    The index remembers the book feed position it reflects. Local Book
+    changes are applied as they commit, changes recorded by other processes
+    are read with their entries from the feed, without a query. Only a lost
+    feed rebuilds it.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._keys: list[tuple[str, int]] = []
+        self._books: dict[int, dict] = {}
+        self.version: Optional[int] = None
+
+    def build(self, books: Iterable[dict], version: int) -> None:
+        entries = {book["id"]: book for book in books}
+        keys = sorted(
+            (key, book_id)
+            for book_id, book in entries.items()
+            for key in index_keys(book["title"], book["author"])
+        )
+
+        with self._lock:
+            self._keys = keys
+            self._books = entries
+            self.version = version
+
+    def upsert(self, book: dict, position: int) -> None:
+        """Apply a local change, unless changes before it are still missing"""
+
+        with self._lock:
+            if self.version != position - 1:
+                return
+            self._upsert(book)
+            self.version = position
+
+    def remove(self, book_id: int, position: int) -> None:
+        with self._lock:
+            if self.version != position - 1:
+                return
+            self._remove(book_id)
+            self.version = position
+
+    def apply(
+        self, books: Iterable[dict], removed: Iterable[int], start: int, end: int
+    ) -> None:
+        """Apply the changes fetched for the feed between ``start`` and ``end``"""
+
+        with self._lock:
+            if self.version != start:
+                return
+            for book in books:
+                self._upsert(book)
+            for book_id in removed:
+                self._remove(book_id)
+            self.version = end
+
+    def lookup(self, prefix: str, limit: int = AUTOCOMPLETE_LIMIT) -> list[dict]:
+        prefix = normalize(prefix)
+        found = {}
+
+        with self._lock:
+            position = bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and len(found) < limit:
+                key, book_id = self._keys[position]
+                if not key.startswith(prefix):
+                    break
+                found.setdefault(book_id, self._books[book_id])
+                position += 1
+
+        return list(found.values())
+
+    def _upsert(self, book: dict) -> None:
+        self._remove(book["id"])
+        self._books[book["id"]] = book
+        for key in index_keys(book["title"], book["author"]):
+            insort(self._keys, (key, book["id"]))
+
+    def _remove(self, book_id: int) -> None:
+        book = self._books.pop(book_id, None)
+        if book is None:
+            return
+        for key in index_keys(book["title"], book["author"]):
+            position = bisect_left(self._keys, (key, book_id))
+            if position < len(self._keys) and self._keys[position] == (key, book_id):
+                del self._keys[position]
+
+
+book_index = BookPrefixIndex()
+
+
+def book_entry(book: Book) -> dict:
+    return {
+        "id": book.id,
+        "title": book.title,
+        "author": book.author,
+        "inventory": book.inventory,
+    }
+
+
+def book_entries(books: QuerySet) -> Iterable[dict]:
+    rows = books.with_live_inventory().values_list(
+        "id", "title", "author", "live_inventory"
+    )
+    for book_id, title, author, inventory in rows.iterator():
+        yield {"id": book_id, "title": title, "author": author, "inventory": inventory}
+
+
+def publish_book_changes(book_ids: list[int]) -> None:
+    """Record the committed entries of the books in the feed, for the
+    indexes of every process, and apply them to the local one"""
+
+    books = list(book_entries(Book.objects.filter(id__in=book_ids)))
+    removed = set(book_ids) - {book["id"] for book in books}
+    position = record_book_changes(books, removed)
+    book_index.apply(books, removed, position - 1, position)
+
+
+def publish_book_changes_on_commit(book_ids: Iterable[int]) -> None:
+    """Publish the changes once they are visible to other connections"""
+
+    book_ids = list(book_ids)
+    transaction.on_commit(lambda: publish_book_changes(book_ids))
+
+
+def rebuild_book_index() -> None:
+    # changes recorded while the books are read are applied again afterwards
+    position = get_book_feed_position()
+    book_index.build(book_entries(Book.objects.all()), position)
+
+
+def rebuild_in_background() -> None:
+    try:
+        rebuild_book_index()
+    except DatabaseError:
+        logger.warning("Book index not rebuilt", exc_info=True)
+    finally:
+        connection.close()
+        rebuilding.release()
+
+
+rebuilding = threading.Lock()
+
+
+def schedule_rebuild() -> None:
+    """Rebuild in a thread of its own, lookups keep the current index meanwhile"""
+
+    if rebuilding.acquire(blocking=False):
+        threading.Thread(target=rebuild_in_background, daemon=True).start()
+
+
+def catch_up(index: BookPrefixIndex) -> None:
+    """Apply the changes other processes recorded in the book feed"""
+
+    start, end = index.version, get_book_feed_position()
+    if start == end:
+        return
+
+    changes = (
+        get_book_changes(start, end) if 0 < end - start <= MAX_INDEX_CHANGES else None
+    )
+    if changes is None:
+        schedule_rebuild()
+        return
+
+    # the last change of a book wins
+    books, removed = {}, set()
+    for entries, deleted in changes:
+        for book in entries:
+            books[book["id"]] = book
+            removed.discard(book["id"])
+        for book_id in deleted:
+            books.pop(book_id, None)
+            removed.add(book_id)
+    index.apply(books.values(), removed, start, end)
+
+
+def get_book_index() -> BookPrefixIndex:
+    """Return the index up to date with the book feed, it is only built in
+    the request when it was never built at all"""
+
+    if book_index.version is None:
+        rebuild_book_index()
+    else:
+        catch_up(book_index)
+    return book_index
+
+
+def warm_up_book_index() -> None:
+    """Build the index at worker startup; an unreachable database just
+    postpones the build to the first lookup"""
+
+    try:
+        rebuild_book_index()
+    except DatabaseError:
+        pass
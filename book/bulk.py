@@ -0,0 +1,202 @@
+import csv
+import json
+from codecs import iterdecode
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from book.autocomplete import publish_book_changes_on_commit
+from book.cache import bump_catalog_version_on_commit
+from book.models import Book
+from book.serializers import BookSerializer
+from book.signals import send_restocked_on_commit
+
+IMPORT_FORMATS = ("csv", "ndjson")
+IMPORT_CHUNK_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+MAX_REPORTED_ERRORS = 100
+BOOK_FIELDS = ("title", "author", "cover", "inventory", "daily_fee")
+EXPORT_FIELDS = ("id",) + BOOK_FIELDS
+
+
+def detect_format(file_name: str, requested: Optional[str] = None) -> str:
+    file_format = requested or file_name.rsplit(".", 1)[-1].lower()
+    if file_format == "jsonl":
+        file_format = "ndjson"
+    if file_format not in IMPORT_FORMATS:
+        raise ValidationError(
+            {"type": f"Unsupported format, use one of: {', '.join(IMPORT_FORMATS)}."}
+        )
+    return file_format
+
+
+def read_rows(
+    lines: Iterable[bytes], file_format: str
+) -> Iterator[tuple[int, Optional[dict], Optional[str]]]:
+    """Yield ``(line number, row, parse error)`` without reading the whole file"""
+
+    text = iterdecode(lines, "utf-8")
+
+    if file_format == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as error:
+            yield line_number, None, f"Invalid JSON: {error.msg}."
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "Each line must be a JSON object."
+            continue
+        yield line_number, row, None
+
+
+def clean_row(row: dict) -> tuple[Optional[Book], dict]:
+    """Validate a row with the model field validators and the daily fee rule.
+
+    ``BookSerializer.validate_daily_fee`` enforces the same bound as the
+    ``daily_fee_gte_0`` constraint, so no per-row database check is needed.
+    """
+
+    values, errors = {}, {}
+
+    for field_name in BOOK_FIELDS:
+        field = Book._meta.get_field(field_name)
+        value = row.get(field_name)
+        try:
+            values[field_name] = field.clean(value, None)
+        except DjangoValidationError as error:
+            errors[field_name] = error.messages
+
+    if "daily_fee" in values:
+        try:
+            BookSerializer().validate_daily_fee(values["daily_fee"])
+        except ValidationError as error:
+            errors["daily_fee"] = error.detail
+
+    book_id = row.get("id")
+    if book_id not in (None, ""):
+        try:
+            values["id"] = int(book_id)
+        except (TypeError, ValueError):
+            errors["id"] = ["A valid integer is required."]
+
+    if errors:
+        return None, errors
+    return Book(**values), errors
+
+
+def import_books(
+    lines: Iterable[bytes], file_format: str, chunk_size: int = IMPORT_CHUNK_SIZE
+) -> dict:
+    """Import books chunk by chunk.
+
+    Rows without an ``id`` are inserted, rows with the id of an existing book
+    are upserted. Invalid rows are reported and skipped.
+    """
+
+    report = {"created": 0, "updated": 0, "errors": []}
+    rows = read_rows(lines, file_format)
+
+    def add_error(line_number: int, error: dict | str) -> None:
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line_number, "errors": error})
+
+    while chunk := list(islice(rows, chunk_size)):
+        new_books, changed_books = [], {}
+
+        for line_number, row, parse_error in chunk:
+            if parse_error:
+                add_error(line_number, parse_error)
+                continue
+
+            book, errors = clean_row(row)
+            if errors:
+                add_error(line_number, errors)
+            elif book.id is None:
+                new_books.append(book)
+            else:
+                changed_books[book.id] = (line_number, book)
+
+        with transaction.atomic():
+            existing_ids = set(
+                Book.objects.filter(id__in=changed_books).values_list("id", flat=True)
+            )
+            for book_id, (line_number, book) in changed_books.items():
+                if book_id not in existing_ids:
+                    add_error(line_number, {"id": ["Book does not exist."]})
+
+            Book.objects.bulk_create(new_books)
+            Book.objects.bulk_create(
+                [
+                    book
+                    for book_id, (line_number, book) in changed_books.items()
+                    if book_id in existing_ids
+                ],
+                update_conflicts=True,
+                unique_fields=["id"],
+                update_fields=BOOK_FIELDS + ("updated_at",),
+            )
+
+            # the upsert only wrote the inventory column of striped books
+            for book in Book.objects.filter(
+                id__in=existing_ids, inventory_stripes__gt=1
+            ):
+                book.stripe_inventory(book.inventory)
+
+            if new_books or existing_ids:
+                # bulk writes fire no signals
+                bump_catalog_version_on_commit()
+                publish_book_changes_on_commit(
+                    [book.id for book in new_books] + sorted(existing_ids)
+                )
+            if existing_ids:
+                # new books have nobody waiting for them yet
+                send_restocked_on_commit(sorted(existing_ids))
+
+        report["created"] += len(new_books)
+        report["updated"] += len(existing_ids)
+
+    return report
+
+
+class Echo:
+    """File-like object that returns what is written, for streaming csv"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def export_books(file_format: str) -> Iterator[str]:
+    """Stream the catalogue without loading the whole table into memory"""
+
+    columns = [
+        "live_inventory" if name == "inventory" else name for name in EXPORT_FIELDS
+    ]
+    books = (
+        Book.objects.with_live_inventory()
+        .order_by("id")
+        .values_list(*columns)
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+    if file_format == "csv":
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        for book in books:
+            yield writer.writerow(book)
+        return
+
+    for book in books:
+        row = dict(zip(EXPORT_FIELDS, book))
+        row["daily_fee"] = str(row["daily_fee"])
+        yield json.dumps(row) + "\n"
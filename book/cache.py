@@ -0,0 +1,99 @@
+import hashlib
+import time
+from typing import Any, Callable, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import QueryDict
+
+CATALOG_VERSION_KEY = "book:catalog:version"
+BOOK_FEED_KEY = "book:feed:position"
+BOOK_CHANGE_KEY = "book:feed:change:{}"
+# a worker lagging behind the kept changes rebuilds its index instead
+BOOK_CHANGE_TIMEOUT = 60 * 60
+
+
+def get_catalog_version() -> int:
+    """Return the current catalog version, initialising it if it was evicted"""
+
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # a time-based seed never reuses a version that may still have cached pages
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version() -> int:
+    """Invalidate every cached catalog response by moving to a new version"""
+
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        get_catalog_version()
+        return cache.incr(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version_on_commit() -> None:
+    """Bump the version once the current transaction commits.
+
+    Bumping earlier would let a concurrent reader cache the pre-commit
+    inventory under the new version.
+    """
+
+    transaction.on_commit(bump_catalog_version)
+
+
+def get_book_feed_position() -> int:
+    """Return the position of the last recorded book change"""
+
+    position = cache.get(BOOK_FEED_KEY)
+    if position is None:
+        # a time-based seed is past every position handed out before eviction
+        cache.add(BOOK_FEED_KEY, time.time_ns(), timeout=None)
+        position = cache.get(BOOK_FEED_KEY)
+    return position
+
+
+def record_book_changes(books: list[dict], removed: Iterable[int] = ()) -> int:
+    """Append the entries of the changed books and the ids of the deleted
+    ones to the feed, return the new position"""
+
+    try:
+        position = cache.incr(BOOK_FEED_KEY)
+    except ValueError:
+        get_book_feed_position()
+        position = cache.incr(BOOK_FEED_KEY)
+    cache.set(
+        BOOK_CHANGE_KEY.format(position),
+        (list(books), list(removed)),
+        BOOK_CHANGE_TIMEOUT,
+    )
+    return position
+
+
+def get_book_changes(
+    start: int, end: int
+) -> Optional[list[tuple[list[dict], list[int]]]]:
+    """The changes after ``start`` up to ``end``, None when some expired"""
+
+    keys = [BOOK_CHANGE_KEY.format(position) for position in range(start + 1, end + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys):
+        return None
+    return [changes[key] for key in keys]
+
+
+def catalog_cache_key(prefix: str, params: QueryDict | dict) -> str:
+    items = params.lists() if isinstance(params, QueryDict) else params.items()
+    digest = hashlib.md5(repr(sorted(items)).encode()).hexdigest()
+    return f"book:catalog:{get_catalog_version()}:{prefix}:{digest}"
+
+
+def get_or_set_catalog(key: str, default: Callable[[], Any]) -> Any:
+    value = cache.get(key)
+    if value is None:
+        value = default()
+        cache.set(key, value, settings.CATALOG_CACHE_TIMEOUT)
+    return value
@@ -0,0 +1,49 @@
+import hashlib
+from typing import Any, Callable
+
+from django.db.models import Count, Max, QuerySet
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+
+class ConditionalGetMixin:
+    """ETag support computed from one aggregate query.
+
+    ``conditional_timestamps`` are the ``updated_at`` lookups whose maximum
+    marks the last change, ``conditional_counts`` catch deletions that leave
+    the maximum untouched. No Last-Modified is sent: striped stock, deletions
+    and shifted pages change the ETag without moving any timestamp.
+    """
+
+    conditional_timestamps = ("updated_at",)
+    conditional_counts = ("pk",)
+
+    def get_conditional_state(self, queryset: QuerySet, *key: Any) -> str:
+        state = queryset.aggregate(
+            **{
+                f"updated_{position}": Max(lookup)
+                for position, lookup in enumerate(self.conditional_timestamps)
+            },
+            **{
+                f"count_{position}": Count(lookup, distinct=True)
+                for position, lookup in enumerate(self.conditional_counts)
+            },
+        )
+        digest = hashlib.md5(repr((key, sorted(state.items()))).encode()).hexdigest()
+        return quote_etag(digest)
+
+    def conditional_response(
+        self, request: Request, etag: str, render: Callable[[], Response]
+    ) -> Response | HttpResponse:
+        """Answer with 304 Not Modified, or render and tag the response"""
+
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        response = render()
+        response["ETag"] = etag
+        return response
@@ -0,0 +1,82 @@
+import random
+
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from book.autocomplete import publish_book_changes_on_commit
+from book.cache import bump_catalog_version_on_commit
+from book.models import Book, BookInventoryStripe
+
+MAX_AVAILABILITY_IDS = 200
+
+
+def reserve_copy(book: Book) -> bool:
+    """Take one copy of the book if any is left.
+
+    A single conditional ``UPDATE ... SET inventory = inventory - 1 WHERE
+    inventory > 0`` makes concurrent checkouts race-free without reading the
+    row first or holding a lock around Python code. Striped books run the
+    same update against a random stripe and move on to the next stripes
+    only when it is empty.
+    """
+
+    if book.is_striped:
+        first = random.randrange(book.inventory_stripes)
+        reserved = any(
+            BookInventoryStripe.objects.filter(
+                book_id=book.id,
+                stripe=(first + offset) % book.inventory_stripes,
+                inventory__gt=0,
+            ).update(inventory=F("inventory") - 1)
+            for offset in range(book.inventory_stripes)
+        )
+    else:
+        reserved = Book.objects.filter(pk=book.id, inventory__gt=0).update(
+            inventory=F("inventory") - 1, updated_at=timezone.now()
+        )
+
+    if reserved:
+        book_changed(book)
+    return bool(reserved)
+
+
+def release_copies(book: Book, count: int = 1) -> None:
+    """Put returned copies back with one atomic increment"""
+
+    if book.is_striped:
+        BookInventoryStripe.objects.filter(
+            book_id=book.id, stripe=random.randrange(book.inventory_stripes)
+        ).update(inventory=F("inventory") + count)
+    else:
+        Book.objects.filter(pk=book.id).update(
+            inventory=F("inventory") + count, updated_at=timezone.now()
+        )
+    book_changed(book)
+
+
+def book_changed(book: Book) -> None:
+    """Stock changes expire the cached catalog pages and reach the
+    autocomplete index as a change of this one book"""
+
+    bump_catalog_version_on_commit()
+    publish_book_changes_on_commit([book.id])
+
+
+def get_availability(book_ids: list[int]) -> list[dict]:
+    """Inventory and active borrowings for many books in one aggregated query"""
+
+    books = (
+        Book.objects.filter(id__in=book_ids)
+        .with_live_inventory()
+        .annotate(
+            active_borrowings=Count(
+                "borrowings", filter=Q(borrowings__actual_return_date__isnull=True)
+            )
+        )
+        .order_by("id")
+        .values_list("id", "live_inventory", "active_borrowings")
+    )
+    return [
+        {"id": book_id, "inventory": inventory, "active_borrowings": active}
+        for book_id, inventory, active in books
+    ]
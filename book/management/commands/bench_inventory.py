@@ -0,0 +1,99 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+
+from django.core.management import BaseCommand, CommandParser
+from django.db import connection, transaction
+
+from book.inventory import reserve_copy
+from book.models import Book
+
+
+def reserve_read_modify_write(book: Book) -> bool:
+    """The previous checkout path: read, decrement in Python, save"""
+
+    book = Book.objects.get(pk=book.id)
+    if book.inventory == 0:
+        return False
+    book.inventory -= 1
+    book.save(update_fields=["inventory"])
+    return True
+
+
+def reserve_select_for_update(book: Book) -> bool:
+    book = Book.objects.select_for_update().get(pk=book.id)
+    if book.inventory == 0:
+        return False
+    book.inventory -= 1
+    book.save(update_fields=["inventory"])
+    return True
+
+
+STRATEGIES = {
+    "read-modify-write": reserve_read_modify_write,
+    "select-for-update": reserve_select_for_update,
+    "conditional-update": reserve_copy,
+    "striped-update": reserve_copy,
+}
+
+
+class Command(BaseCommand):
+    """Django command to benchmark concurrent checkouts of a single hot book"""
+
+    help = "Measure checkout throughput and lost updates under contention"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--checkouts", type=int, default=2000)
+        parser.add_argument("--inventory", type=int, default=1000)
+        parser.add_argument("--stripes", type=int, default=8)
+        parser.add_argument(
+            "--hold-ms",
+            type=float,
+            default=0,
+            help="Time spent in the checkout transaction after the reservation",
+        )
+
+    def handle(self, *args: tuple, **options: dict) -> None:
+        for name, reserve in STRATEGIES.items():
+            book = Book.objects.create(
+                title="Benchmark book",
+                author="Benchmark",
+                cover="soft",
+                inventory=options["inventory"],
+                daily_fee=1,
+                inventory_stripes=options["stripes"] if name == "striped-update" else 1,
+            )
+            try:
+                elapsed, reserved = self.run(book, reserve, options)
+                left = Book.objects.with_live_inventory().get(pk=book.id).inventory
+                lost = reserved - (options["inventory"] - left)
+                self.stdout.write(
+                    f"{name:>20}: {options['checkouts'] / elapsed:8.0f} checkouts/s, "
+                    f"{reserved} reserved, {lost} lost updates"
+                )
+            finally:
+                book.delete()
+
+    @staticmethod
+    def run(book: Book, reserve: callable, options: dict) -> tuple[float, int]:
+        threads = options["threads"]
+        per_thread = options["checkouts"] // threads
+        barrier = Barrier(threads)
+
+        def worker() -> int:
+            barrier.wait()
+            reserved = 0
+            try:
+                for _ in range(per_thread):
+                    with transaction.atomic():
+                        reserved += reserve(book)
+                        time.sleep(options["hold_ms"] / 1000)
+            finally:
+                connection.close()
+            return reserved
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            reserved = sum(executor.map(lambda _: worker(), range(threads)))
+        return time.perf_counter() - started, reserved
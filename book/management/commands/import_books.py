@@ -0,0 +1,31 @@
+import json
+
+from django.core.management import BaseCommand, CommandParser
+
+from book.bulk import IMPORT_CHUNK_SIZE, detect_format, import_books
+
+
+class Command(BaseCommand):
+    """Django command to bulk import books from a csv or ndjson file"""
+
+    help = "Import books from a csv or ndjson file"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("path")
+        parser.add_argument("--type", choices=("csv", "ndjson"))
+        parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args: tuple, **options: dict) -> None:
+        file_format = detect_format(options["path"], options["type"])
+
+        with open(options["path"], "rb") as file:
+            report = import_books(file, file_format, options["chunk_size"])
+
+        if report["errors"]:
+            self.stdout.write(json.dumps(report["errors"], indent=2))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {report['created']}, updated {report['updated']} books, "
+                f"{len(report['errors'])} rows rejected."
+            )
+        )
@@ -0,0 +1,62 @@
+# Generated by Django 4.2 on 2026-10-18 01:40
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR_SQL = """
+    setweight(to_tsvector('pg_catalog.english', coalesce({row}title, '')), 'A') ||
+    setweight(to_tsvector('pg_catalog.english', coalesce({row}author, '')), 'B')
+"""
+
+CREATE_SEARCH_VECTOR_SQL = f"""
+CREATE FUNCTION book_book_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR_SQL.format(row="NEW.")};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER book_book_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, author ON book_book
+    FOR EACH ROW EXECUTE FUNCTION book_book_search_vector_update();
+
+UPDATE book_book SET search_vector = {SEARCH_VECTOR_SQL.format(row="")};
+
+CREATE INDEX book_book_search_vector_gin ON book_book USING GIN (search_vector);
+"""
+
+DROP_SEARCH_VECTOR_SQL = """
+DROP INDEX IF EXISTS book_book_search_vector_gin;
+DROP TRIGGER IF EXISTS book_book_search_vector_trigger ON book_book;
+DROP FUNCTION IF EXISTS book_book_search_vector_update();
+"""
+
+
+def create_search_vector(apps, schema_editor) -> None:
+    """The trigger and GIN index only exist on PostgreSQL, other backends
+    use the fallback search engine"""
+
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_SEARCH_VECTOR_SQL)
+
+
+def drop_search_vector(apps, schema_editor) -> None:
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_SEARCH_VECTOR_SQL)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("book", "0002_book_daily_fee_gte_0"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(create_search_vector, drop_search_vector),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("book", "0003_book_search_vector"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-18 01:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("book", "0004_book_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="inventory_stripes",
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.CreateModel(
+            name="BookInventoryStripe",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("stripe", models.PositiveSmallIntegerField()),
+                ("inventory", models.PositiveIntegerField()),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stripes",
+                        to="book.book",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="bookinventorystripe",
+            constraint=models.UniqueConstraint(
+                fields=("book", "stripe"), name="unique_book_stripe"
+            ),
+        ),
+    ]
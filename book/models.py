@@ -1,5 +1,56 @@
-from django.db import models
-from django.db.models import CheckConstraint, Q
+from typing import Optional
+
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import (
+    Case,
+    CheckConstraint,
+    F,
+    OuterRef,
+    Q,
+    QuerySet,
+    Subquery,
+    Sum,
+    UniqueConstraint,
+    When,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.query import ModelIterable
+
+
+class LiveInventoryIterable(ModelIterable):
+    """Expose the summed stripes of striped books as ``Book.inventory``"""
+
+    def __iter__(self):
+        for book in super().__iter__():
+            book.inventory = book.live_inventory
+            book._loaded_inventory = (book.inventory, book.inventory_stripes)
+            yield book
+
+
+class BookQuerySet(QuerySet):
+    def with_live_inventory(self) -> "BookQuerySet":
+        """Annotate ``live_inventory``: the inventory column for regular books,
+        the sum of the stripes for striped ones"""
+
+        stripes_total = (
+            BookInventoryStripe.objects.filter(book=OuterRef("pk"))
+            .values("book")
+            .annotate(total=Sum("inventory"))
+            .values("total")
+        )
+        queryset = self.annotate(
+            live_inventory=Case(
+                When(
+                    inventory_stripes__gt=1,
+                    then=Coalesce(Subquery(stripes_total), 0),
+                ),
+                default=F("inventory"),
+                output_field=models.PositiveIntegerField(),
+            )
+        )
+        queryset._iterable_class = LiveInventoryIterable
+        return queryset
 
 
 class Book(models.Model):
@@ -14,6 +65,92 @@ class Book(models.Model):
     cover = models.CharField(max_length=4, choices=Enum.choices)
     inventory = models.PositiveIntegerField()
     daily_fee = models.DecimalField(max_digits=5, decimal_places=2)
+    # more than one stripe spreads the inventory over BookInventoryStripe rows
+    inventory_stripes = models.PositiveSmallIntegerField(default=1)
+    # maintained by a database trigger on PostgreSQL, see book.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = BookQuerySet.as_manager()
+
+    @property
+    def is_striped(self) -> bool:
+        return self.inventory_stripes > 1
+
+    @classmethod
+    def from_db(cls, db: str, field_names: list[str], values: list) -> "Book":
+        book = super().from_db(db, field_names, values)
+        book._loaded_inventory = (
+            book.__dict__.get("inventory"),
+            book.__dict__.get("inventory_stripes"),
+        )
+        return book
+
+    def save(self, *args: tuple, **kwargs: dict) -> None:
+        loaded = getattr(self, "_loaded_inventory", None)
+
+        if not self._stripes_outdated(loaded):
+            super().save(*args, **kwargs)
+        else:
+            inventory_changed = loaded is None or self.inventory != loaded[0]
+            was_striped = loaded is not None and (loaded[1] or 1) > 1
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                if not inventory_changed:
+                    self.stripe_inventory()
+                elif was_striped and loaded[0] is not None:
+                    # the loaded stock may be stale or moved on since, the
+                    # edit is applied as copies added to the live stock
+                    self.stripe_inventory(added=self.inventory - loaded[0])
+                else:
+                    self.stripe_inventory(self.inventory)
+
+        self._loaded_inventory = (self.inventory, self.inventory_stripes)
+
+    def _stripes_outdated(self, loaded: Optional[tuple]) -> bool:
+        """Whether a save changes the stock or the stripe count of a book that
+        is (or was) striped"""
+
+        if loaded is None:
+            return self.is_striped
+        was_striped = (loaded[1] or 1) > 1
+        return (was_striped or self.is_striped) and loaded != (
+            self.inventory,
+            self.inventory_stripes,
+        )
+
+    def stripe_inventory(self, total: Optional[int] = None, added: int = 0) -> None:
+        """Spread ``total`` copies (by default the current stock plus
+        ``added``) evenly over ``inventory_stripes`` rows, or fold the stripes
+        back into the inventory column when striping is switched off"""
+
+        with transaction.atomic():
+            stripes = list(self.stripes.select_for_update().order_by("stripe"))
+            if total is None:
+                total = (
+                    sum(stripe.inventory for stripe in stripes)
+                    if stripes
+                    else Book.objects.get(pk=self.pk).inventory
+                )
+                # copies out on loan cannot be taken off the shelf
+                total = max(total + added, 0)
+
+            # existing stripes are updated in place, so a checkout blocked on a
+            # stripe row re-reads the new share instead of missing the row
+            count = self.inventory_stripes if self.is_striped else 0
+            share, remainder = divmod(total, count or 1)
+            existing = {stripe.stripe: stripe for stripe in stripes}
+
+            self.stripes.filter(stripe__gte=count).delete()
+            for number in range(count):
+                stripe = existing.get(number) or BookInventoryStripe(
+                    book=self, stripe=number
+                )
+                stripe.inventory = share + (number < remainder)
+                stripe.save()
+
+            Book.objects.filter(pk=self.pk).update(inventory=total)
+            self.inventory = total
 
     def __str__(self) -> str:
         return self.title
@@ -26,3 +163,23 @@ class Book(models.Model):
                 violation_error_message="Borrowing cost cannot be less than zero",
             )
         ]
+
+
+class BookInventoryStripe(models.Model):
+    """One share of a hot book's inventory.
+
+    Checkouts of a striped book update a random stripe instead of the single
+    Book row, so concurrent writers rarely wait for each other.
+    """
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="stripes")
+    stripe = models.PositiveSmallIntegerField()
+    inventory = models.PositiveIntegerField()
+
+    def __str__(self) -> str:
+        return f"{self.book} (stripe {self.stripe})"
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=["book", "stripe"], name="unique_book_stripe")
+        ]
@@ -0,0 +1,46 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Q, QuerySet, Value, When
+
+SEARCH_CONFIG = "english"
+SEARCH_RESULTS_LIMIT = 50
+
+
+def search_books(queryset: QuerySet, query: str) -> QuerySet:
+    """Return books matching the query, best matches first"""
+
+    if connection.vendor == "postgresql":
+        return search_books_postgres(queryset, query)
+    return search_books_fallback(queryset, query)
+
+
+def search_books_postgres(queryset: QuerySet, query: str) -> QuerySet:
+    """Ranked search over the trigger-maintained ``search_vector`` column.
+
+    Titles carry weight A and authors weight B, so a title match ranks higher.
+    """
+
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+    return (
+        queryset.filter(search_vector=search_query)
+        .annotate(rank=SearchRank(F("search_vector"), search_query))
+        .order_by("-rank", "id")
+    )
+
+
+def search_books_fallback(queryset: QuerySet, query: str) -> QuerySet:
+    """Substring search for databases without full-text support (e.g. SQLite)"""
+
+    terms = query.split()
+    rank = Value(0)
+
+    for term in terms:
+        queryset = queryset.filter(Q(title__icontains=term) | Q(author__icontains=term))
+        rank += Case(
+            When(title__icontains=term, then=Value(2)),
+            When(author__icontains=term, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+
+    return queryset.annotate(rank=rank).order_by("-rank", "id")
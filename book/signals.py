@@ -0,0 +1,50 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from book import autocomplete
+from book.autocomplete import book_entry, publish_book_changes
+from book.cache import bump_catalog_version, record_book_changes
+from book.models import Book
+
+# sent with ``book_ids`` once copies added to the stock are committed
+books_restocked = Signal()
+
+
+def send_restocked_on_commit(book_ids: list[int]) -> None:
+    book_ids = list(book_ids)
+    transaction.on_commit(lambda: books_restocked.send(sender=Book, book_ids=book_ids))
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender: type[Book], instance: Book, **kwargs: dict) -> None:
+    """Invalidate the catalog cache and update the autocomplete index on commit"""
+
+    book_id = instance.id
+    # the stock of a striped book lives in the stripes, the index reads it back
+    entry = None if instance.is_striped else book_entry(instance)
+
+    # Book.save only records the saved stock after the signal
+    loaded = getattr(instance, "_loaded_inventory", None)
+    if loaded and loaded[0] is not None and instance.inventory > loaded[0]:
+        send_restocked_on_commit([book_id])
+
+    def saved() -> None:
+        bump_catalog_version()
+        if entry is None:
+            publish_book_changes([book_id])
+            return
+        autocomplete.book_index.upsert(entry, record_book_changes([entry]))
+
+    transaction.on_commit(saved)
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender: type[Book], instance: Book, **kwargs: dict) -> None:
+    book_id = instance.id
+
+    def deleted() -> None:
+        bump_catalog_version()
+        autocomplete.book_index.remove(book_id, record_book_changes([], [book_id]))
+
+    transaction.on_commit(deleted)
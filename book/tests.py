@@ -1,11 +1,41 @@
+import datetime
+import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from book.autocomplete import BookPrefixIndex
+from book.cache import record_book_changes
+from book.inventory import reserve_copy
 from book.models import Book
+from book.search import search_books_fallback
+from borrowing.models import Borrowing
 
 BOOKS_URL = reverse("library:book-list")
+BOOK_SEARCH_URL = reverse("library:book-search")
+BOOK_AUTOCOMPLETE_URL = reverse("library:book-autocomplete")
+BOOK_IMPORT_URL = reverse("library:book-import-catalog")
+BOOK_EXPORT_URL = reverse("library:book-export-catalog")
+BOOK_AVAILABILITY_URL = reverse("library:book-availability")
+
+
+def sample_book(**params: dict) -> Book:
+    defaults = {
+        "title": "Lion",
+        "author": "Dad",
+        "cover": "hard",
+        "inventory": 12,
+        "daily_fee": 12.08,
+    }
+    defaults.update(params)
+
+    return Book.objects.create(**defaults)
 
 
 class UnAuthenticatedBookApiTests(TestCase):
@@ -23,3 +53,298 @@ class UnAuthenticatedBookApiTests(TestCase):
         )
 
         self.assertEqual(str(book), "Lion")
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        cache.clear()
+
+    def test_cached_list_does_not_query_database(self) -> None:
+        sample_book()
+        self.client.get(BOOKS_URL)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(BOOKS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+    def test_conditional_get_returns_not_modified(self) -> None:
+        sample_book()
+        response = self.client.get(BOOKS_URL)
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(
+                BOOKS_URL, HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+
+        self.assertNotIn("Last-Modified", response)
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_striped_stock_change_is_not_answered_by_date(self) -> None:
+        book = sample_book(inventory=4, inventory_stripes=2)
+        self.client.get(BOOKS_URL)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_copy(book)
+        response = self.client.get(
+            BOOKS_URL, HTTP_IF_MODIFIED_SINCE="Fri, 01 Jan 2100 00:00:00 GMT"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]["inventory"], 3)
+
+    def test_cursor_pagination(self) -> None:
+        books = [sample_book(title=f"Book {number}") for number in range(3)]
+
+        response = self.client.get(BOOKS_URL, {"pagination": "cursor", "page_size": 2})
+
+        self.assertEqual(
+            [book["id"] for book in response.data["results"]],
+            [books[2].id, books[1].id],
+        )
+        self.assertIsNotNone(response.data["next"])
+
+    def test_book_change_invalidates_cache(self) -> None:
+        book = sample_book()
+        url = reverse("library:book-detail", kwargs={"pk": book.id})
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.inventory = 3
+            book.save()
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.data["inventory"], 3)
+
+
+class BookSearchTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        cache.clear()
+        self.by_title = sample_book(title="Wolf Hall", author="Hilary Mantel")
+        self.by_author = sample_book(title="Sea Stories", author="Virginia Wolf")
+        sample_book(title="Dune", author="Frank Herbert")
+
+    def test_search_ranks_title_matches_first(self) -> None:
+        response = self.client.get(BOOK_SEARCH_URL, {"q": "wolf"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [book["id"] for book in response.data],
+            [self.by_title.id, self.by_author.id],
+        )
+
+    def test_fallback_engine_ranks_title_matches_first(self) -> None:
+        books = search_books_fallback(Book.objects.all(), "wolf")
+
+        self.assertEqual(list(books), [self.by_title, self.by_author])
+
+    def test_search_requires_query(self) -> None:
+        response = self.client.get(BOOK_SEARCH_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BookAutocompleteTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        cache.clear()
+        patcher = mock.patch("book.autocomplete.book_index", BookPrefixIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.book = sample_book(title="Harry Potter", author="J. K. Rowling")
+        sample_book(title="Dune", author="Frank Herbert")
+
+    def test_autocomplete_matches_word_prefixes(self) -> None:
+        response = self.client.get(BOOK_AUTOCOMPLETE_URL, {"q": "pot"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data,
+            [
+                {
+                    "id": self.book.id,
+                    "title": "Harry Potter",
+                    "author": "J. K. Rowling",
+                    "inventory": 12,
+                }
+            ],
+        )
+
+    def test_autocomplete_does_not_query_database(self) -> None:
+        self.client.get(BOOK_AUTOCOMPLETE_URL, {"q": "h"})
+
+        with self.assertNumQueries(0):
+            response = self.client.get(BOOK_AUTOCOMPLETE_URL, {"q": "row"})
+
+        self.assertEqual(len(response.data), 1)
+
+    def test_index_follows_book_changes(self) -> None:
+        self.client.get(BOOK_AUTOCOMPLETE_URL, {"q": "h"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.inventory = 0
+            self.book.save()
+
+        with self.assertNumQueries(0):
+            response = self.client.get(BOOK_AUTOCOMPLETE_URL, {"q": "harry"})
+
+        self.assertEqual(response.data[0]["inventory"], 0)
+
+    def test_index_applies_changes_of_other_processes(self) -> None:
+        self.client.get(BOOK_AUTOCOMPLETE_URL, {"q": "h"})
+        dune = Book.objects.get(title="Dune")
+        record_book_changes(
+            [
+                {
+                    "id": self.book.id,
+                    "title": "Harry Potter 2",
+                    "author": "J. K. Rowling",
+                    "inventory": 12,
+                }
+            ]
+        )
+        record_book_changes([], [dune.id])
+
+        # the feed carries the entries, nothing is read back
+        with self.assertNumQueries(0):
+            response = self.client.get(BOOK_AUTOCOMPLETE_URL, {"q": "harry"})
+            removed = self.client.get(BOOK_AUTOCOMPLETE_URL, {"q": "dune"})
+
+        self.assertEqual(response.data[0]["title"], "Harry Potter 2")
+        self.assertEqual(removed.data, [])
+
+    @mock.patch("book.autocomplete.schedule_rebuild")
+    def test_stock_changes_do_not_rebuild_the_index(
+        self, schedule_rebuild: mock.Mock
+    ) -> None:
+        self.client.get(BOOK_AUTOCOMPLETE_URL, {"q": "h"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_copy(self.book)
+        response = self.client.get(BOOK_AUTOCOMPLETE_URL, {"q": "harry"})
+
+        self.assertEqual(response.data[0]["inventory"], 11)
+        schedule_rebuild.assert_not_called()
+
+    @mock.patch("book.autocomplete.schedule_rebuild")
+    def test_lost_feed_is_rebuilt_off_the_request_path(
+        self, schedule_rebuild: mock.Mock
+    ) -> None:
+        self.client.get(BOOK_AUTOCOMPLETE_URL, {"q": "h"})
+        cache.clear()
+
+        with self.assertNumQueries(0):
+            response = self.client.get(BOOK_AUTOCOMPLETE_URL, {"q": "dune"})
+
+        self.assertEqual(response.data[0]["title"], "Dune")
+        schedule_rebuild.assert_called_once_with()
+
+
+class BookBulkImportExportTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_superuser(
+            "admin@admin.com", "test_pass"
+        )
+        self.client.force_authenticate(self.admin)
+
+    def test_import_csv_creates_updates_and_reports_errors(self) -> None:
+        book = sample_book()
+        upload = SimpleUploadedFile(
+            "books.csv",
+            (
+                "id,title,author,cover,inventory,daily_fee\n"
+                ",Dune,Frank Herbert,soft,3,1.50\n"
+                f"{book.id},Lion,Dad,soft,20,2.00\n"
+                ",Free,Nobody,hard,1,-1\n"
+                ",Bad cover,Nobody,paper,1,1\n"
+            ).encode(),
+        )
+
+        response = self.client.post(BOOK_IMPORT_URL, {"file": upload})
+        book.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual(response.data["updated"], 1)
+        self.assertEqual([error["line"] for error in response.data["errors"]], [4, 5])
+        self.assertIn("daily_fee", response.data["errors"][0]["errors"])
+        self.assertEqual((book.inventory, book.cover), (20, "soft"))
+
+    def test_import_ndjson(self) -> None:
+        upload = SimpleUploadedFile(
+            "books.ndjson",
+            b'{"title": "Dune", "author": "Frank Herbert", "cover": "soft", '
+            b'"inventory": 3, "daily_fee": "1.50"}\nnot json\n',
+        )
+
+        response = self.client.post(BOOK_IMPORT_URL, {"file": upload})
+
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual(response.data["errors"][0]["line"], 2)
+
+    def test_import_requires_staff(self) -> None:
+        self.client.force_authenticate(
+            get_user_model().objects.create_user("user@user.com", "test_pass")
+        )
+        upload = SimpleUploadedFile("books.csv", b"title\n")
+
+        response = self.client.post(BOOK_IMPORT_URL, {"file": upload})
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_streams_catalogue(self) -> None:
+        book = sample_book()
+
+        response = self.client.get(BOOK_EXPORT_URL, {"type": "ndjson"})
+        rows = b"".join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(
+            json.loads(rows[0]),
+            {
+                "id": book.id,
+                "title": "Lion",
+                "author": "Dad",
+                "cover": "hard",
+                "inventory": 12,
+                "daily_fee": "12.08",
+            },
+        )
+
+
+class BookAvailabilityTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        cache.clear()
+        self.user = get_user_model().objects.create_user("user@user.com", "test_pass")
+
+    def test_availability_for_many_books_in_one_query(self) -> None:
+        book1 = sample_book(inventory=2)
+        book2 = sample_book(inventory=0)
+        Borrowing.objects.create(
+            book=book2,
+            user=self.user,
+            expected_return_date=datetime.date.today() + datetime.timedelta(days=7),
+        )
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                BOOK_AVAILABILITY_URL, {"ids": f"{book2.id},{book1.id},9999"}
+            )
+
+        self.assertEqual(
+            response.data,
+            [
+                {"id": book1.id, "inventory": 2, "active_borrowings": 0},
+                {"id": book2.id, "inventory": 0, "active_borrowings": 1},
+            ],
+        )
+
+    def test_availability_rejects_invalid_ids(self) -> None:
+        response = self.client.get(BOOK_AVAILABILITY_URL, {"ids": "1,abc"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
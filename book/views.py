@@ -1,13 +1,230 @@
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
+from rest_framework.request import Request
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
+from book.autocomplete import (
+    AUTOCOMPLETE_LIMIT,
+    AUTOCOMPLETE_MAX_LIMIT,
+    get_book_index,
+)
+from book.bulk import detect_format, export_books, import_books
+from book.cache import catalog_cache_key, get_or_set_catalog
+from book.conditional import ConditionalGetMixin
+from book.inventory import MAX_AVAILABILITY_IDS, get_availability
 from book.models import Book
 from book.permissions import IsAdminOrIfAuthenticatedReadOnly
+from book.search import SEARCH_RESULTS_LIMIT, search_books
 from book.serializers import BookSerializer
+from borrowing.pagination import CursorPaginationMixin
 
 
-class BookViewSet(ModelViewSet):
+class BookViewSet(ConditionalGetMixin, CursorPaginationMixin, ModelViewSet):
     """Book CRUD endpoints"""
 
-    queryset = Book.objects.all()
+    queryset = Book.objects.with_live_inventory()
     serializer_class = BookSerializer
     permission_classes = (IsAdminOrIfAuthenticatedReadOnly,)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "pagination",
+                type=OpenApiTypes.STR,
+                description="Keyset pagination by id (ex. ?pagination=cursor)",
+            ),
+        ]
+    )
+    def list(
+        self, request: Request, *args: tuple, **kwargs: dict
+    ) -> Response | HttpResponse:
+        """Serve serialized catalog pages from the versioned catalog cache.
+
+        The cached entry carries its ETag, so a conditional hit is answered
+        without touching the database.
+        """
+
+        key = catalog_cache_key("list", request.query_params)
+
+        def render() -> tuple:
+            # state is read before serializing: a concurrent change can only
+            # make the ETag older than the data, never newer
+            queryset = self.filter_queryset(self.get_queryset())
+            etag = self.get_conditional_state(queryset, key)
+            response = super(BookViewSet, self).list(request, *args, **kwargs)
+            return etag, response.data
+
+        etag, data = get_or_set_catalog(key, render)
+        return self.conditional_response(request, etag, lambda: Response(data))
+
+    def retrieve(
+        self, request: Request, *args: tuple, **kwargs: dict
+    ) -> Response | HttpResponse:
+        key = catalog_cache_key(f"detail:{kwargs['pk']}", request.query_params)
+
+        def render() -> tuple:
+            try:
+                queryset = self.get_queryset().filter(pk=kwargs["pk"])
+            except (TypeError, ValueError):
+                raise Http404
+            etag = self.get_conditional_state(queryset, key)
+            response = super(BookViewSet, self).retrieve(request, *args, **kwargs)
+            return etag, response.data
+
+        etag, data = get_or_set_catalog(key, render)
+        return self.conditional_response(request, etag, lambda: Response(data))
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "q",
+                type=OpenApiTypes.STR,
+                description="Search by title and author (ex. ?q=harry potter)",
+            ),
+        ]
+    )
+    @action(methods=["GET"], detail=False, url_path="search")
+    def search(self, request: Request) -> Response:
+        """Ranked full-text search over book titles and authors"""
+
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            raise ValidationError({"q": "Enter a search query."})
+
+        def search_results() -> list:
+            books = search_books(self.get_queryset(), query)[:SEARCH_RESULTS_LIMIT]
+            return self.get_serializer(books, many=True).data
+
+        data = get_or_set_catalog(
+            catalog_cache_key("search", request.query_params), search_results
+        )
+        return Response(data)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "q",
+                type=OpenApiTypes.STR,
+                description="Title or author prefix (ex. ?q=harr)",
+            ),
+            OpenApiParameter(
+                "limit",
+                type=OpenApiTypes.INT,
+                description=f"Number of suggestions, at most {AUTOCOMPLETE_MAX_LIMIT}",
+            ),
+        ]
+    )
+    @action(methods=["GET"], detail=False, url_path="autocomplete")
+    def autocomplete(self, request: Request) -> Response:
+        """Prefix suggestions served from the in-process book index"""
+
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response([])
+
+        try:
+            limit = int(request.query_params.get("limit", AUTOCOMPLETE_LIMIT))
+        except ValueError:
+            raise ValidationError({"limit": "A valid integer is required."})
+
+        limit = max(1, min(limit, AUTOCOMPLETE_MAX_LIMIT))
+        return Response(get_book_index().lookup(query, limit))
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "type",
+                type=OpenApiTypes.STR,
+                description="csv or ndjson, taken from the file name by default",
+            ),
+        ]
+    )
+    @action(
+        methods=["POST"],
+        detail=False,
+        url_path="import",
+        permission_classes=[IsAdminUser],
+        parser_classes=[MultiPartParser],
+    )
+    def import_catalog(self, request: Request) -> Response:
+        """Bulk import books from an uploaded csv or ndjson file"""
+
+        upload = request.FILES.get("file")
+        if upload is None:
+            raise ValidationError({"file": "Upload a csv or ndjson file."})
+
+        file_format = detect_format(upload.name, request.query_params.get("type"))
+        return Response(import_books(upload, file_format))
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "type",
+                type=OpenApiTypes.STR,
+                description="csv (default) or ndjson",
+            ),
+        ]
+    )
+    @action(
+        methods=["GET"],
+        detail=False,
+        url_path="export",
+        permission_classes=[IsAdminUser],
+    )
+    def export_catalog(self, request: Request) -> StreamingHttpResponse:
+        """Stream the whole catalogue as csv or ndjson"""
+
+        file_format = detect_format("", request.query_params.get("type", "csv"))
+        content_type = "text/csv" if file_format == "csv" else "application/x-ndjson"
+        response = StreamingHttpResponse(
+            export_books(file_format), content_type=content_type
+        )
+        response["Content-Disposition"] = f'attachment; filename="books.{file_format}"'
+        return response
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "ids",
+                type=OpenApiTypes.STR,
+                description=(
+                    f"Comma separated book ids, at most {MAX_AVAILABILITY_IDS} "
+                    "(ex. ?ids=1,2,3)"
+                ),
+            ),
+        ]
+    )
+    @action(methods=["GET"], detail=False, url_path="availability")
+    def availability(self, request: Request) -> Response:
+        """Inventory and active borrowings count for a batch of books"""
+
+        try:
+            book_ids = sorted(
+                {
+                    int(book_id)
+                    for value in request.query_params.getlist("ids")
+                    for book_id in value.split(",")
+                    if book_id.strip()
+                }
+            )
+        except ValueError:
+            raise ValidationError({"ids": "Enter comma separated book ids."})
+
+        if not book_ids:
+            raise ValidationError({"ids": "Enter at least one book id."})
+        if len(book_ids) > MAX_AVAILABILITY_IDS:
+            raise ValidationError(
+                {"ids": f"Ask for at most {MAX_AVAILABILITY_IDS} books at once."}
+            )
+
+        data = get_or_set_catalog(
+            catalog_cache_key("availability", {"ids": book_ids}),
+            lambda: get_availability(book_ids),
+        )
+        return Response(data)
@@ -1,6 +1,23 @@
 from django.contrib import admin
 
-from borrowing.models import Borrowing, Payment
+from borrowing.models import (
+    Borrowing,
+    DailyActivity,
+    DailyBookBorrowings,
+    DailyRevenue,
+    FineSnapshot,
+    Hold,
+    Notification,
+    Payment,
+    StripeEvent,
+)
 
 admin.site.register(Borrowing)
 admin.site.register(Payment)
+admin.site.register(Hold)
+admin.site.register(Notification)
+admin.site.register(DailyActivity)
+admin.site.register(DailyBookBorrowings)
+admin.site.register(DailyRevenue)
+admin.site.register(StripeEvent)
+admin.site.register(FineSnapshot)
@@ -0,0 +1,211 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from borrowing.models import (
+    AnalyticsWatermark,
+    Borrowing,
+    DailyActivity,
+    DailyBookBorrowings,
+    DailyRevenue,
+    Payment,
+)
+
+DAILY_AGGREGATES = "daily aggregates"
+# rows written by transactions still open at the previous refresh carry an
+# older updated_at or paid_at, the overlap picks their days up on the next run
+REFRESH_OVERLAP = datetime.timedelta(minutes=10)
+DAYS_PER_QUERY = 31
+TOP_BOOKS = 10
+
+
+def day_bounds(days: list[datetime.date]) -> tuple[datetime.datetime, ...]:
+    """Aware datetimes around ``days`` so paid_at is filtered by its index"""
+
+    start = datetime.datetime.combine(min(days), datetime.time.min)
+    end = datetime.datetime.combine(
+        max(days) + datetime.timedelta(days=1), datetime.time.min
+    )
+    return timezone.make_aware(start), timezone.make_aware(end)
+
+
+def changed_days(since: datetime.datetime | None) -> set[datetime.date]:
+    """Days whose aggregates moved since the watermark, every day when the
+    aggregates were never built"""
+
+    borrowings = Borrowing.objects.order_by()
+    payments = Payment.objects.order_by().filter(status="PAID")
+    if since is not None:
+        borrowings = borrowings.filter(updated_at__gte=since)
+        payments = payments.filter(paid_at__gte=since)
+
+    days = set(borrowings.values_list("borrow_date", flat=True).distinct())
+    days.update(
+        borrowings.filter(actual_return_date__isnull=False)
+        .values_list("actual_return_date", flat=True)
+        .distinct()
+    )
+    days.update(
+        payments.annotate(day=TruncDate("paid_at"))
+        .values_list("day", flat=True)
+        .distinct()
+    )
+    return days
+
+
+def refresh_days(days: list[datetime.date]) -> None:
+    """Rebuild the aggregates of ``days`` with one GROUP BY per table"""
+
+    borrowings = Borrowing.objects.order_by()
+    activity = {day: DailyActivity(day=day) for day in days}
+
+    for day, borrowed in (
+        borrowings.filter(borrow_date__in=days)
+        .values_list("borrow_date")
+        .annotate(Count("id"))
+    ):
+        activity[day].borrowed = borrowed
+    for day, returned, returned_late in (
+        borrowings.filter(actual_return_date__in=days)
+        .values_list("actual_return_date")
+        .annotate(
+            returned=Count("id"),
+            returned_late=Count(
+                "id", filter=Q(actual_return_date__gt=F("expected_return_date"))
+            ),
+        )
+    ):
+        activity[day].returned = returned
+        activity[day].returned_late = returned_late
+
+    DailyActivity.objects.bulk_create(
+        activity.values(),
+        update_conflicts=True,
+        unique_fields=["day"],
+        update_fields=["borrowed", "returned", "returned_late"],
+    )
+
+    DailyBookBorrowings.objects.filter(day__in=days).delete()
+    DailyBookBorrowings.objects.bulk_create(
+        DailyBookBorrowings(day=day, book_id=book_id, borrowed=borrowed)
+        for day, book_id, borrowed in borrowings.filter(borrow_date__in=days)
+        .values_list("borrow_date", "book_id")
+        .annotate(Count("id"))
+    )
+
+    DailyRevenue.objects.filter(day__in=days).delete()
+    DailyRevenue.objects.bulk_create(
+        DailyRevenue(day=day, type=payment_type, total=total, payments=count)
+        for day, payment_type, total, count in Payment.objects.order_by()
+        .filter(status="PAID", paid_at__range=day_bounds(days))
+        .annotate(day=TruncDate("paid_at"))
+        .filter(day__in=days)
+        .values_list("day", "type")
+        .annotate(Sum("money_to_pay"), Count("id"))
+    )
+
+
+def snapshot_overdue(today: datetime.date) -> None:
+    """Record the loans out and overdue now, from the partial index of
+    active borrowings"""
+
+    loans = Borrowing.objects.filter(actual_return_date__isnull=True).aggregate(
+        active=Count("id"),
+        overdue=Count("id", filter=Q(expected_return_date__lt=today)),
+    )
+    DailyActivity.objects.bulk_create(
+        [
+            DailyActivity(
+                day=today,
+                active_loans=loans["active"],
+                overdue_loans=loans["overdue"],
+            )
+        ],
+        update_conflicts=True,
+        unique_fields=["day"],
+        update_fields=["active_loans", "overdue_loans"],
+    )
+
+
+@transaction.atomic()
+def refresh_daily_aggregates() -> int:
+    """Reprocess the days touched since the last refresh and return their
+    count. The locked watermark keeps two refreshes from interleaving."""
+
+    AnalyticsWatermark.objects.get_or_create(name=DAILY_AGGREGATES)
+    watermark = AnalyticsWatermark.objects.select_for_update().get(
+        name=DAILY_AGGREGATES
+    )
+    started = timezone.now()
+    since = watermark.value and watermark.value - REFRESH_OVERLAP
+
+    days = sorted(changed_days(since))
+    for position in range(0, len(days), DAYS_PER_QUERY):
+        refresh_days(days[position : position + DAYS_PER_QUERY])
+    snapshot_overdue(timezone.localdate(started))
+
+    watermark.value = started
+    watermark.save(update_fields=["value"])
+    return len(days)
+
+
+def ratio(part: int, whole: int) -> float | None:
+    return round(part / whole, 4) if whole else None
+
+
+def analytics_report(start: datetime.date, end: datetime.date) -> dict:
+    """Dashboard figures between two days, read from the aggregates only"""
+
+    revenue = defaultdict(dict)
+    totals = defaultdict(lambda: {"total": Decimal(0), "payments": 0})
+    for day, payment_type, total, count in DailyRevenue.objects.filter(
+        day__range=(start, end)
+    ).values_list("day", "type", "total", "payments"):
+        revenue[day][payment_type] = str(total)
+        totals[payment_type]["total"] += total
+        totals[payment_type]["payments"] += count
+
+    return {
+        "days": [
+            {
+                "day": activity.day.isoformat(),
+                "borrowed": activity.borrowed,
+                "returned": activity.returned,
+                "returned_late": activity.returned_late,
+                "active_loans": activity.active_loans,
+                "overdue_loans": activity.overdue_loans,
+                "overdue_rate": ratio(activity.overdue_loans, activity.active_loans),
+                "revenue": revenue[activity.day],
+            }
+            for activity in DailyActivity.objects.filter(day__range=(start, end))
+        ],
+        "top_books": top_books(start, end),
+        "revenue": [
+            {
+                "type": payment_type,
+                "total": str(row["total"]),
+                "payments": row["payments"],
+            }
+            for payment_type, row in sorted(totals.items())
+        ],
+        "refreshed_at": refreshed_at(),
+    }
+
+
+def top_books(start: datetime.date, end: datetime.date) -> list[dict]:
+    return list(
+        DailyBookBorrowings.objects.filter(day__range=(start, end))
+        .values("book_id", title=F("book__title"))
+        .annotate(borrowed=Sum("borrowed"))
+        .order_by("-borrowed", "book_id")[:TOP_BOOKS]
+    )
+
+
+def refreshed_at() -> datetime.datetime | None:
+    watermark = AnalyticsWatermark.objects.filter(name=DAILY_AGGREGATES).first()
+    return watermark and watermark.value
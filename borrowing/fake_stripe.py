@@ -0,0 +1,227 @@
+import json
+import re
+import secrets
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qsl, urlsplit
+
+SESSION_PATH = re.compile(
+    r"^/v1/checkout/sessions/(?P<session_id>[\w-]+)(?P<expire>/expire)?$"
+)
+LINE_ITEM_KEY = re.compile(r"^line_items\[(\d+)\]\[(.+)\]$")
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    # keep-alive, so the pooling of the client can be observed
+    protocol_version = "HTTP/1.1"
+    server: "FakeStripe"
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.count("connections")
+
+    def log_message(self, *args: tuple) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self.handle_api("GET")
+
+    def do_POST(self) -> None:
+        self.handle_api("POST")
+
+    def handle_api(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode()
+        self.server.count("requests")
+
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(body if method == "POST" else url.query))
+        status, payload = self.server.respond(method, url.path, params, self.headers)
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class FakeStripe(ThreadingHTTPServer):
+    """In-process stand-in for the checkout session API of Stripe.
+
+    Point a StripeGateway at ``url`` to test or load test it offline. The
+    ``latency`` and ``fail_next`` knobs play a slow or failing Stripe.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0) -> None:
+        super().__init__(("127.0.0.1", 0), FakeStripeHandler)
+        self.latency = latency
+        self.sessions: dict[str, dict] = {}
+        # (created, id) of every session, for the list endpoint
+        self._created: list[tuple[int, str]] = []
+        self.counters = defaultdict(int)
+        self._idempotent: dict[str, tuple[int, dict]] = {}
+        self._failures: list[int] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakeStripe":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args: tuple) -> None:
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def handle_error(self, request: object, client_address: tuple) -> None:
+        # a client that timed out is gone before the answer is written
+        pass
+
+    def count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def fail_next(self, count: int, status: int = 500) -> None:
+        """Answer the next ``count`` requests with an API error"""
+
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def pay(self, session_id: str) -> dict:
+        with self._lock:
+            session = self.sessions[session_id]
+            session.update(payment_status="paid", status="complete")
+            return session
+
+    def add_session(
+        self,
+        created: Optional[int] = None,
+        session_id: Optional[str] = None,
+        **fields: dict,
+    ) -> dict:
+        """Store a session directly, to seed large listings quickly"""
+
+        with self._lock:
+            session = self.create_session({}, created, session_id)
+            session.update(fields)
+            return session
+
+    def respond(
+        self, method: str, path: str, params: dict, headers: dict
+    ) -> tuple[int, dict]:
+        time.sleep(self.latency)
+
+        if not headers.get("Authorization", "").startswith("Bearer "):
+            return 401, error("invalid_request_error", "No API key provided.")
+
+        with self._lock:
+            if self._failures:
+                status = self._failures.pop(0)
+                return status, error("api_error", "Something went wrong.")
+
+            key = headers.get("Idempotency-Key")
+            if method == "POST" and key in self._idempotent:
+                return self._idempotent[key]
+
+            if method == "POST" and path == "/v1/checkout/sessions":
+                response = 200, self.create_session(params)
+                if key:
+                    self._idempotent[key] = response
+                return response
+
+            if method == "GET" and path == "/v1/checkout/sessions":
+                return 200, self.list_sessions(params)
+
+            match = SESSION_PATH.match(path)
+            if match and (method == "POST") == bool(match["expire"]):
+                session = self.sessions.get(match["session_id"])
+                if session is None:
+                    return 404, error(
+                        "invalid_request_error",
+                        f"No such checkout.session: '{match['session_id']}'",
+                    )
+                if match["expire"]:
+                    if session["status"] != "open":
+                        return 400, error(
+                            "invalid_request_error",
+                            "Only Checkout Sessions with a status in "
+                            '["open"] can be expired.',
+                        )
+                    session["status"] = "expired"
+                return 200, session
+
+        return 404, error("invalid_request_error", f"Unrecognized request URL {path}")
+
+    def list_sessions(self, params: dict) -> dict:
+        """Newest first like Stripe, filtered by created[gte] and created[lte]"""
+
+        low = bisect_left(self._created, (int(params.get("created[gte]", 0)), ""))
+        high = bisect_right(
+            self._created, (int(params.get("created[lte]", 2**62)), "\uffff")
+        )
+        if "starting_after" in params:
+            after = self.sessions[params["starting_after"]]
+            high = min(
+                high, bisect_left(self._created, (after["created"], after["id"]))
+            )
+
+        limit = int(params.get("limit", 10))
+        found = self._created[max(low, high - limit) : high][::-1]
+        return {
+            "object": "list",
+            "url": "/v1/checkout/sessions",
+            "has_more": high - limit > low,
+            "data": [self.sessions[session_id] for _, session_id in found],
+        }
+
+    def create_session(
+        self,
+        params: dict,
+        created: Optional[int] = None,
+        session_id: Optional[str] = None,
+    ) -> dict:
+        items = defaultdict(dict)
+        for name, value in params.items():
+            match = LINE_ITEM_KEY.match(name)
+            if match:
+                items[match[1]][match[2]] = value
+
+        session_id = session_id or f"cs_test_{secrets.token_hex(12)}"
+        session = {
+            "id": session_id,
+            "object": "checkout.session",
+            "amount_total": sum(
+                int(item.get("price_data][unit_amount", 0))
+                * int(item.get("quantity", 1))
+                for item in items.values()
+            ),
+            "created": created or int(time.time()),
+            "currency": "usd",
+            "expires_at": int(params.get("expires_at", time.time() + 86400)),
+            "livemode": False,
+            "mode": params.get("mode", "payment"),
+            "payment_status": "unpaid",
+            "status": "open",
+            "success_url": params.get("success_url"),
+            "cancel_url": params.get("cancel_url"),
+            "url": f"https://checkout.stripe.com/c/pay/{session_id}",
+        }
+        self.sessions[session_id] = session
+        insort(self._created, (session["created"], session_id))
+        return session
+
+
+def error(error_type: str, message: str) -> dict:
+    return {"error": {"type": error_type, "message": message}}
@@ -0,0 +1,94 @@
+import datetime
+from decimal import Decimal
+from typing import Optional
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, QuerySet, Sum, Value
+from django.utils import timezone
+
+from borrowing.models import Borrowing, FineSnapshot
+from borrowing.pricing import fine_expression, overdue_days_expression
+
+SNAPSHOT_RETENTION = datetime.timedelta(days=90)
+TOP_USERS = 100
+CENT = Decimal("0.01")
+
+
+def money(value: Optional[Decimal]) -> str:
+    # SQLite sums the decimals without their scale
+    return str((value or Decimal(0)).quantize(CENT))
+
+
+def overdue_borrowings(as_of: datetime.date) -> QuerySet:
+    """Active borrowings due before ``as_of``, from the partial index"""
+
+    return Borrowing.objects.order_by().filter(
+        actual_return_date__isnull=True, expected_return_date__lt=as_of
+    )
+
+
+@transaction.atomic()
+def accrue_fines(as_of: Optional[datetime.date] = None) -> int:
+    """Snapshot the fine of every active overdue borrowing in one
+    INSERT ... SELECT and return the number of snapshots.
+
+    Running it again on the same day replaces the day's snapshots.
+    """
+
+    as_of = as_of or timezone.localdate()
+    rows = overdue_borrowings(as_of).values_list(
+        "id",
+        "user_id",
+        Value(as_of),
+        overdue_days_expression(as_of),
+        fine_expression(as_of),
+    )
+    sql, params = rows.query.sql_with_params()
+
+    FineSnapshot.objects.filter(as_of=as_of).delete()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FineSnapshot._meta.db_table} "
+            f"(borrowing_id, user_id, as_of, overdue_days, fine) {sql}",
+            params,
+        )
+        accrued = cursor.rowcount
+
+    FineSnapshot.objects.filter(as_of__lt=as_of - SNAPSHOT_RETENTION).delete()
+    return accrued
+
+
+def projected_fines(user_id: Optional[int] = None) -> dict:
+    """Fines of the latest snapshot in total and per user, or per borrowing
+    of a single user"""
+
+    as_of = FineSnapshot.objects.aggregate(as_of=Max("as_of"))["as_of"]
+    snapshots = FineSnapshot.objects.order_by().filter(as_of=as_of)
+    if user_id is not None:
+        snapshots = snapshots.filter(user_id=user_id)
+
+    totals = snapshots.aggregate(total=Sum("fine"), borrowings=Count("id"))
+    report = {
+        "as_of": as_of and as_of.isoformat(),
+        "total": money(totals["total"]),
+        "overdue_borrowings": totals["borrowings"],
+    }
+
+    if user_id is not None:
+        report["borrowings"] = [
+            {**row, "fine": money(row["fine"])}
+            for row in snapshots.order_by("-fine", "borrowing_id").values(
+                "borrowing_id",
+                "overdue_days",
+                "fine",
+                title=F("borrowing__book__title"),
+            )
+        ]
+    else:
+        report["users"] = [
+            {**row, "fine": money(row["fine"])}
+            for row in snapshots.values("user_id", email=F("user__email"))
+            .annotate(fine=Sum("fine"), borrowings=Count("id"))
+            .order_by("-fine", "user_id")[:TOP_USERS]
+        ]
+    return report
@@ -0,0 +1,189 @@
+import threading
+import time
+import uuid
+from typing import Callable, Iterator, Optional
+from urllib.parse import quote
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from stripe.api_requestor import APIRequestor
+from stripe.http_client import RequestsClient
+from stripe.util import convert_to_stripe_object
+
+# consecutive failures that open the circuit, and how long it stays open
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+# an outage, as opposed to Stripe rejecting the request
+OUTAGE_ERRORS = (stripe.error.APIConnectionError, stripe.error.APIError)
+
+
+class CircuitOpenError(stripe.error.APIConnectionError):
+    """Raised without calling Stripe while the circuit is open.
+
+    It is an APIConnectionError, so callers retry it like any other
+    unreachable Stripe.
+    """
+
+
+class CircuitBreaker:
+    """Fail fast after ``threshold`` consecutive outage errors, then let a
+    single trial call through every ``reset_timeout`` seconds"""
+
+    def __init__(
+        self,
+        threshold: int = BREAKER_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self.clock() - self._opened_at < self.reset_timeout:
+                return "open"
+            return "half-open"
+
+    def call(self, function: Callable, *args: tuple, **kwargs: dict) -> object:
+        self._before_call()
+        try:
+            result = function(*args, **kwargs)
+        except OUTAGE_ERRORS:
+            self._record(failed=True)
+            raise
+        except Exception:
+            # Stripe answered, a rejected request is no sign of an outage
+            self._record(failed=False)
+            raise
+        self._record(failed=False)
+        return result
+
+    def _before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self.clock() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError("Stripe is unavailable, the circuit is open.")
+            if self._trial_running:
+                raise CircuitOpenError("Stripe is unavailable, a trial call runs.")
+            self._trial_running = True
+
+    def _record(self, failed: bool) -> None:
+        with self._lock:
+            trial, self._trial_running = self._trial_running, False
+            if not failed:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if trial or self._failures >= self.threshold:
+                self._opened_at = self.clock()
+
+
+class PooledRequestsClient(RequestsClient):
+    """Stripe HTTP client sharing one keep-alive connection pool between
+    threads, with its own retry budget instead of stripe.max_network_retries"""
+
+    def __init__(
+        self,
+        connect_timeout: float,
+        read_timeout: float,
+        max_retries: int,
+        pool_size: int,
+    ) -> None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        super().__init__(timeout=(connect_timeout, read_timeout), session=session)
+        self.max_retries = max_retries
+
+    def _max_network_retries(self) -> int:
+        return self.max_retries
+
+
+class StripeGateway:
+    """The only way the service talks to the Stripe API.
+
+    Calls go through a pooled client with strict timeouts and bounded
+    retries, and a circuit breaker answers at once while Stripe is down.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        api_base: str = "https://api.stripe.com",
+        connect_timeout: float = 3,
+        read_timeout: float = 10,
+        max_retries: int = 2,
+        pool_size: int = 10,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        self.api_key = api_key
+        self.api_base = api_base
+        self.http_client = PooledRequestsClient(
+            connect_timeout, read_timeout, max_retries, pool_size
+        )
+        self.breaker = breaker or CircuitBreaker()
+
+    @classmethod
+    def from_settings(cls) -> "StripeGateway":
+        return cls(
+            api_key=settings.STRIPE_SECRET_KEY,
+            api_base=settings.STRIPE_API_BASE,
+            connect_timeout=settings.STRIPE_CONNECT_TIMEOUT,
+            read_timeout=settings.STRIPE_READ_TIMEOUT,
+            max_retries=settings.STRIPE_MAX_RETRIES,
+            pool_size=settings.STRIPE_POOL_SIZE,
+        )
+
+    def request(
+        self, method: str, url: str, params: Optional[dict] = None
+    ) -> stripe.stripe_object.StripeObject:
+        return self.breaker.call(self._send, method, url, params)
+
+    def create_session(self, **params: dict) -> stripe.checkout.Session:
+        return self.request("post", "/v1/checkout/sessions", params)
+
+    def retrieve_session(self, session_id: str) -> stripe.checkout.Session:
+        return self.request("get", f"/v1/checkout/sessions/{quote(session_id)}")
+
+    def expire_session(self, session_id: str) -> stripe.checkout.Session:
+        return self.request("post", f"/v1/checkout/sessions/{quote(session_id)}/expire")
+
+    def list_sessions(self, **params: dict) -> stripe.ListObject:
+        return self.request("get", "/v1/checkout/sessions", params)
+
+    def iter_sessions(self, **params: dict) -> Iterator[stripe.checkout.Session]:
+        """Every session matching ``params``, fetched a page at a time"""
+
+        page = self.list_sessions(**params)
+        while True:
+            yield from page.data
+            if not page.has_more or not page.data:
+                return
+            page = self.list_sessions(**params, starting_after=page.data[-1].id)
+
+    def _send(
+        self, method: str, url: str, params: Optional[dict]
+    ) -> stripe.stripe_object.StripeObject:
+        requestor = APIRequestor(
+            key=self.api_key, client=self.http_client, api_base=self.api_base
+        )
+        # the retries of a POST must not create a second session
+        headers = {"Idempotency-Key": str(uuid.uuid4())} if method == "post" else None
+        response, api_key = requestor.request(method, url, params, headers)
+        return convert_to_stripe_object(response, api_key)
+
+
+gateway = StripeGateway.from_settings()
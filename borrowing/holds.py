@@ -0,0 +1,148 @@
+import datetime
+from collections import Counter
+
+from django.contrib.auth.models import AbstractBaseUser
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from book.inventory import release_copies, reserve_copy
+from book.models import Book
+from borrowing.models import Hold
+from borrowing.telegram_notification import notify
+
+# an allocated copy not borrowed by then goes to the next in line
+ALLOCATION_TIMEOUT = datetime.timedelta(days=2)
+EXPIRE_BATCH = 500
+
+
+def place_hold(book: Book, user: AbstractBaseUser) -> Hold:
+    """Join the queue of the book; with nobody ahead and a copy still on the
+    shelf, the copy is allocated right away"""
+
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                hold = Hold.objects.create(book=book, user=user)
+        except IntegrityError:
+            raise ValidationError("You already hold this book.")
+
+        queue_is_empty = not Hold.objects.filter(
+            book=book, status=Hold.EnumStatus.WAITING, id__lt=hold.id
+        ).exists()
+        if queue_is_empty and reserve_copy(book):
+            hold.status = Hold.EnumStatus.ALLOCATED
+            hold.allocated_at = timezone.now()
+            hold.save(update_fields=["status", "allocated_at"])
+
+    return hold
+
+
+def allocate_copies(book: Book, count: int = 1) -> list[Hold]:
+    """Hand returned copies to the head of the queue and shelve the rest.
+
+    Meant to run in the transaction of the return. SKIP LOCKED lets
+    concurrent returns of the same book take the next holds in line instead
+    of waiting for each other; the users served share one notification.
+    """
+
+    holds = waiting_holds(book, count)
+    allocate_holds(book, holds)
+
+    if count > len(holds):
+        release_copies(book, count - len(holds))
+    return holds
+
+
+def waiting_holds(book: Book, count: int) -> list[Hold]:
+    """Lock the first ``count`` holds in line, skipping the ones being served"""
+
+    return list(
+        Hold.objects.select_for_update(skip_locked=True, of=("self",))
+        .select_related("user")
+        .filter(book=book, status=Hold.EnumStatus.WAITING)
+        .order_by("id")[:count]
+    )
+
+
+def allocate_holds(book: Book, holds: list[Hold]) -> None:
+    if not holds:
+        return
+
+    Hold.objects.filter(id__in=[hold.id for hold in holds]).update(
+        status=Hold.EnumStatus.ALLOCATED, allocated_at=timezone.now()
+    )
+    message = (
+        f"{book.title} is ready to be borrowed by "
+        f"{', '.join(str(hold.user) for hold in holds)}."
+    )
+    notify(message)
+
+
+@transaction.atomic()
+def allocate_shelved_copies(book: Book) -> list[Hold]:
+    """Hand copies already on the shelf, after a restock, to the queue"""
+
+    stock = (
+        Book.objects.filter(pk=book.pk)
+        .with_live_inventory()
+        .values_list("live_inventory", flat=True)
+        .first()
+    )
+    holds = []
+    for hold in waiting_holds(book, stock or 0):
+        if not reserve_copy(book):
+            break
+        holds.append(hold)
+    allocate_holds(book, holds)
+    return holds
+
+
+@transaction.atomic()
+def expire_allocations() -> int:
+    """Pass the copies allocated longer than ``ALLOCATION_TIMEOUT`` ago on to
+    the next in line, or back to the shelf. Returns the expired holds."""
+
+    stale = list(
+        Hold.objects.select_for_update(skip_locked=True)
+        .filter(
+            status=Hold.EnumStatus.ALLOCATED,
+            allocated_at__lt=timezone.now() - ALLOCATION_TIMEOUT,
+        )
+        .order_by("allocated_at")[:EXPIRE_BATCH]
+    )
+    Hold.objects.filter(id__in=[hold.id for hold in stale]).update(
+        status=Hold.EnumStatus.EXPIRED
+    )
+
+    copies = Counter(hold.book_id for hold in stale)
+    books = Book.objects.in_bulk(list(copies))
+    for book_id in sorted(copies):
+        allocate_copies(books[book_id], copies[book_id])
+    return len(stale)
+
+
+def claim_hold(book: Book, user: AbstractBaseUser) -> bool:
+    """Turn the copy allocated to the user into a borrowing"""
+
+    return bool(
+        Hold.objects.filter(
+            book=book, user=user, status=Hold.EnumStatus.ALLOCATED
+        ).update(status=Hold.EnumStatus.FULFILLED)
+    )
+
+
+@transaction.atomic()
+def cancel_hold(hold: Hold) -> None:
+    """Leave the queue; an allocated copy moves on to the next in line"""
+
+    if Hold.objects.filter(pk=hold.pk, status=Hold.EnumStatus.ALLOCATED).update(
+        status=Hold.EnumStatus.CANCELLED
+    ):
+        allocate_copies(hold.book)
+    elif not Hold.objects.filter(pk=hold.pk, status=Hold.EnumStatus.WAITING).update(
+        status=Hold.EnumStatus.CANCELLED
+    ):
+        raise ValidationError("This hold is already closed.")
+
+    hold.status = Hold.EnumStatus.CANCELLED
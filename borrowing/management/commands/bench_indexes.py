@@ -0,0 +1,199 @@
+import datetime
+import re
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError, CommandParser
+from django.db import connection, transaction
+from django.db.models import QuerySet
+
+from book.models import Book
+from borrowing.models import Borrowing, Payment
+
+BENCH_INDEXES = {
+    Borrowing: ("borrowing_active_due_idx", "borrowing_active_user_idx"),
+    Payment: ("payment_borrowing_status_idx",),
+}
+BENCH_CONSTRAINTS = {Payment: ("unique_payment_session_id",)}
+
+
+def analyze() -> None:
+    """Refresh the planner statistics of every table the hot queries touch"""
+
+    tables = (get_user_model(), Book, Borrowing, Payment)
+    with connection.cursor() as cursor:
+        cursor.execute(f"ANALYZE {', '.join(model._meta.db_table for model in tables)}")
+
+
+def hot_queries(user_id: int, borrowing_id: int) -> dict[str, QuerySet]:
+    """The filters of the borrowing views, the overdue digest and the
+    payment success endpoint"""
+
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    return {
+        "overdue digest": Borrowing.objects.filter(
+            actual_return_date__isnull=True, expected_return_date__lte=tomorrow
+        )
+        .order_by("expected_return_date", "id")
+        .values_list("book__title", "user__email")[:1000],
+        "active borrowings of a user": Borrowing.objects.filter(
+            user_id=user_id, actual_return_date__isnull=True
+        )[:5],
+        "payment by session id": Payment.objects.filter(
+            session_id=f"cs_bench_{borrowing_id}"
+        ),
+        "pending payments of a borrowing": Payment.objects.filter(
+            borrowing_id=borrowing_id, status="PENDING"
+        ),
+        "payments of a user": Payment.objects.filter(borrowing__user_id=user_id)[:5],
+    }
+
+
+class Command(BaseCommand):
+    """Django command to compare the hot query plans with and without the
+    borrowing and payment indexes"""
+
+    help = (
+        "Seed borrowings and payments in a rolled back transaction "
+        "and EXPLAIN ANALYZE the hot queries"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--rows", type=int, default=5_000_000)
+        parser.add_argument("--users", type=int, default=10_000)
+        parser.add_argument(
+            "--active-percent",
+            type=float,
+            default=2,
+            help="Share of borrowings that are not returned yet",
+        )
+
+    def handle(self, *args: tuple, **options: dict) -> None:
+        if connection.vendor != "postgresql":
+            raise CommandError("The benchmark needs PostgreSQL.")
+
+        with transaction.atomic():
+            self.drop_indexes()
+            started = time.perf_counter()
+            user_id, borrowing_id = self.seed(options)
+            self.stdout.write(
+                f"Seeded {options['rows']} borrowings and payments "
+                f"in {time.perf_counter() - started:.0f}s"
+            )
+
+            before = self.explain(user_id, borrowing_id)
+            started = time.perf_counter()
+            self.create_indexes()
+            self.stdout.write(f"Built indexes in {time.perf_counter() - started:.0f}s")
+            after = self.explain(user_id, borrowing_id)
+
+            for name in before:
+                self.stdout.write(
+                    f"{name:>32}: {before[name]:10.2f} ms -> {after[name]:8.2f} ms"
+                )
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def drop_indexes() -> None:
+        with connection.schema_editor() as editor:
+            for model, names in BENCH_INDEXES.items():
+                for index in model._meta.indexes:
+                    if index.name in names:
+                        editor.remove_index(model, index)
+            for model, names in BENCH_CONSTRAINTS.items():
+                for constraint in model._meta.constraints:
+                    if constraint.name in names:
+                        editor.remove_constraint(model, constraint)
+
+    @staticmethod
+    def create_indexes() -> None:
+        with connection.schema_editor() as editor:
+            for model, names in BENCH_INDEXES.items():
+                for index in model._meta.indexes:
+                    if index.name in names:
+                        editor.add_index(model, index)
+            for model, names in BENCH_CONSTRAINTS.items():
+                for constraint in model._meta.constraints:
+                    if constraint.name in names:
+                        editor.add_constraint(model, constraint)
+        analyze()
+
+    @staticmethod
+    def seed(options: dict) -> tuple[int, int]:
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(email=f"bench{number}@bench.com", password="!")
+            for number in range(options["users"])
+        )
+        book = Book.objects.create(
+            title="Benchmark book",
+            author="Benchmark",
+            cover="soft",
+            inventory=0,
+            daily_fee=1,
+        )
+        first_user = users[0].id
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {Borrowing._meta.db_table}
+                    (borrow_date, expected_return_date, actual_return_date,
+                     book_id, user_id, updated_at)
+                SELECT
+                    CURRENT_DATE - mod(n, 1000),
+                    CURRENT_DATE - mod(n, 1000) + 14,
+                    CASE WHEN random() * 100 < %s THEN NULL
+                         ELSE CURRENT_DATE - mod(n, 1000) + 7 END,
+                    %s,
+                    %s + mod(n, %s),
+                    now()
+                FROM generate_series(1, %s) AS n
+                """,
+                [
+                    options["active_percent"],
+                    book.id,
+                    first_user,
+                    options["users"],
+                    options["rows"],
+                ],
+            )
+            cursor.execute(
+                f"SELECT (min(id) + max(id)) / 2 FROM {Borrowing._meta.db_table} "
+                "WHERE book_id = %s",
+                [book.id],
+            )
+            borrowing_id = cursor.fetchone()[0]
+
+            cursor.execute(
+                f"""
+                INSERT INTO {Payment._meta.db_table}
+                    (status, type, borrowing_id, session_url, session_id,
+                     money_to_pay, updated_at, session_state)
+                SELECT
+                    CASE WHEN random() < 0.1 THEN 'PENDING' ELSE 'PAID' END,
+                    'PAYMENT',
+                    id,
+                    'https://checkout.stripe.com/c/pay/cs_bench_' || id,
+                    'cs_bench_' || id,
+                    14,
+                    now(),
+                    'ready'
+                FROM {Borrowing._meta.db_table}
+                WHERE book_id = %s
+                """,
+                [book.id],
+            )
+            # run the deferred foreign key checks now, an index cannot be
+            # built on a table with pending trigger events
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        analyze()
+
+        return first_user + options["users"] // 2, borrowing_id
+
+    @staticmethod
+    def explain(user_id: int, borrowing_id: int) -> dict[str, float]:
+        timings = {}
+        for name, queryset in hot_queries(user_id, borrowing_id).items():
+            plan = queryset.explain(analyze=True)
+            timings[name] = float(re.search(r"Execution Time: ([\d.]+)", plan)[1])
+        return timings
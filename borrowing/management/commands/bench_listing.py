@@ -0,0 +1,91 @@
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError, CommandParser
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from book.models import Book
+from borrowing.models import Borrowing, Payment
+from borrowing.views import BorrowingViewSet, PaymentListView
+
+LISTINGS = {
+    "borrowings": (BorrowingViewSet, BorrowingViewSet.as_view({"get": "list"})),
+    "payments": (PaymentListView, PaymentListView.as_view()),
+}
+
+
+class Command(BaseCommand):
+    """Django command to compare the fast read path of the listings with the
+    DRF serializers"""
+
+    help = "Measure requests/s of 100-row borrowing and payment pages"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--rows", type=int, default=1000)
+        parser.add_argument("--page-size", type=int, default=100)
+        parser.add_argument("--requests", type=int, default=200)
+
+    # the factory requests come from "testserver"
+    @override_settings(ALLOWED_HOSTS=["testserver"])
+    def handle(self, *args: tuple, **options: dict) -> None:
+        with transaction.atomic():
+            user = self.seed(options["rows"])
+            request = APIRequestFactory().get(
+                "/", {"pagination": "cursor", "page_size": options["page_size"]}
+            )
+            force_authenticate(request, user=user)
+
+            for name, (view_class, view) in LISTINGS.items():
+                with mock.patch.object(view_class, "use_fast_list", False):
+                    serializer_rate, expected = self.run(view, request, options)
+                fast_rate, content = self.run(view, request, options)
+
+                if content != expected:
+                    raise CommandError(f"The fast {name} listing differs")
+                self.stdout.write(
+                    f"{name:>10}: serializers {serializer_rate:7.0f} requests/s, "
+                    f"fast path {fast_rate:7.0f} requests/s "
+                    f"({fast_rate / serializer_rate:.1f}x)"
+                )
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def seed(rows: int) -> get_user_model():
+        user = get_user_model().objects.create_superuser(
+            "bench-listing@bench.com", "bench"
+        )
+        book = Book.objects.create(
+            title="Benchmark book",
+            author="Benchmark",
+            cover="soft",
+            inventory=0,
+            daily_fee=1,
+        )
+        borrowings = Borrowing.objects.bulk_create(
+            Borrowing(book=book, user=user, expected_return_date="2030-01-01")
+            for _ in range(rows)
+        )
+        Payment.objects.bulk_create(
+            Payment(
+                status="PENDING",
+                type=payment_type,
+                borrowing=borrowing,
+                session_url=f"https://checkout.stripe.com/c/pay/cs_{borrowing.id}",
+                session_id=f"cs_{borrowing.id}_{payment_type}",
+                money_to_pay=14,
+            )
+            for borrowing in borrowings
+            for payment_type in ("PAYMENT", "FINE")
+        )
+        return user
+
+    @staticmethod
+    def run(view: callable, request: object, options: dict) -> tuple[float, bytes]:
+        content = view(request).render().content
+        started = time.perf_counter()
+        for _ in range(options["requests"]):
+            view(request).render()
+        return options["requests"] / (time.perf_counter() - started), content
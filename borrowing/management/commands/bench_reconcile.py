@@ -0,0 +1,116 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError, CommandParser
+from django.db import connection, transaction
+
+from book.models import Book
+from borrowing.fake_stripe import FakeStripe
+from borrowing.gateway import StripeGateway
+from borrowing.management.commands.bench_indexes import analyze
+from borrowing.models import Borrowing, Payment
+from borrowing.payments import reconcile_payments
+from borrowing.stripe import SESSION_LIFETIME
+
+
+class Command(BaseCommand):
+    """Django command to time a reconciliation pass over pending payments
+    against the in-process fake Stripe"""
+
+    help = (
+        "Seed pending payments in a rolled back transaction "
+        "and reconcile them with a fake Stripe"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--rows", type=int, default=100_000)
+        parser.add_argument(
+            "--paid-percent",
+            type=float,
+            default=10,
+            help="Share of the pending payments whose session was paid",
+        )
+        parser.add_argument("--latency-ms", type=float, default=0)
+
+    def handle(self, *args: tuple, **options: dict) -> None:
+        if connection.vendor != "postgresql":
+            raise CommandError("The benchmark needs PostgreSQL.")
+
+        with FakeStripe(latency=options["latency_ms"] / 1000) as fake:
+            with transaction.atomic():
+                started = time.perf_counter()
+                self.seed(fake, options)
+                self.stdout.write(
+                    f"Seeded {options['rows']} pending payments "
+                    f"in {time.perf_counter() - started:.0f}s"
+                )
+
+                gateway = StripeGateway(api_key="sk_test_bench", api_base=fake.url)
+                started = time.perf_counter()
+                checked, settled = reconcile_payments(gateway, budget=float("inf"))
+                elapsed = time.perf_counter() - started
+
+                self.stdout.write(
+                    f"Checked {checked} payments and settled {settled} "
+                    f"in {elapsed:.1f}s ({checked / elapsed:.0f} payments/s) "
+                    f"with {fake.counters['requests']} Stripe requests"
+                )
+                transaction.set_rollback(True)
+
+    @staticmethod
+    def seed(fake: FakeStripe, options: dict) -> None:
+        user = get_user_model().objects.create_user("bench-reconcile@bench.com")
+        book = Book.objects.create(
+            title="Benchmark book",
+            author="Benchmark",
+            cover="soft",
+            inventory=0,
+            daily_fee=1,
+        )
+        with connection.cursor() as cursor:
+            # sessions expired evenly over the last day
+            cursor.execute(
+                f"""
+                WITH borrowings AS (
+                    INSERT INTO {Borrowing._meta.db_table}
+                        (borrow_date, expected_return_date, book_id, user_id,
+                         updated_at)
+                    SELECT CURRENT_DATE, CURRENT_DATE + 14, %s, %s, now()
+                    FROM generate_series(1, %s)
+                    RETURNING id
+                )
+                INSERT INTO {Payment._meta.db_table}
+                    (status, type, borrowing_id, session_url, session_id,
+                     money_to_pay, updated_at, session_state, session_expires_at,
+                     session_renewals)
+                SELECT
+                    'PENDING',
+                    'PAYMENT',
+                    id,
+                    'https://checkout.stripe.com/c/pay/cs_bench_' || id,
+                    'cs_bench_' || id,
+                    14,
+                    now(),
+                    'ready',
+                    now() - interval '10 minutes'
+                        - (%s - row_number() OVER (ORDER BY id))
+                        * interval '23 hours' / %s,
+                    0
+                FROM borrowings
+                """,
+                [book.id, user.id, options["rows"], options["rows"], options["rows"]],
+            )
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        analyze()
+
+        pending = Payment.objects.filter(borrowing__book=book).values_list(
+            "session_id", "session_expires_at"
+        )
+        for session_id, expires_at in pending.iterator(chunk_size=10_000):
+            paid = random.random() * 100 < options["paid_percent"]
+            fake.add_session(
+                created=int((expires_at - SESSION_LIFETIME).timestamp()),
+                session_id=session_id,
+                payment_status="paid" if paid else "unpaid",
+            )
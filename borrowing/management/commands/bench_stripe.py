@@ -0,0 +1,70 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+
+import stripe
+from django.core.management import BaseCommand, CommandParser
+
+from borrowing.fake_stripe import FakeStripe
+from borrowing.gateway import CircuitBreaker, StripeGateway
+
+
+class Command(BaseCommand):
+    """Django command to load test the Stripe gateway against the in-process
+    fake Stripe"""
+
+    help = "Measure checkout session calls/s and latency, healthy and in an outage"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--calls", type=int, default=2000)
+        parser.add_argument("--latency-ms", type=float, default=20)
+        parser.add_argument("--read-timeout", type=float, default=2)
+
+    def handle(self, *args: tuple, **options: dict) -> None:
+        with FakeStripe(latency=options["latency_ms"] / 1000) as fake:
+            gateway = StripeGateway(
+                api_key="sk_test_bench",
+                api_base=fake.url,
+                read_timeout=options["read_timeout"],
+                max_retries=0,
+                pool_size=options["threads"],
+            )
+            self.report("healthy", self.run(gateway, options))
+            self.stdout.write(
+                f"{'':>20}  {fake.counters['connections']} connections "
+                f"for {fake.counters['requests']} requests"
+            )
+
+            # every call is answered 503 after the usual latency
+            fake.fail_next(options["calls"] * 2, status=503)
+            for name, breaker in (
+                ("no breaker", CircuitBreaker(threshold=options["calls"] * 2)),
+                ("breaker", CircuitBreaker()),
+            ):
+                gateway.breaker = breaker
+                self.report(f"outage, {name}", self.run(gateway, options))
+
+    @staticmethod
+    def run(gateway: StripeGateway, options: dict) -> tuple[float, list[float]]:
+        def call(_: int) -> float:
+            started = time.perf_counter()
+            try:
+                gateway.create_session(mode="payment")
+            except stripe.error.StripeError:
+                pass
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as executor:
+            timings = list(executor.map(call, range(options["calls"])))
+        return options["calls"] / (time.perf_counter() - started), timings
+
+    def report(self, name: str, result: tuple[float, list[float]]) -> None:
+        rate, timings = result
+        percentiles = quantiles(timings, n=100)
+        self.stdout.write(
+            f"{name:>20}: {rate:8.0f} calls/s, "
+            f"p50 {percentiles[49] * 1000:7.2f} ms, "
+            f"p99 {percentiles[98] * 1000:7.2f} ms"
+        )
@@ -0,0 +1,43 @@
+from django.core.management import BaseCommand, CommandParser
+
+from borrowing.gateway import gateway
+from borrowing.models import ReconciliationCheckpoint
+from borrowing.payments import (
+    FULL_RECONCILIATION,
+    estimate_session_expiries,
+    reconcile_payments,
+)
+
+
+class Command(BaseCommand):
+    """Django command to check every pending payment against Stripe once,
+    including those behind the checkpoint of the periodic reconciliation"""
+
+    help = (
+        "Walk all pending payments from the oldest session expiry "
+        "and settle those paid on Stripe"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Start over instead of resuming an interrupted walk",
+        )
+
+    def handle(self, *args: tuple, **options: dict) -> None:
+        if options["restart"]:
+            ReconciliationCheckpoint.objects.filter(name=FULL_RECONCILIATION).delete()
+
+        estimated = estimate_session_expiries()
+        if estimated:
+            self.stdout.write(f"Estimated the expiry of {estimated} sessions")
+
+        checked, settled = reconcile_payments(
+            gateway, budget=float("inf"), name=FULL_RECONCILIATION
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Checked {checked} payments and settled {settled} paid on Stripe"
+            )
+        )
@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-18 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("borrowing", "0006_alter_borrowing_options_alter_payment_options"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="borrowing",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
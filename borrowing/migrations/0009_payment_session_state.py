@@ -0,0 +1,47 @@
+# Generated by Django 4.2 on 2026-10-18 01:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("borrowing", "0008_hold"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="session_state",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("ready", "Ready"),
+                    ("failed", "Failed"),
+                ],
+                default="ready",
+                max_length=7,
+            ),
+        ),
+        # existing payments already carry their session, new ones start pending
+        migrations.AlterField(
+            model_name="payment",
+            name="session_state",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("ready", "Ready"),
+                    ("failed", "Failed"),
+                ],
+                default="pending",
+                max_length=7,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("session_state", "pending")),
+                fields=["updated_at"],
+                name="payment_session_pending_idx",
+            ),
+        ),
+    ]
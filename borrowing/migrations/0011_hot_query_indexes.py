@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-18 01:59
+
+from django.db import migrations, models
+
+from borrowing.migration_operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+    # build the indexes without blocking writes to the busy tables
+    atomic = False
+
+    dependencies = [
+        ("borrowing", "0010_notification"),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name="borrowing",
+            index=models.Index(
+                condition=models.Q(("actual_return_date__isnull", True)),
+                fields=["expected_return_date", "id"],
+                name="borrowing_active_due_idx",
+            ),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name="borrowing",
+            index=models.Index(
+                condition=models.Q(("actual_return_date__isnull", True)),
+                fields=["user", "-id"],
+                name="borrowing_active_user_idx",
+            ),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name="payment",
+            index=models.Index(
+                fields=["borrowing", "status"], name="payment_borrowing_status_idx"
+            ),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name="payment",
+            index=models.Index(fields=["session_id"], name="payment_session_id_idx"),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 02:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("borrowing", "0011_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="checkout_id",
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 4.2 on 2026-10-18 02:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("book", "0005_book_inventory_stripes"),
+        ("borrowing", "0012_payment_checkout"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AnalyticsWatermark",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=50, primary_key=True, serialize=False),
+                ),
+                ("value", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="DailyActivity",
+            fields=[
+                ("day", models.DateField(primary_key=True, serialize=False)),
+                ("borrowed", models.PositiveIntegerField(default=0)),
+                ("returned", models.PositiveIntegerField(default=0)),
+                ("returned_late", models.PositiveIntegerField(default=0)),
+                ("active_loans", models.PositiveIntegerField(default=0)),
+                ("overdue_loans", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name_plural": "daily activity",
+                "ordering": ["day"],
+            },
+        ),
+        migrations.CreateModel(
+            name="DailyBookBorrowings",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("borrowed", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name_plural": "daily book borrowings",
+                "ordering": ["day", "book"],
+            },
+        ),
+        migrations.CreateModel(
+            name="DailyRevenue",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("type", models.CharField(max_length=7)),
+                (
+                    "total",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                ("payments", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "ordering": ["day", "type"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="dailyrevenue",
+            constraint=models.UniqueConstraint(
+                fields=("day", "type"), name="unique_daily_revenue"
+            ),
+        ),
+        migrations.AddField(
+            model_name="dailybookborrowings",
+            name="book",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="book.book",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="dailybookborrowings",
+            constraint=models.UniqueConstraint(
+                fields=("day", "book"), name="unique_daily_book"
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-18 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("borrowing", "0013_daily_aggregates"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StripeEvent",
+            fields=[
+                (
+                    "event_id",
+                    models.CharField(max_length=255, primary_key=True, serialize=False),
+                ),
+                ("type", models.CharField(max_length=255)),
+                ("payload", models.JSONField()),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+                ("processed_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "ordering": ["received_at"],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-18 02:32
+
+from django.db import migrations, models
+
+from borrowing.migration_operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+    # build the index without blocking writes to the payments
+    atomic = False
+
+    dependencies = [
+        ("borrowing", "0014_stripe_event"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReconciliationCheckpoint",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=50, primary_key=True, serialize=False),
+                ),
+                ("last_payment_id", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("status", "PENDING")),
+                fields=["id"],
+                name="payment_pending_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2 on 2026-10-18 02:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("borrowing", "0015_payment_reconciliation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FineSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("as_of", models.DateField()),
+                ("overdue_days", models.PositiveIntegerField()),
+                ("fine", models.DecimalField(decimal_places=2, max_digits=12)),
+                (
+                    "borrowing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="fine_snapshots",
+                        to="borrowing.borrowing",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["as_of", "borrowing"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="finesnapshot",
+            index=models.Index(fields=["as_of", "user"], name="fine_snapshot_user_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="finesnapshot",
+            constraint=models.UniqueConstraint(
+                fields=("as_of", "borrowing"), name="unique_fine_snapshot"
+            ),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2 on 2026-10-18 09:12
+
+import datetime
+
+from django.db import migrations, models
+
+from borrowing.migration_operations import AddIndexConcurrentlyOnPostgres
+from django.db.models import F
+
+# the default lifetime of a Stripe checkout session
+SESSION_LIFETIME = datetime.timedelta(minutes=30)
+
+
+def estimate_session_expiry(apps, schema_editor) -> None:
+    """Sessions created before the column expire half an hour after their
+    payment turned ready"""
+
+    Payment = apps.get_model("borrowing", "Payment")
+    Payment.objects.filter(
+        status="PENDING", session_state="ready", session_expires_at__isnull=True
+    ).update(session_expires_at=F("updated_at") + SESSION_LIFETIME)
+
+
+class Migration(migrations.Migration):
+    # build the index without blocking writes to the payments
+    atomic = False
+
+    dependencies = [
+        ("borrowing", "0016_fine_snapshot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="session_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="session_renewals",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(estimate_session_expiry, migrations.RunPython.noop),
+        AddIndexConcurrentlyOnPostgres(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("session_state", "ready"), ("status", "PENDING")),
+                fields=["session_expires_at"],
+                name="payment_session_expiry_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+from borrowing.migration_operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+    # build the index without blocking writes to the payments
+    atomic = False
+
+    dependencies = [
+        ("borrowing", "0017_payment_session_expiry"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="session_state",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("ready", "Ready"),
+                    ("failed", "Failed"),
+                    ("renewing", "Renewing"),
+                ],
+                default="pending",
+                max_length=8,
+            ),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("session_state", "renewing")),
+                fields=["updated_at"],
+                name="payment_session_renewing_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+from borrowing.migration_operations import (
+    AddIndexConcurrentlyOnPostgres,
+    RemoveIndexConcurrentlyOnPostgres,
+)
+
+
+class Migration(migrations.Migration):
+    # swap the indexes without blocking writes to the payments
+    atomic = False
+
+    dependencies = [
+        ("borrowing", "0018_payment_session_renewing"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="reconciliationcheckpoint",
+            name="last_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("status", "PENDING")),
+                fields=["session_expires_at", "id"],
+                name="payment_pending_expiry_idx",
+            ),
+        ),
+        RemoveIndexConcurrentlyOnPostgres(
+            model_name="payment",
+            name="payment_pending_idx",
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-18 16:05
+
+from django.db import migrations, models
+from django.db.models import F
+
+from borrowing.migration_operations import AddIndexConcurrentlyOnPostgres
+
+
+def estimate_paid_at(apps, schema_editor) -> None:
+    """Payments settled before the column were last written when paid"""
+
+    Payment = apps.get_model("borrowing", "Payment")
+    Payment.objects.filter(status="PAID", paid_at__isnull=True).update(
+        paid_at=F("updated_at")
+    )
+
+
+class Migration(migrations.Migration):
+    # build the index without blocking writes to the payments
+    atomic = False
+
+    dependencies = [
+        ("borrowing", "0019_reconciliation_by_expiry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="paid_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(estimate_paid_at, migrations.RunPython.noop),
+        AddIndexConcurrentlyOnPostgres(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("status", "PAID")),
+                fields=["paid_at"],
+                name="payment_paid_at_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+from borrowing.migration_operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+    # build the index without blocking writes to the holds
+    atomic = False
+
+    dependencies = [
+        ("borrowing", "0020_payment_paid_at"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="hold",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("waiting", "Waiting"),
+                    ("allocated", "Allocated"),
+                    ("fulfilled", "Fulfilled"),
+                    ("cancelled", "Cancelled"),
+                    ("expired", "Expired"),
+                ],
+                default="waiting",
+                max_length=9,
+            ),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name="hold",
+            index=models.Index(
+                condition=models.Q(("status", "allocated")),
+                fields=["allocated_at"],
+                name="hold_allocated_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("borrowing", "0021_hold_allocation_expiry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="claimed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2 on 2026-10-18 19:40
+
+from django.db import migrations
+
+from borrowing.pricing import borrowing_fee, fine
+
+BATCH_SIZE = 1000
+
+
+def days_charged(payment) -> int:
+    """The days the daily fee of the payment is charged for"""
+
+    borrowing = payment.borrowing
+    if payment.type == "FINE" and borrowing.actual_return_date is not None:
+        return fine(borrowing.expected_return_date, borrowing.actual_return_date, 1)
+    return borrowing_fee(borrowing.borrow_date, borrowing.expected_return_date, 1)
+
+
+def convert(apps, to_charged: bool) -> None:
+    Payment = apps.get_model("borrowing", "Payment")
+    AnalyticsWatermark = apps.get_model("borrowing", "AnalyticsWatermark")
+    payments = Payment.objects.select_related("borrowing__book").order_by("id")
+
+    batch = []
+    for payment in payments.iterator(chunk_size=BATCH_SIZE):
+        days = days_charged(payment)
+        if to_charged:
+            payment.money_to_pay *= days
+        else:
+            # a zero day charge lost the fee, the book still knows it
+            payment.money_to_pay = (
+                payment.money_to_pay / days
+                if days
+                else payment.borrowing.book.daily_fee
+            )
+        batch.append(payment)
+        if len(batch) == BATCH_SIZE:
+            Payment.objects.bulk_update(batch, ["money_to_pay"])
+            batch = []
+    Payment.objects.bulk_update(batch, ["money_to_pay"])
+    # the next refresh rebuilds the revenue of every day
+    AnalyticsWatermark.objects.filter(name="daily aggregates").update(value=None)
+
+
+def daily_fee_to_charged(apps, schema_editor) -> None:
+    """Payments stored the daily fee of the book, they store the amount
+    charged for the borrowing or its fine since"""
+
+    convert(apps, to_charged=True)
+
+
+def charged_to_daily_fee(apps, schema_editor) -> None:
+    convert(apps, to_charged=False)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("borrowing", "0022_notification_claimed_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(daily_fee_to_charged, charged_to_daily_fee),
+    ]
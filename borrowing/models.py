@@ -4,6 +4,7 @@ from typing import Optional, Type
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Q, UniqueConstraint
 
 from book.models import Book
 
@@ -18,6 +19,7 @@ class Borrowing(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name="borrowings"
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def validate_return_dates(
         self,
@@ -61,6 +63,20 @@ class Borrowing(models.Model):
 
     class Meta:
         ordering = ["-id"]
+        indexes = [
+            # overdue digest: active borrowings due by a date
+            models.Index(
+                fields=["expected_return_date", "id"],
+                condition=Q(actual_return_date__isnull=True),
+                name="borrowing_active_due_idx",
+            ),
+            # active borrowings of a user, newest first
+            models.Index(
+                fields=["user", "-id"],
+                condition=Q(actual_return_date__isnull=True),
+                name="borrowing_active_user_idx",
+            ),
+        ]
 
 
 class Payment(models.Model):
@@ -74,6 +90,13 @@ class Payment(models.Model):
         PAYMENT = "payment"
         FINE = "fine"
 
+    class EnumSessionState(models.TextChoices):
+        PENDING = "pending"
+        READY = "ready"
+        FAILED = "failed"
+        # claimed by the sweeper replacing an expiring session
+        RENEWING = "renewing"
+
     status = models.CharField(max_length=7, choices=EnumStatus.choices)
     type = models.CharField(max_length=7, choices=EnumType.choices)
     borrowing = models.ForeignKey(
@@ -81,10 +104,256 @@ class Payment(models.Model):
     )
     session_url = models.URLField(max_length=500, null=True, blank=True)
     session_id = models.CharField(max_length=500, null=True, blank=True)
+    # the Stripe session is created by a celery task after the borrowing commits
+    session_state = models.CharField(
+        max_length=8,
+        choices=EnumSessionState.choices,
+        default=EnumSessionState.PENDING,
+    )
+    # payments of one multi-book checkout share a single Stripe session
+    checkout_id = models.UUIDField(null=True, blank=True, db_index=True)
+    # Stripe closes an unpaid session after a while, the sweeper renews it
+    session_expires_at = models.DateTimeField(null=True, blank=True)
+    session_renewals = models.PositiveSmallIntegerField(default=0)
     money_to_pay = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # set once when the payment is settled, unlike updated_at
+    paid_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Payment ({self.borrowing.book.title})"
 
     class Meta:
         ordering = ["-id"]
+        indexes = [
+            models.Index(
+                fields=["updated_at"],
+                condition=Q(session_state="pending"),
+                name="payment_session_pending_idx",
+            ),
+            models.Index(
+                fields=["borrowing", "status"], name="payment_borrowing_status_idx"
+            ),
+            models.Index(fields=["session_id"], name="payment_session_id_idx"),
+            # walk of the reconciliation over pending payments by expiry
+            models.Index(
+                fields=["session_expires_at", "id"],
+                condition=Q(status="PENDING"),
+                name="payment_pending_expiry_idx",
+            ),
+            # unpaid sessions about to expire, for the renewal sweeper
+            models.Index(
+                fields=["session_expires_at"],
+                condition=Q(status="PENDING", session_state="ready"),
+                name="payment_session_expiry_idx",
+            ),
+            # claims of a renewal sweep that never finished
+            models.Index(
+                fields=["updated_at"],
+                condition=Q(session_state="renewing"),
+                name="payment_session_renewing_idx",
+            ),
+            # revenue per day of the analytics refresh
+            models.Index(
+                fields=["paid_at"],
+                condition=Q(status="PAID"),
+                name="payment_paid_at_idx",
+            ),
+        ]
+
+
+class Hold(models.Model):
+    """A place in the queue for an out of stock book"""
+
+    class EnumStatus(models.TextChoices):
+        WAITING = "waiting"
+        ALLOCATED = "allocated"
+        FULFILLED = "fulfilled"
+        CANCELLED = "cancelled"
+        # allocated but not borrowed in time
+        EXPIRED = "expired"
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="holds")
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="holds"
+    )
+    status = models.CharField(
+        max_length=9, choices=EnumStatus.choices, default=EnumStatus.WAITING
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    allocated_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.user}: {self.book.title} ({self.status})"
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(
+                fields=["book", "id"],
+                condition=Q(status="waiting"),
+                name="hold_queue_idx",
+            ),
+            # allocations of the expiry sweep
+            models.Index(
+                fields=["allocated_at"],
+                condition=Q(status="allocated"),
+                name="hold_allocated_idx",
+            ),
+        ]
+        constraints = [
+            UniqueConstraint(
+                fields=["book", "user"],
+                condition=Q(status__in=["waiting", "allocated"]),
+                name="unique_open_hold",
+                violation_error_message="You already hold this book.",
+            )
+        ]
+
+
+class Notification(models.Model):
+    """Telegram message waiting in the outbox"""
+
+    message = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # set while a dispatcher sends the message
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    # set when telegram rejects the message for good
+    error = models.TextField(blank=True)
+
+    def __str__(self) -> str:
+        return self.message[:50]
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=Q(sent_at__isnull=True, error=""),
+                name="notification_outbox_idx",
+            )
+        ]
+
+
+class DailyActivity(models.Model):
+    """Borrowings and returns of a day, refreshed by borrowing.analytics"""
+
+    day = models.DateField(primary_key=True)
+    borrowed = models.PositiveIntegerField(default=0)
+    returned = models.PositiveIntegerField(default=0)
+    returned_late = models.PositiveIntegerField(default=0)
+    # loans out at the last refresh of the day, overdue cannot be rebuilt
+    # for past days once the loans are returned
+    active_loans = models.PositiveIntegerField(default=0)
+    overdue_loans = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"Activity of {self.day}"
+
+    class Meta:
+        ordering = ["day"]
+        verbose_name_plural = "daily activity"
+
+
+class DailyBookBorrowings(models.Model):
+    """Borrowings of a book on a day, summed for the top borrowed books"""
+
+    day = models.DateField()
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="+")
+    borrowed = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"{self.book_id} on {self.day}: {self.borrowed}"
+
+    class Meta:
+        ordering = ["day", "book"]
+        verbose_name_plural = "daily book borrowings"
+        constraints = [
+            UniqueConstraint(fields=["day", "book"], name="unique_daily_book")
+        ]
+
+
+class DailyRevenue(models.Model):
+    """Money of the payments paid on a day, per payment type"""
+
+    day = models.DateField()
+    type = models.CharField(max_length=7)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    payments = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"{self.type} on {self.day}: {self.total}"
+
+    class Meta:
+        ordering = ["day", "type"]
+        constraints = [
+            UniqueConstraint(fields=["day", "type"], name="unique_daily_revenue")
+        ]
+
+
+class AnalyticsWatermark(models.Model):
+    """The time the daily aggregates were last refreshed from"""
+
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.name}: {self.value}"
+
+
+class StripeEvent(models.Model):
+    """A received Stripe webhook event, the primary key makes redeliveries
+    of an event no-ops"""
+
+    event_id = models.CharField(max_length=255, primary_key=True)
+    type = models.CharField(max_length=255)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.type} ({self.event_id})"
+
+    class Meta:
+        ordering = ["received_at"]
+
+
+class ReconciliationCheckpoint(models.Model):
+    """The last payment a reconciliation pass with Stripe went through"""
+
+    name = models.CharField(max_length=50, primary_key=True)
+    # position of the walk over the pending payments by session expiry
+    last_expires_at = models.DateTimeField(null=True, blank=True)
+    last_payment_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.name}: {self.last_payment_id}"
+
+
+class FineSnapshot(models.Model):
+    """Fine an active overdue borrowing accrued by a day, written by the
+    nightly fine engine"""
+
+    as_of = models.DateField()
+    borrowing = models.ForeignKey(
+        Borrowing, on_delete=models.CASCADE, related_name="fine_snapshots"
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+"
+    )
+    overdue_days = models.PositiveIntegerField()
+    fine = models.DecimalField(max_digits=12, decimal_places=2)
+
+    def __str__(self) -> str:
+        return f"{self.borrowing_id} on {self.as_of}: {self.fine}"
+
+    class Meta:
+        ordering = ["as_of", "borrowing"]
+        indexes = [
+            models.Index(fields=["as_of", "user"], name="fine_snapshot_user_idx")
+        ]
+        constraints = [
+            UniqueConstraint(fields=["as_of", "borrowing"], name="unique_fine_snapshot")
+        ]
@@ -1,29 +1,60 @@
 import datetime
+from typing import Iterable, Iterator
 
-from book.models import Book
 from borrowing.models import Borrowing
-from user.models import User
+from borrowing.telegram_notification import TELEGRAM_MESSAGE_LIMIT
 
+OVERDUE_CHUNK_SIZE = 2000  # rows fetched per round trip of the server-side cursor
 
-def filtering_borrowing():
-    """Filtering data"""
+
+def overdue_lines() -> Iterator[str]:
+    """One line per borrowing due by tomorrow, streamed from a single query"""
 
     permission_date = datetime.date.today() + datetime.timedelta(days=1)
-    expired_borrowings = Borrowing.objects.filter(
-        actual_return_date__isnull=True, expected_return_date__lte=permission_date
-    ).select_related("book", "user")
-
-    if expired_borrowings:
-        message = ""
-
-        for borrowing in expired_borrowings:
-            message += (
-                f"Book '{Book.objects.get(id=borrowing.book_id)}' was borrowed by user"
-                f" {User.objects.get(id=borrowing.user_id)} at "
-                f"{borrowing.borrow_date}. The book must be returned "
-                f"{borrowing.expected_return_date}\n"
-            )
-
-    else:
-        message = "No borrowings overdue today!"
-    return message
+    expired_borrowings = (
+        Borrowing.objects.filter(
+            actual_return_date__isnull=True, expected_return_date__lte=permission_date
+        )
+        .order_by("expected_return_date", "id")
+        .values_list(
+            "book__title", "user__email", "borrow_date", "expected_return_date"
+        )
+    )
+
+    for title, email, borrow_date, expected_return_date in expired_borrowings.iterator(
+        chunk_size=OVERDUE_CHUNK_SIZE
+    ):
+        yield (
+            f"Book '{title}' was borrowed by user {email} at {borrow_date}. "
+            f"The book must be returned {expected_return_date}\n"
+        )
+
+
+def chunk_lines(
+    lines: Iterable[str], limit: int = TELEGRAM_MESSAGE_LIMIT
+) -> Iterator[str]:
+    """Pack lines into messages of at most ``limit`` characters"""
+
+    parts, size = [], 0
+    for line in lines:
+        line = line[:limit]
+        if size + len(line) > limit:
+            yield "".join(parts)
+            parts, size = [], 0
+        parts.append(line)
+        size += len(line)
+
+    if parts:
+        yield "".join(parts)
+
+
+def filtering_borrowing() -> Iterator[str]:
+    """Overdue digest split into messages that fit into Telegram"""
+
+    empty = True
+    for message in chunk_lines(overdue_lines()):
+        empty = False
+        yield message
+
+    if empty:
+        yield "No borrowings overdue today!"
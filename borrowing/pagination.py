@@ -1,6 +1,185 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from collections import OrderedDict
+from typing import Optional
+
+from django.conf import settings
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.pagination import (
+    BasePagination,
+    CursorPagination,
+    PageNumberPagination,
+)
+from rest_framework.response import Response
 
 
 class OrderPagination(PageNumberPagination):
     page_size = 5
     max_page_size = 100
+
+
+def estimated_count(queryset: QuerySet) -> Optional[int]:
+    """The planner's row estimate for ``queryset``, None off PostgreSQL.
+
+    An unfiltered table reads ``reltuples`` from the catalog, a filtered
+    queryset the top row estimate of its EXPLAIN.
+    """
+
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+
+    queryset = queryset.order_by()
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            reltuples = cursor.fetchone()[0]
+            # -1 until the table is first vacuumed or analyzed
+            if reltuples >= 0:
+                return int(reltuples)
+
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class LookaheadPage(Page):
+    """A page fetched with one extra row, it knows if another page follows
+    without counting"""
+
+    def __init__(
+        self, object_list: list, number: int, paginator: Paginator, has_more: bool
+    ) -> None:
+        super().__init__(object_list, number, paginator)
+        self.has_more = has_more
+
+    def has_next(self) -> bool:
+        return self.has_more
+
+
+class EstimatedCountPaginator(Paginator):
+    """Count exactly up to ``PAGINATION_EXACT_COUNT_LIMIT`` rows, estimate
+    past it"""
+
+    def __init__(self, *args: tuple, **kwargs: dict) -> None:
+        super().__init__(*args, **kwargs)
+        self.count_estimated = False
+        # rows known to exist from the pages fetched
+        self.rows_seen = 0
+
+    @cached_property
+    def count(self) -> int:
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+
+        # stops scanning at the limit, a small listing is counted exactly
+        limit = settings.PAGINATION_EXACT_COUNT_LIMIT
+        capped = self.object_list.order_by().values("pk")[:limit].count()
+        estimate = estimated_count(self.object_list) if capped >= limit else None
+        if estimate is None:
+            return capped if capped < limit else super().count
+
+        self.count_estimated = True
+        return max(estimate, limit, self.rows_seen)
+
+    def validate_number(self, number: int | float | str) -> int:
+        """A positive page number, whether the page has rows is only known
+        once it is fetched"""
+
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger("That page number is not an integer")
+        if number < 1:
+            raise EmptyPage("That page number is less than 1")
+        return number
+
+    def page(self, number: int | float | str) -> LookaheadPage:
+        """The page fetched with one extra row, without a COUNT(*)"""
+
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom : bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage("That page contains no results")
+
+        has_more = len(rows) > self.per_page
+        self.rows_seen = bottom + len(rows)
+        if not has_more:
+            # the last page tells the exact count for free
+            self.__dict__["count"] = self.rows_seen
+        return LookaheadPage(rows[: self.per_page], number, self, has_more)
+
+
+class EstimatedCountPagination(OrderPagination):
+    """Page numbers for large tables.
+
+    ``count`` is exact below ``PAGINATION_EXACT_COUNT_LIMIT`` rows and the
+    planner estimate from there on, flagged by ``count_estimated``. ``has_next``
+    comes from fetching one row past the page.
+    """
+
+    django_paginator_class = EstimatedCountPaginator
+
+    def get_paginated_response(self, data: list) -> Response:
+        paginator = self.page.paginator
+        return Response(
+            OrderedDict(
+                [
+                    ("count", paginator.count),
+                    ("count_estimated", paginator.count_estimated),
+                    ("has_next", self.page.has_next()),
+                    ("next", self.get_next_link()),
+                    ("previous", self.get_previous_link()),
+                    ("results", data),
+                ]
+            )
+        )
+
+    def get_paginated_response_schema(self, schema: dict) -> dict:
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"]["count_estimated"] = {
+            "type": "boolean",
+            "example": False,
+        }
+        response_schema["properties"]["has_next"] = {
+            "type": "boolean",
+            "example": True,
+        }
+        return response_schema
+
+
+class OrderCursorPagination(CursorPagination):
+    """Keyset pagination over the ``-id`` ordering, no COUNT(*) and no OFFSET"""
+
+    ordering = "-id"
+    page_size = 5
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class CursorPaginationMixin:
+    """Let clients opt into keyset pagination with ``?pagination=cursor``"""
+
+    cursor_pagination_class = OrderCursorPagination
+    pagination_mode_param = "pagination"
+
+    @property
+    def paginator(self) -> Optional[BasePagination]:
+        if (
+            not hasattr(self, "_paginator")
+            and self.request is not None
+            and self.request.query_params.get(self.pagination_mode_param) == "cursor"
+        ):
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
@@ -0,0 +1,408 @@
+import datetime
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Min, Q, QuerySet
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from borrowing.gateway import StripeGateway, gateway
+from borrowing.models import Payment, ReconciliationCheckpoint, StripeEvent
+from borrowing.stats import record_paid
+from borrowing.stripe import SESSION_LIFETIME, create_stripe_session
+from borrowing.telegram_notification import notify
+
+logger = logging.getLogger(__name__)
+
+RECONCILIATION = "stripe sessions"
+# the one-off walk over every pending session, run by a management command
+FULL_RECONCILIATION = "stripe sessions full walk"
+RECONCILE_CHUNK = 1000
+# sessions expired within the span make one chunk, it bounds the listing
+RECONCILE_SPAN = datetime.timedelta(hours=1)
+# the webhook of a session that just expired may still be on its way
+RECONCILE_DELAY = datetime.timedelta(minutes=5)
+# a session expires SESSION_LIFETIME after it is created, the window of
+# the listing leaves room for clock skew
+SESSION_WINDOW_BEFORE = datetime.timedelta(minutes=1)
+SESSION_WINDOW_AFTER = datetime.timedelta(minutes=1)
+STRIPE_PAGE_SIZE = 100
+# sessions expiring before the next sweep are renewed on this one
+RENEW_MARGIN = datetime.timedelta(minutes=10)
+RENEW_BATCH = 200
+RENEW_CONCURRENCY = 8
+# longer than the task time limit, an older claim belongs to a dead sweep
+RENEW_CLAIM_TIMEOUT = datetime.timedelta(minutes=45)
+RENEWAL = "session renewal"
+# a day of 30 minute sessions, the payment link expires for good after it
+MAX_SESSION_RENEWALS = 48
+
+
+def settle_payments(payments: list[Payment]) -> None:
+    """Turn locked pending payments PAID in one UPDATE"""
+
+    now = timezone.now()
+    Payment.objects.filter(id__in=[payment.id for payment in payments]).update(
+        status="PAID", paid_at=now, updated_at=now
+    )
+    record_paid(payments)
+
+
+@transaction.atomic()
+def mark_session_paid(session_id: str) -> list[Payment]:
+    """Settle the pending payments of a paid Stripe session.
+
+    The payments of a multi-book checkout share the session. Only payments
+    still pending are settled, so a repeated confirmation is a no-op.
+    """
+
+    payments = list(
+        Payment.objects.select_for_update(of=("self",))
+        .select_related("borrowing__book")
+        .filter(session_id=session_id, status="PENDING")
+    )
+    if not payments:
+        return payments
+
+    settle_payments(payments)
+
+    titles = ", ".join(payment.borrowing.book.title for payment in payments)
+    notify(f"{titles} was paid.")
+    return payments
+
+
+# a session paid by card completes paid, delayed methods succeed later
+PAID_SESSION_EVENTS = (
+    "checkout.session.completed",
+    "checkout.session.async_payment_succeeded",
+)
+
+
+def receive_stripe_event(payload: bytes, signature: str) -> StripeEvent:
+    """Verify the signature of a webhook delivery and store its event.
+
+    Raises ValueError or stripe.error.SignatureVerificationError for a
+    delivery that does not come from Stripe.
+    """
+
+    stripe.Webhook.construct_event(payload, signature, settings.STRIPE_WEBHOOK_SECRET)
+    event = json.loads(payload)
+    stripe_event, _ = StripeEvent.objects.get_or_create(
+        event_id=event["id"], defaults={"type": event["type"], "payload": event}
+    )
+    return stripe_event
+
+
+@transaction.atomic()
+def handle_stripe_event(event_id: str) -> None:
+    """Apply a stored event once, however many times it is delivered"""
+
+    event = (
+        StripeEvent.objects.select_for_update()
+        .filter(event_id=event_id, processed_at__isnull=True)
+        .first()
+    )
+    if event is None:
+        return
+
+    session = event.payload["data"]["object"]
+    if event.type in PAID_SESSION_EVENTS and session["payment_status"] == "paid":
+        mark_session_paid(session["id"])
+
+    event.processed_at = timezone.now()
+    event.save(update_fields=["processed_at"])
+
+
+def paid_sessions(
+    stripe_gateway: StripeGateway,
+    session_ids: set[str],
+    start: datetime.datetime,
+    end: datetime.datetime,
+) -> set[str]:
+    """The paid sessions among ``session_ids``, from listing every session
+    created between ``start`` and ``end`` a page at a time"""
+
+    paid, seen = set(), set()
+    for session in stripe_gateway.iter_sessions(
+        created={"gte": int(start.timestamp()), "lte": int(end.timestamp())},
+        limit=STRIPE_PAGE_SIZE,
+    ):
+        if session.id not in session_ids:
+            continue
+        seen.add(session.id)
+        if session.payment_status == "paid":
+            paid.add(session.id)
+        if len(seen) == len(session_ids):
+            break
+    return paid
+
+
+def estimate_session_expiries() -> int:
+    """Give pending sessions stored without an expiry one estimated from
+    their last write, so the walk by expiry reaches them"""
+
+    return Payment.objects.filter(
+        status="PENDING", session_id__isnull=False, session_expires_at__isnull=True
+    ).update(session_expires_at=F("updated_at") + SESSION_LIFETIME)
+
+
+def reconcile_chunk(
+    stripe_gateway: StripeGateway = gateway,
+    now: Optional[datetime.datetime] = None,
+    name: str = RECONCILIATION,
+) -> Optional[tuple[int, int]]:
+    """Check the next chunk of expired sessions against Stripe.
+
+    A session is checked once, after it expired, in the order of expiry.
+    A walk without a checkpoint starts from the oldest pending session.
+    Returns the number of payments checked and settled, None once the
+    walk caught up with RECONCILE_DELAY before ``now``. Stripe is paged
+    without a lock, the checkpoint then moves in the same transaction as
+    the settled payments, so a crashed pass resumes where it stopped.
+    """
+
+    now = (now or timezone.now()) - RECONCILE_DELAY
+    checkpoint, _ = ReconciliationCheckpoint.objects.get_or_create(name=name)
+    start = checkpoint.last_expires_at
+    if start is None:
+        start = Payment.objects.filter(
+            status="PENDING", session_id__isnull=False
+        ).aggregate(oldest=Min("session_expires_at"))["oldest"]
+    if start is None or start >= now:
+        return None
+    after_id = checkpoint.last_payment_id if start == checkpoint.last_expires_at else 0
+
+    pending = list(
+        Payment.objects.order_by("session_expires_at", "id")
+        .filter(
+            Q(session_expires_at__gt=start)
+            | Q(session_expires_at=start, id__gt=after_id),
+            session_expires_at__lte=now,
+            status="PENDING",
+            session_id__isnull=False,
+        )
+        .values_list("id", "session_id", "session_expires_at")[:RECONCILE_CHUNK]
+    )
+    # the span starts at the next pending session, gaps of an old walk are skipped
+    end = min(pending[0][2] + RECONCILE_SPAN, now) if pending else now
+    chunk = [row for row in pending if row[2] <= end]
+    paid = set()
+    if chunk:
+        expiries = [expires_at for _, _, expires_at in chunk]
+        paid = paid_sessions(
+            stripe_gateway,
+            {session_id for _, session_id, _ in chunk},
+            min(expiries) - SESSION_LIFETIME - SESSION_WINDOW_BEFORE,
+            max(expiries) - SESSION_LIFETIME + SESSION_WINDOW_AFTER,
+        )
+
+    if len(chunk) == RECONCILE_CHUNK:
+        last_expires_at, last_payment_id = chunk[-1][2], chunk[-1][0]
+    else:
+        last_expires_at = end
+        last_payment_id = chunk[-1][0] if chunk and chunk[-1][2] == end else 0
+
+    with transaction.atomic():
+        checkpoint = ReconciliationCheckpoint.objects.select_for_update().get(name=name)
+        # a payment the webhook is settling right now is left to it
+        payments = list(
+            Payment.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("borrowing")
+            .filter(
+                id__in=[
+                    payment_id
+                    for payment_id, session_id, _ in chunk
+                    if session_id in paid
+                ],
+                status="PENDING",
+            )
+        )
+        if payments:
+            settle_payments(payments)
+            notify(f"{len(payments)} abandoned payments were found paid on Stripe.")
+
+        # an overlapping pass may be ahead already
+        if checkpoint.last_expires_at is None or (
+            checkpoint.last_expires_at,
+            checkpoint.last_payment_id,
+        ) < (last_expires_at, last_payment_id):
+            checkpoint.last_expires_at = last_expires_at
+            checkpoint.last_payment_id = last_payment_id
+            checkpoint.save()
+    return len(chunk), len(payments)
+
+
+def reconcile_payments(
+    stripe_gateway: StripeGateway = gateway,
+    budget: float = 240,
+    name: str = RECONCILIATION,
+) -> tuple[int, int]:
+    """Reconcile chunks until the walk caught up or ``budget`` seconds ran
+    out, the next run resumes from the checkpoint"""
+
+    checked = settled = 0
+    now = timezone.now()
+    deadline = time.monotonic() + budget
+    while time.monotonic() < deadline:
+        chunk = reconcile_chunk(stripe_gateway, now, name)
+        if chunk is None:
+            break
+        checked += chunk[0]
+        settled += chunk[1]
+    return checked, settled
+
+
+def expiring_sessions(now: datetime.datetime) -> QuerySet[Payment]:
+    """Pending payments whose unpaid session expires before the next sweep"""
+
+    return Payment.objects.filter(
+        status="PENDING",
+        session_state=Payment.EnumSessionState.READY,
+        session_expires_at__lt=now + RENEW_MARGIN,
+        session_renewals__lt=MAX_SESSION_RENEWALS,
+    )
+
+
+@transaction.atomic()
+def claim_expiring_sessions(now: datetime.datetime) -> dict[str, list[Payment]]:
+    """Claim a batch of expiring sessions, soonest expiry first.
+
+    Every payment of a claimed session turns RENEWING, so a multi-book
+    checkout is renewed as a whole. The claim commits before Stripe is
+    called, the webhook never waits on the sweep.
+    """
+
+    # the checkpoint row only serializes the claims of overlapping sweeps
+    ReconciliationCheckpoint.objects.get_or_create(name=RENEWAL)
+    ReconciliationCheckpoint.objects.select_for_update().get(name=RENEWAL)
+
+    # claims of a sweep that died, whose old session may be expired already
+    Payment.objects.filter(
+        session_state=Payment.EnumSessionState.RENEWING,
+        updated_at__lt=now - RENEW_CLAIM_TIMEOUT,
+    ).update(session_state=Payment.EnumSessionState.READY, updated_at=now)
+
+    session_ids = list(
+        dict.fromkeys(
+            expiring_sessions(now)
+            .order_by("session_expires_at", "id")
+            .values_list("session_id", flat=True)[:RENEW_BATCH]
+        )
+    )
+    Payment.objects.filter(
+        session_id__in=session_ids,
+        status="PENDING",
+        session_state=Payment.EnumSessionState.READY,
+    ).update(session_state=Payment.EnumSessionState.RENEWING, updated_at=now)
+
+    sessions: dict[str, list[Payment]] = {}
+    for payment in (
+        Payment.objects.select_related("borrowing__book")
+        .filter(
+            session_id__in=session_ids,
+            session_state=Payment.EnumSessionState.RENEWING,
+        )
+        .order_by("id")
+    ):
+        sessions.setdefault(payment.session_id, []).append(payment)
+    return sessions
+
+
+def renew_session(
+    stripe_gateway: StripeGateway, session_id: str, payments: list[Payment]
+) -> tuple[Optional[tuple[str, str, datetime.datetime]], bool]:
+    """A new session for the payments of an expiring one, and whether the
+    old session is closed.
+
+    The old session is expired first, so it cannot be paid next to the new
+    one. No new session when it was paid meanwhile or Stripe failed, the
+    next sweep tries again.
+    """
+
+    try:
+        try:
+            stripe_gateway.expire_session(session_id)
+        except stripe.error.InvalidRequestError:
+            # only an open session can be expired, a paid one is left to
+            # the webhook
+            if stripe_gateway.retrieve_session(session_id).status != "expired":
+                return None, False
+    except stripe.error.StripeError:
+        logger.warning("Session %s not expired", session_id, exc_info=True)
+        return None, False
+
+    try:
+        session = create_stripe_session(
+            [payment.borrowing for payment in payments],
+            act_ret_date=(
+                payments[0].borrowing.actual_return_date
+                if payments[0].type == "FINE"
+                else None
+            ),
+            stripe_gateway=stripe_gateway,
+        )
+    except stripe.error.StripeError:
+        logger.warning("Session %s not renewed", session_id, exc_info=True)
+        return None, True
+
+    return (None if isinstance(session, ValidationError) else session), True
+
+
+@transaction.atomic()
+def finish_renewal(
+    session_id: str,
+    session: Optional[tuple[str, str, datetime.datetime]],
+    closed: bool,
+) -> None:
+    """Point the claimed payments to their new session, or hand them back
+    to the next sweep"""
+
+    now = timezone.now()
+    claimed = Payment.objects.filter(
+        session_id=session_id, session_state=Payment.EnumSessionState.RENEWING
+    )
+    if session is not None:
+        session_url, new_session_id, expires_at = session
+        claimed.filter(status="PENDING").update(
+            session_url=session_url,
+            session_id=new_session_id,
+            session_expires_at=expires_at,
+            session_state=Payment.EnumSessionState.READY,
+            session_renewals=F("session_renewals") + 1,
+            updated_at=now,
+        )
+
+    update = {"session_state": Payment.EnumSessionState.READY, "updated_at": now}
+    if closed and session is None:
+        # the stored link is dead, the cancel endpoint must not hand it out
+        update["session_expires_at"] = now
+    claimed.update(**update)
+
+
+def renew_expiring_sessions(stripe_gateway: StripeGateway = gateway) -> int:
+    """Replace a batch of expiring unpaid sessions.
+
+    Stripe is called from a small thread pool outside of any transaction,
+    each session is committed as soon as it is renewed.
+    """
+
+    sessions = claim_expiring_sessions(timezone.now())
+    renewed = 0
+    with ThreadPoolExecutor(max_workers=RENEW_CONCURRENCY) as executor:
+        futures = {}
+        for session_id, payments in sessions.items():
+            future = executor.submit(
+                renew_session, stripe_gateway, session_id, payments
+            )
+            futures[future] = session_id
+        for future in as_completed(futures):
+            session, closed = future.result()
+            finish_renewal(futures[future], session, closed)
+            renewed += session is not None
+    return renewed
@@ -0,0 +1,72 @@
+"""Borrowing fee and fine formulas.
+
+Each formula exists twice: for one borrowing in Python and as a database
+expression for the batch fine engine. Both multiply the same integer day
+count by the 2-decimal daily fee, so they agree to the cent.
+"""
+
+from datetime import date
+from decimal import Decimal
+
+from django.db.models import (
+    Case,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    Func,
+    IntegerField,
+    Value,
+    When,
+)
+
+FINE_MULTIPLIER = 2  # fine coefficient for overdue days
+
+
+def borrowing_fee(
+    borrow_date: date, expected_return_date: date, daily_fee: Decimal
+) -> Decimal:
+    return (expected_return_date - borrow_date).days * daily_fee
+
+
+def overdue_days(expected_return_date: date, return_date: date) -> int:
+    return max((return_date - expected_return_date).days, 0)
+
+
+def fine(expected_return_date: date, return_date: date, daily_fee: Decimal) -> Decimal:
+    """The fine of a book returned on ``return_date``, zero when in time"""
+
+    return FINE_MULTIPLIER * overdue_days(expected_return_date, return_date) * daily_fee
+
+
+class DaysBetween(Func):
+    """Whole days from the second date to the first, date minus date is an
+    integer on PostgreSQL"""
+
+    arg_joiner = " - "
+    template = "(%(expressions)s)"
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # SQLite stores dates as text, julianday() makes them day numbers
+        return self.as_sql(
+            compiler,
+            connection,
+            template="CAST(julianday(%(expressions)s) AS INTEGER)",
+            arg_joiner=") - julianday(",
+            **extra_context,
+        )
+
+
+def overdue_days_expression(as_of: date) -> Case:
+    days = DaysBetween(Value(as_of), F("expected_return_date"))
+    return Case(When(expected_return_date__lt=as_of, then=days), default=Value(0))
+
+
+def fine_expression(as_of: date) -> ExpressionWrapper:
+    """fine() of every row as of ``as_of``, for borrowings with the book
+    joined in"""
+
+    return ExpressionWrapper(
+        FINE_MULTIPLIER * overdue_days_expression(as_of) * F("book__daily_fee"),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
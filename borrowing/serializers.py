@@ -1,14 +1,23 @@
-import asyncio
 import datetime
+import uuid
+from collections import Counter, defaultdict
+from decimal import Decimal
+from typing import Iterable, Optional
 
 from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
+from book.inventory import reserve_copy
+from book.models import Book
 from book.serializers import BookSerializer
-from borrowing.models import Borrowing, Payment
-from borrowing.stripe import create_stripe_session
-from borrowing.telegram_notification import send_message
+from borrowing.holds import allocate_copies, claim_hold, place_hold
+from borrowing.models import Borrowing, Hold, Payment
+from borrowing.stats import record_borrowings, record_returns
+from borrowing.stripe import amount_to_pay
+from borrowing.tasks import enqueue_payment_session
+from borrowing.telegram_notification import notify
 from user.serializers import UserSerializer
 
 
@@ -22,6 +31,7 @@ class PaymentSerializer(serializers.ModelSerializer):
             "type",
             "session_url",
             "session_id",
+            "session_state",
             "money_to_pay",
         )
 
@@ -52,6 +62,62 @@ class BorrowingListSerializer(BorrowingSerializer):
     payments = PaymentSerializer(many=True, read_only=True)
 
 
+# fast read path: the JSON of PaymentSerializer and BorrowingListSerializer
+# built straight from database rows, without per-field to_representation calls
+
+BORROWING_LIST_VALUES = (
+    "id",
+    "borrow_date",
+    "expected_return_date",
+    "actual_return_date",
+    "book__title",
+    "user__email",
+)
+MONEY_QUANTUM = Decimal("0.01")
+
+
+def iso_date(value: Optional[datetime.date]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def payment_rows(rows: Iterable[dict]) -> list[dict]:
+    """PaymentSerializer output for ``.values(*PaymentSerializer.Meta.fields)``"""
+
+    payments = []
+    for row in rows:
+        # values() keeps the field order of the serializer
+        row["money_to_pay"] = f"{row['money_to_pay'].quantize(MONEY_QUANTUM):f}"
+        payments.append(row)
+    return payments
+
+
+def borrowing_list_rows(rows: Iterable[dict]) -> list[dict]:
+    """BorrowingListSerializer output for ``.values(*BORROWING_LIST_VALUES)``,
+    with the payments of the whole page fetched in one query"""
+
+    rows = list(rows)
+    payments = defaultdict(list)
+    for payment in payment_rows(
+        Payment.objects.filter(borrowing_id__in=[row["id"] for row in rows]).values(
+            *PaymentSerializer.Meta.fields
+        )
+    ):
+        payments[payment["borrowing"]].append(payment)
+
+    return [
+        {
+            "id": row["id"],
+            "borrow_date": iso_date(row["borrow_date"]),
+            "expected_return_date": iso_date(row["expected_return_date"]),
+            "actual_return_date": iso_date(row["actual_return_date"]),
+            "book": row["book__title"],
+            "user": row["user__email"],
+            "payments": payments[row["id"]],
+        }
+        for row in rows
+    ]
+
+
 class BorrowingCreateSerializer(BorrowingSerializer):
     def validate_expected_return_date(
         self, value: datetime.date
@@ -65,36 +131,33 @@ class BorrowingCreateSerializer(BorrowingSerializer):
 
     @transaction.atomic()
     def create(self, validated_data: dict) -> Borrowing:
-        # update book_inventory
+        # take the copy allocated by a hold, or reserve one from the shelf
         book = validated_data.get("book")
-        if book.inventory == 0:
-            raise serializers.ValidationError("This book is currently out of stock.")
-
-        book.inventory -= 1
-        book.save()
+        if not claim_hold(book, validated_data.get("user")) and not reserve_copy(book):
+            raise serializers.ValidationError(
+                "This book is currently out of stock. Place a hold to get the "
+                "next returned copy."
+            )
 
         # create book
         borrowing = Borrowing.objects.create(**validated_data)
 
-        # getting session_url & session_id
-        session_url, session_id = create_stripe_session(borrowing)
-
-        # create payment
-        Payment.objects.create(
+        # create payment, its stripe session is created once the borrowing commits
+        payment = Payment.objects.create(
             status="PENDING",
             type="PAYMENT",
             borrowing=borrowing,
-            session_url=session_url,
-            session_id=session_id,
-            money_to_pay=book.daily_fee,
+            money_to_pay=amount_to_pay(borrowing),
         )
+        transaction.on_commit(lambda: enqueue_payment_session(payment.id))
+        record_borrowings(borrowing.user_id)
 
         # sending message via telegram bot
         message = (
             f"{book.title} was borrowed by the user "
             f"{validated_data.get('user')}. Expected return date {validated_data.get('expected_return_date')}"
         )
-        asyncio.run(send_message(message=message))
+        notify(message)
 
         return borrowing
 
@@ -103,6 +166,83 @@ class BorrowingCreateSerializer(BorrowingSerializer):
         fields = ("expected_return_date", "book")
 
 
+MAX_CHECKOUT_BOOKS = 10
+
+
+class BorrowingCheckoutSerializer(serializers.Serializer):
+    """Borrow several books at once, paid with a single Stripe session"""
+
+    books = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=MAX_CHECKOUT_BOOKS,
+    )
+    expected_return_date = serializers.DateField()
+
+    def validate_expected_return_date(
+        self, value: datetime.date
+    ) -> ValidationError | datetime.date:
+        return BorrowingCreateSerializer.validate_expected_return_date(self, value)
+
+    def validate_books(self, value: list[int]) -> list[Book]:
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError("Every book can be borrowed once.")
+
+        # one query for the whole cart
+        books = Book.objects.in_bulk(value)
+        missing = [book_id for book_id in value if book_id not in books]
+        if missing:
+            raise serializers.ValidationError(f"Unknown books: {missing}.")
+
+        # reserve in id order, so concurrent carts take the row locks alike
+        return [books[book_id] for book_id in sorted(value)]
+
+    @transaction.atomic()
+    def create(self, validated_data: dict) -> list[Borrowing]:
+        books = validated_data["books"]
+        user = validated_data["user"]
+        expected_return_date = validated_data["expected_return_date"]
+
+        # all or nothing: an unavailable book rolls back every reservation
+        out_of_stock = [
+            book.title
+            for book in books
+            if not claim_hold(book, user) and not reserve_copy(book)
+        ]
+        if out_of_stock:
+            raise serializers.ValidationError(
+                {"books": f"Out of stock: {', '.join(out_of_stock)}."}
+            )
+
+        # the cart is validated above, skip the per-row full_clean of save()
+        borrowings = Borrowing.objects.bulk_create(
+            Borrowing(book=book, user=user, expected_return_date=expected_return_date)
+            for book in books
+        )
+
+        checkout_id = uuid.uuid4()
+        payments = Payment.objects.bulk_create(
+            Payment(
+                status="PENDING",
+                type="PAYMENT",
+                borrowing=borrowing,
+                checkout_id=checkout_id,
+                money_to_pay=amount_to_pay(borrowing),
+            )
+            for borrowing in borrowings
+        )
+        transaction.on_commit(lambda: enqueue_payment_session(payments[0].id))
+        record_borrowings(user.id, len(borrowings))
+
+        message = (
+            f"{', '.join(book.title for book in books)} were borrowed by the user "
+            f"{user}. Expected return date {expected_return_date}"
+        )
+        notify(message)
+
+        return borrowings
+
+
 class BorrowingDetailSerializer(BorrowingSerializer):
     book = BookSerializer(many=False, read_only=True)
     user = UserSerializer(many=False, read_only=True)
@@ -125,27 +265,32 @@ class BorrowingReturnSerializer(BorrowingSerializer):
 
     @transaction.atomic()
     def update(self, instance: Borrowing, validated_data: dict) -> Borrowing:
-        if instance.actual_return_date is not None:
+        return_date = validated_data.get("actual_return_date")
+
+        # guarded transition: only one of concurrent returns can close the borrowing
+        returned = Borrowing.objects.filter(
+            pk=instance.pk, actual_return_date__isnull=True
+        ).update(actual_return_date=return_date, updated_at=timezone.now())
+        if not returned:
             raise serializers.ValidationError(
                 "It is not possible to donate the same book twice."
             )
 
-        instance.book.inventory += 1
-        instance.book.save()
-
-        return_date = validated_data.get("actual_return_date")
+        # the returned copy goes to the first hold in line, if any
+        allocate_copies(instance.book)
 
+        fine = Decimal(0)
         if return_date > instance.expected_return_date:
-            payment = (
-                instance.payments.first()
-            )  # update existing payment for this borrowing
-            session_url, session_id = create_stripe_session(
-                instance, act_ret_date=return_date
-            )  # create new session for fine
-            payment.session_url = session_url
-            payment.session_id = session_id
-            payment.type = "FINE"
-            payment.save()
+            # the fine is a payment of its own, the borrowing fee stays as is
+            payment = Payment.objects.create(
+                status="PENDING",
+                type="FINE",
+                borrowing=instance,
+                money_to_pay=amount_to_pay(instance, return_date),
+            )
+            fine = payment.money_to_pay
+            # the session for the fine is created after commit
+            transaction.on_commit(lambda: enqueue_payment_session(payment.id))
 
             # sending message about fine via telegram bot
             message = (
@@ -153,11 +298,164 @@ class BorrowingReturnSerializer(BorrowingSerializer):
                 f"{instance.user}. Unfortunately, you returned the book at the wrong time. "
                 "Please pay the fine"
             )
-            asyncio.run(send_message(message=message))
+            notify(message)
 
-        borrowing = super().update(instance, validated_data)
-        return borrowing
+        record_returns(instance.user_id, fines=fine)
+
+        instance.actual_return_date = return_date
+        return instance
 
     class Meta:
         model = Borrowing
         fields = ("id", "actual_return_date")
+
+
+MAX_BULK_RETURN = 500
+
+
+class BorrowingBulkReturnSerializer(serializers.Serializer):
+    """Desk check-in of a stack of returned books"""
+
+    borrowings = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=MAX_BULK_RETURN,
+    )
+    actual_return_date = serializers.DateField()
+
+    def validate_actual_return_date(
+        self, value: datetime.date
+    ) -> ValidationError | datetime.date:
+        return BorrowingReturnSerializer.validate_actual_return_date(self, value)
+
+    @transaction.atomic()
+    def create(self, validated_data: dict) -> list[dict]:
+        borrowing_ids = list(dict.fromkeys(validated_data["borrowings"]))
+        return_date = validated_data["actual_return_date"]
+
+        # lock the open borrowings: concurrent returns of the same rows wait
+        # and then find them closed
+        open_borrowings = list(
+            Borrowing.objects.select_for_update(of=("self",))
+            .filter(id__in=borrowing_ids, actual_return_date__isnull=True)
+            .select_related("book", "user")
+        )
+        Borrowing.objects.filter(
+            id__in=[borrowing.id for borrowing in open_borrowings]
+        ).update(actual_return_date=return_date, updated_at=timezone.now())
+
+        # one aggregated inventory update (or hold allocation) per book
+        books = {borrowing.book_id: borrowing.book for borrowing in open_borrowings}
+        copies = Counter(borrowing.book_id for borrowing in open_borrowings)
+        for book_id in sorted(copies):
+            allocate_copies(books[book_id], copies[book_id])
+
+        overdue = [
+            borrowing
+            for borrowing in open_borrowings
+            if return_date > borrowing.expected_return_date
+        ]
+        fines = self.charge_fines(overdue, return_date)
+
+        returns = Counter(borrowing.user_id for borrowing in open_borrowings)
+        for user_id in sorted(returns):
+            record_returns(user_id, returns[user_id], fines[user_id])
+
+        returned = {borrowing.id for borrowing in open_borrowings}
+        fined = {borrowing.id for borrowing in overdue}
+        known = set(
+            Borrowing.objects.filter(id__in=borrowing_ids).values_list("id", flat=True)
+        )
+        return [
+            {
+                "id": borrowing_id,
+                "status": (
+                    "returned"
+                    if borrowing_id in returned
+                    else "already returned"
+                    if borrowing_id in known
+                    else "not found"
+                ),
+                "fine": borrowing_id in fined,
+            }
+            for borrowing_id in borrowing_ids
+        ]
+
+    @staticmethod
+    def charge_fines(
+        overdue: list[Borrowing], return_date: datetime.date
+    ) -> defaultdict[int, Decimal]:
+        """Charge a fine payment for every overdue borrowing, the sessions
+        are created after commit. Returns the fines per user."""
+
+        fines = defaultdict(Decimal)
+        if not overdue:
+            return fines
+
+        payments = Payment.objects.bulk_create(
+            Payment(
+                status="PENDING",
+                type="FINE",
+                borrowing=borrowing,
+                money_to_pay=amount_to_pay(borrowing, return_date),
+            )
+            for borrowing in overdue
+        )
+        for payment in payments:
+            fines[payment.borrowing.user_id] += payment.money_to_pay
+        payment_ids = [payment.id for payment in payments]
+
+        def enqueue_fines() -> None:
+            for payment_id in payment_ids:
+                enqueue_payment_session(payment_id)
+
+        transaction.on_commit(enqueue_fines)
+
+        message = (
+            "Books returned at the wrong time, please pay the fine:\n"
+            + "\n".join(
+                f"{borrowing.book.title} borrowed by the user {borrowing.user}"
+                for borrowing in overdue
+            )
+        )
+        notify(message)
+        return fines
+
+
+class HoldSerializer(serializers.ModelSerializer):
+    book = serializers.SlugRelatedField(read_only=True, slug_field="title")
+    position = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Hold
+        fields = ("id", "book", "status", "position", "created_at", "allocated_at")
+
+
+class HoldCreateSerializer(serializers.ModelSerializer):
+    def create(self, validated_data: dict) -> Hold:
+        return place_hold(validated_data["book"], validated_data["user"])
+
+    class Meta:
+        model = Hold
+        fields = ("id", "book")
+
+
+ANALYTICS_DAYS = 30
+MAX_ANALYTICS_DAYS = 366
+
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, attrs: dict) -> dict:
+        end = attrs.get("end") or timezone.localdate()
+        start = attrs.get("start") or end - datetime.timedelta(days=ANALYTICS_DAYS - 1)
+
+        if start > end:
+            raise ValidationError({"start": "The start must not be after the end."})
+        if (end - start).days >= MAX_ANALYTICS_DAYS:
+            raise ValidationError(
+                {"start": f"Ask for at most {MAX_ANALYTICS_DAYS} days at once."}
+            )
+        return {"start": start, "end": end}
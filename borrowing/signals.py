@@ -0,0 +1,17 @@
+from django.dispatch import receiver
+
+from book.models import Book
+from book.signals import books_restocked
+from borrowing.holds import allocate_shelved_copies
+from borrowing.models import Hold
+
+
+@receiver(books_restocked)
+def allocate_restocked(sender: type[Book], book_ids: list[int], **kwargs: dict) -> None:
+    """Serve the holds waiting for books that got new copies"""
+
+    books = Book.objects.filter(
+        id__in=book_ids, holds__status=Hold.EnumStatus.WAITING
+    ).distinct()
+    for book in books.order_by("id"):
+        allocate_shelved_copies(book)
@@ -0,0 +1,53 @@
+from collections import defaultdict
+from decimal import Decimal
+from typing import Iterable
+
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from borrowing.models import Payment
+from user.models import UserBorrowingStats
+
+
+def bump_stats(user_id: int, **deltas: int | Decimal) -> None:
+    """Add ``deltas`` to the counters of a user in one UPDATE, creating the
+    row on the first change.
+
+    Counters stop at zero, borrowings written around these helpers (admin,
+    fixtures) must not push them negative.
+    """
+
+    changes = {
+        field: Greatest(F(field) + delta, Value(0))
+        for field, delta in deltas.items()
+        if delta
+    }
+    if not changes:
+        return
+
+    stats = UserBorrowingStats.objects.filter(user_id=user_id)
+    if not stats.update(**changes):
+        UserBorrowingStats.objects.get_or_create(user_id=user_id)
+        stats.update(**changes)
+
+
+def record_borrowings(user_id: int, count: int = 1) -> None:
+    bump_stats(user_id, active_loans=count)
+
+
+def record_returns(user_id: int, count: int = 1, fines: Decimal = 0) -> None:
+    bump_stats(user_id, active_loans=-count, outstanding_fines=fines)
+
+
+def record_paid(payments: Iterable[Payment]) -> None:
+    """Count payments that just turned PAID, fines stop being outstanding"""
+
+    paid, fines = defaultdict(Decimal), defaultdict(Decimal)
+    for payment in payments:
+        user_id = payment.borrowing.user_id
+        paid[user_id] += payment.money_to_pay
+        if payment.type == "FINE":
+            fines[user_id] += payment.money_to_pay
+
+    for user_id in paid:
+        bump_stats(user_id, total_paid=paid[user_id], outstanding_fines=-fines[user_id])
@@ -1,53 +1,75 @@
 import time
-from datetime import date
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
 from typing import Tuple, Optional
 
-import stripe
-from django.conf import settings
 from rest_framework.exceptions import ValidationError
+
+from borrowing.gateway import StripeGateway, gateway
 from borrowing.models import Borrowing
+from borrowing.pricing import borrowing_fee, fine
+
+SESSION_LIFETIME = timedelta(minutes=30)
+
+
+def amount_to_pay(borrowing: Borrowing, act_ret_date: Optional[date] = None) -> Decimal:
+    """The borrowing fee, or the fine when returned after the expected date"""
+
+    if act_ret_date is not None and act_ret_date > borrowing.expected_return_date:
+        return fine(
+            borrowing.expected_return_date, act_ret_date, borrowing.book.daily_fee
+        )
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-FINE_MULTIPLIER = 2  # fine coefficient for overdue days
+    return borrowing_fee(
+        borrowing.borrow_date,
+        borrowing.expected_return_date,
+        borrowing.book.daily_fee,
+    )
+
+
+def line_item(borrowing: Borrowing, act_ret_date: Optional[date] = None) -> dict:
+    to_pay = amount_to_pay(borrowing, act_ret_date)
+
+    return {
+        "price_data": {
+            "currency": "usd",
+            "unit_amount": int(to_pay * 100),
+            "product_data": {
+                "name": borrowing.book.title,
+                "description": "Book borrowing fee",
+            },
+        },
+        "quantity": 1,
+    }
 
 
 def create_stripe_session(
-    borrowing: Borrowing, act_ret_date: Optional[date] = None
-) -> Tuple[str, str] | ValidationError:
-    if stripe.api_key:
-        expiration_time = int(time.time()) + (
-            30 * 60
+    borrowing: Borrowing | list[Borrowing],
+    act_ret_date: Optional[date] = None,
+    stripe_gateway: Optional[StripeGateway] = None,
+) -> Tuple[str, str, datetime] | ValidationError:
+    """Checkout session for one borrowing, or one session with a line item
+    per borrowing of a multi-book checkout"""
+
+    stripe_gateway = stripe_gateway or gateway
+    if stripe_gateway.api_key:
+        expiration_time = int(
+            time.time() + SESSION_LIFETIME.total_seconds()
         )  # Set expiration time to 30 minutes from now
 
-        to_pay = (
-            borrowing.expected_return_date - borrowing.borrow_date
-        ).days * borrowing.book.daily_fee
-
-        if act_ret_date is not None and act_ret_date > borrowing.expected_return_date:
-            count_fine_days = (act_ret_date - borrowing.expected_return_date).days
-            to_pay = FINE_MULTIPLIER * count_fine_days * borrowing.book.daily_fee
-
-        correct_url = "http://0.0.0.0:8000/api/library/borrowings/" + str(borrowing.id)
-
-        checkout_session = stripe.checkout.Session.create(
-            line_items=[
-                {
-                    "price_data": {
-                        "currency": "usd",
-                        "unit_amount": int(to_pay * 100),
-                        "product_data": {
-                            "name": borrowing.book.title,
-                            "description": "Book borrowing fee",
-                        },
-                    },
-                    "quantity": 1,
-                }
-            ],
+        borrowings = borrowing if isinstance(borrowing, list) else [borrowing]
+        correct_url = "http://0.0.0.0:8000/api/library/borrowings/" + str(
+            borrowings[0].id
+        )
+
+        checkout_session = stripe_gateway.create_session(
+            line_items=[line_item(item, act_ret_date) for item in borrowings],
             mode="payment",
             success_url=correct_url + "/success?session_id={CHECKOUT_SESSION_ID}",
             cancel_url=correct_url + "/cancel?session_id={CHECKOUT_SESSION_ID}",
             expires_at=expiration_time,
         )
-        return checkout_session.url, checkout_session.id
+        expires_at = datetime.fromtimestamp(checkout_session.expires_at, timezone.utc)
+        return checkout_session.url, checkout_session.id, expires_at
 
     return ValidationError("Stripe is unavailable, please provide us Stripe creds.")
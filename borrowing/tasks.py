@@ -1,12 +1,165 @@
-import asyncio
+import datetime
+import logging
 
+import stripe
 from celery import shared_task
+from django.utils import timezone
+from kombu.exceptions import OperationalError
+from rest_framework.exceptions import ValidationError
 
+from borrowing.analytics import refresh_daily_aggregates
+from borrowing.fines import accrue_fines
+from borrowing.holds import expire_allocations
+from borrowing.models import Payment
 from borrowing.monitoring import filtering_borrowing
-from borrowing.telegram_notification import send_message
+from borrowing.payments import (
+    handle_stripe_event,
+    reconcile_payments,
+    renew_expiring_sessions,
+)
+from borrowing.stripe import create_stripe_session
+from borrowing.telegram_notification import notify_many
+
+logger = logging.getLogger(__name__)
+
+# a pending session older than this lost its task (broker down, worker crash)
+PENDING_SESSION_TIMEOUT = datetime.timedelta(minutes=5)
 
 
 @shared_task
 def run_sync_with_api() -> None:
-    message = filtering_borrowing()
-    asyncio.run(send_message(message=message))
+    notify_many(filtering_borrowing())
+
+
+def enqueue_payment_session(payment_id: int) -> None:
+    """Queue the Stripe session of a committed payment.
+
+    An unreachable broker must not fail the borrowing that already
+    committed: the payment stays pending and the sweeper queues it again.
+    """
+
+    try:
+        create_payment_session.delay(payment_id)
+    except OperationalError:
+        logger.warning("Broker unavailable, payment %s left to the sweeper", payment_id)
+
+
+RETRIED_STRIPE_ERRORS = (stripe.error.APIConnectionError, stripe.error.RateLimitError)
+
+
+@shared_task(
+    autoretry_for=RETRIED_STRIPE_ERRORS,
+    retry_backoff=True,
+    max_retries=5,
+)
+def create_payment_session(payment_id: int) -> None:
+    """Create the Stripe checkout session of a pending payment, shared by
+    all payments of its checkout"""
+
+    pending = Payment.objects.select_related("borrowing__book").filter(
+        session_state=Payment.EnumSessionState.PENDING
+    )
+    payment = pending.filter(pk=payment_id).first()
+    if payment is None:
+        return
+
+    borrowing = payment.borrowing
+    payment_ids = [payment_id]
+    if payment.checkout_id:
+        payments = list(pending.filter(checkout_id=payment.checkout_id).order_by("id"))
+        payment_ids = [payment.id for payment in payments]
+        borrowing = [payment.borrowing for payment in payments]
+
+    try:
+        session = create_stripe_session(
+            borrowing,
+            act_ret_date=(
+                borrowing.actual_return_date if payment.type == "FINE" else None
+            ),
+        )
+    except RETRIED_STRIPE_ERRORS:
+        raise
+    except stripe.error.StripeError:
+        logger.exception("Stripe rejected the session of payment %s", payment_id)
+        session = None
+
+    if session is None or isinstance(session, ValidationError):
+        update = {"session_state": Payment.EnumSessionState.FAILED}
+    else:
+        session_url, session_id, expires_at = session
+        update = {
+            "session_url": session_url,
+            "session_id": session_id,
+            "session_expires_at": expires_at,
+            "session_state": Payment.EnumSessionState.READY,
+        }
+
+    # a duplicate delivery of the task must not overwrite a finished session
+    Payment.objects.filter(
+        pk__in=payment_ids, session_state=Payment.EnumSessionState.PENDING
+    ).update(updated_at=timezone.now(), **update)
+
+
+@shared_task
+def sweep_pending_payment_sessions() -> int:
+    """Queue again the pending sessions whose task got lost"""
+
+    now = timezone.now()
+    stale = Payment.objects.filter(
+        session_state=Payment.EnumSessionState.PENDING,
+        updated_at__lt=now - PENDING_SESSION_TIMEOUT,
+    )
+    # one task per checkout, it covers every payment of the checkout
+    payment_ids = {}
+    for payment_id, checkout_id in stale.order_by("id").values_list(
+        "id", "checkout_id"
+    ):
+        payment_ids.setdefault(checkout_id or payment_id, payment_id)
+
+    # touching the payments gives the new tasks a full timeout to finish
+    stale.update(updated_at=now)
+
+    for payment_id in payment_ids.values():
+        enqueue_payment_session(payment_id)
+    return len(payment_ids)
+
+
+@shared_task
+def refresh_analytics() -> int:
+    return refresh_daily_aggregates()
+
+
+@shared_task
+def process_stripe_event(event_id: str) -> None:
+    handle_stripe_event(event_id)
+
+
+@shared_task
+def reconcile_stripe_payments() -> tuple[int, int]:
+    """Settle the pending payments paid on Stripe whose webhook got lost"""
+
+    try:
+        return reconcile_payments()
+    except stripe.error.StripeError:
+        # the chunk rolled back, the next run resumes from the checkpoint
+        logger.warning("Stripe unavailable, reconciliation postponed", exc_info=True)
+        return 0, 0
+
+
+@shared_task
+def accrue_overdue_fines() -> int:
+    return accrue_fines()
+
+
+@shared_task
+def renew_payment_sessions() -> int:
+    """Renew the unpaid Stripe sessions about to expire"""
+
+    return renew_expiring_sessions()
+
+
+@shared_task
+def expire_hold_allocations() -> int:
+    """Pass the copies allocated but never borrowed on to the next in line"""
+
+    return expire_allocations()
@@ -1,8 +1,181 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import Iterable, Iterator, Optional
+
 import telegram
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from kombu.exceptions import OperationalError
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+from borrowing.models import Notification
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+NOTIFICATION_WINDOW = 2  # seconds of notifications merged into one send
+NOTIFICATION_BATCH = 100
+SEND_INTERVAL = 1  # telegram allows about one message per second in a chat
+# the send slot lives in the cache, so every dispatcher process shares it
+SEND_SLOT_KEY = "telegram:send:slot"
+SEND_POLL = 0.1
+MAX_RETRY_DELAY = 5 * 60
+# longer than a batch takes to send, an older claim belongs to a dead worker
+CLAIM_TIMEOUT = datetime.timedelta(minutes=10)
+
+
+def notify(message: str) -> Notification:
+    """Put a message in the outbox of the current transaction; it is sent
+    by the dispatcher once the transaction commits"""
+
+    notification = Notification.objects.create(message=message)
+    transaction.on_commit(schedule_dispatch)
+    return notification
+
+
+def notify_many(messages: Iterable[str]) -> int:
+    """Queue a stream of messages with batched inserts and a single dispatch"""
+
+    count = 0
+    with transaction.atomic():
+        batch = []
+        for message in messages:
+            batch.append(Notification(message=message))
+            if len(batch) == NOTIFICATION_BATCH:
+                count += len(Notification.objects.bulk_create(batch))
+                batch = []
+        count += len(Notification.objects.bulk_create(batch))
+        transaction.on_commit(schedule_dispatch)
+    return count
+
+
+def schedule_dispatch() -> None:
+    # a lost dispatch only delays the messages until the periodic run
+    try:
+        dispatch_notifications.apply_async(countdown=NOTIFICATION_WINDOW)
+    except OperationalError:
+        logger.warning("Broker unavailable, notifications left to the periodic run")
+
+
+def merge_notifications(
+    notifications: Iterable[Notification],
+) -> Iterator[tuple[str, list[int]]]:
+    """Join queued messages into texts within the Telegram size limit,
+    each with the ids of the notifications it carries"""
+
+    text, ids = "", []
+    for notification in notifications:
+        message = notification.message.rstrip("\n")
+        if text and len(text) + 1 + len(message) > TELEGRAM_MESSAGE_LIMIT:
+            yield text, ids
+            text, ids = "", []
+
+        if len(message) > TELEGRAM_MESSAGE_LIMIT:
+            # an oversized message goes out alone, in pieces
+            for start in range(0, len(message), TELEGRAM_MESSAGE_LIMIT):
+                yield message[start : start + TELEGRAM_MESSAGE_LIMIT], [notification.id]
+            continue
+
+        text = f"{text}\n{message}" if text else message
+        ids.append(notification.id)
+
+    if text:
+        yield text, ids
+
+
+def wait_for_send_slot() -> None:
+    """Take the send slot of the chat. The key expires SEND_INTERVAL after
+    it was added, so sends stay that far apart across all workers sharing
+    the cache, whatever the concurrency of the dispatcher."""
+
+    while not cache.add(SEND_SLOT_KEY, True, timeout=SEND_INTERVAL):
+        time.sleep(SEND_POLL)
+
+
+class TelegramDispatcher:
+    """One bot and event loop for the lifetime of the worker process, so the
+    HTTP connection to Telegram is reused between batches"""
+
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._bot: Optional[telegram.Bot] = None
+
+    def send(self, text: str) -> None:
+        if self._bot is None:
+            self._loop = asyncio.new_event_loop()
+            self._bot = telegram.Bot(token=settings.TELEGRAM_TOKEN)
+            self._loop.run_until_complete(self._bot.initialize())
+
+        wait_for_send_slot()
+        self._loop.run_until_complete(
+            self._bot.send_message(chat_id=settings.TELEGRAM_CHAT_ID, text=text)
+        )
+
+
+dispatcher = TelegramDispatcher()
+
+
+def send_batch(notifications: list[Notification]) -> None:
+    for text, ids in merge_notifications(notifications):
+        try:
+            dispatcher.send(text)
+        except TelegramError as error:
+            # BadRequest subclasses NetworkError, but retrying it would block the queue
+            transient = isinstance(error, (RetryAfter, NetworkError))
+            if transient and not isinstance(error, BadRequest):
+                raise
+            logger.exception("Telegram rejected notifications %s", ids)
+            Notification.objects.filter(id__in=ids).update(error=str(error))
+        else:
+            Notification.objects.filter(id__in=ids).update(sent_at=timezone.now())
+
+
+@transaction.atomic()
+def claim_batch() -> list[Notification]:
+    """Claim the next batch of the outbox for this dispatcher. The rows are
+    only locked while claiming, Telegram is called after the commit."""
+
+    now = timezone.now()
+    batch = list(
+        Notification.objects.select_for_update(skip_locked=True)
+        .filter(sent_at__isnull=True, error="")
+        .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - CLAIM_TIMEOUT))
+        .order_by("id")[:NOTIFICATION_BATCH]
+    )
+    Notification.objects.filter(id__in=[item.id for item in batch]).update(
+        claimed_at=now
+    )
+    return batch
+
 
-from library_service import settings
+@shared_task(bind=True, max_retries=None)
+def dispatch_notifications(self) -> int:
+    """Drain the outbox in merged batches, backing off while Telegram is
+    unreachable or rate limits the bot"""
 
+    if not settings.TELEGRAM_TOKEN:
+        return 0
 
-async def send_message(message: str) -> None:
-    bot = telegram.Bot(token=settings.TELEGRAM_TOKEN)
-    await bot.send_message(chat_id=settings.TELEGRAM_CHAT_ID, text=message)
+    sent = 0
+    while batch := claim_batch():
+        # notifications sent before a failure stay marked as sent
+        try:
+            send_batch(batch)
+        except (RetryAfter, NetworkError) as error:
+            # hand the unsent rest back to the next run
+            Notification.objects.filter(
+                id__in=[item.id for item in batch], sent_at__isnull=True, error=""
+            ).update(claimed_at=None)
+            if isinstance(error, RetryAfter):
+                countdown = error.retry_after
+            else:
+                countdown = min(2**self.request.retries, MAX_RETRY_DELAY)
+            raise self.retry(exc=error, countdown=countdown)
+        sent += len(batch)
+    return sent
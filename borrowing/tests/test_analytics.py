@@ -0,0 +1,137 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from borrowing.analytics import refresh_daily_aggregates
+from borrowing.models import Borrowing, DailyActivity, Payment
+from .test_borrowing_api import sample_book, sample_borrowing
+
+ANALYTICS_URL = reverse("borrowing:analytics")
+
+
+class AnalyticsTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.staff = get_user_model().objects.create_superuser(
+            "admin@admin.com", "test_pass"
+        )
+        self.client.force_authenticate(self.staff)
+        self.today = datetime.date.today()
+
+        self.popular = sample_book(title="Popular")
+        self.other = sample_book(title="Other")
+        self.borrowings = [
+            sample_borrowing(book=self.popular, user=self.staff),
+            sample_borrowing(book=self.popular, user=self.staff),
+            sample_borrowing(book=self.other, user=self.staff),
+        ]
+        for money, payment_type in ((Decimal("14.00"), "PAYMENT"), (5, "FINE")):
+            Payment.objects.create(
+                status="PAID",
+                type=payment_type,
+                borrowing=self.borrowings[0],
+                money_to_pay=money,
+                paid_at=timezone.now(),
+            )
+        Payment.objects.create(
+            status="PENDING",
+            type="PAYMENT",
+            borrowing=self.borrowings[1],
+            money_to_pay=100,
+        )
+
+    def test_refresh_builds_daily_aggregates(self) -> None:
+        self.assertEqual(refresh_daily_aggregates(), 1)
+
+        response = self.client.get(ANALYTICS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        [day] = response.data["days"]
+        self.assertEqual(day["day"], self.today.isoformat())
+        self.assertEqual(day["borrowed"], 3)
+        self.assertEqual(day["active_loans"], 3)
+        self.assertEqual(day["revenue"], {"FINE": "5.00", "PAYMENT": "14.00"})
+        self.assertEqual(
+            [(book["title"], book["borrowed"]) for book in response.data["top_books"]],
+            [("Popular", 2), ("Other", 1)],
+        )
+        self.assertEqual(
+            response.data["revenue"],
+            [
+                {"type": "FINE", "total": "5.00", "payments": 1},
+                {"type": "PAYMENT", "total": "14.00", "payments": 1},
+            ],
+        )
+
+    def test_refresh_only_reprocesses_changed_days(self) -> None:
+        an_hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        Borrowing.objects.update(updated_at=an_hour_ago)
+        Payment.objects.update(updated_at=an_hour_ago)
+        Payment.objects.filter(status="PAID").update(paid_at=an_hour_ago)
+        refresh_daily_aggregates()
+
+        self.assertEqual(refresh_daily_aggregates(), 0)
+
+        return_date = self.today + datetime.timedelta(days=1)
+        Borrowing.objects.filter(pk=self.borrowings[2].pk).update(
+            actual_return_date=return_date, updated_at=timezone.now()
+        )
+
+        # the borrow day and the return day of the borrowing
+        self.assertEqual(refresh_daily_aggregates(), 2)
+        activity = DailyActivity.objects.get(day=return_date)
+        self.assertEqual((activity.returned, activity.returned_late), (1, 0))
+        self.assertEqual(DailyActivity.objects.get(day=self.today).borrowed, 3)
+
+    def test_revenue_is_counted_on_the_day_of_payment(self) -> None:
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        Payment.objects.filter(type="FINE").update(paid_at=yesterday)
+        refresh_daily_aggregates()
+
+        # a later write to a settled payment does not move its revenue
+        Payment.objects.filter(type="FINE").update(updated_at=timezone.now())
+        refresh_daily_aggregates()
+
+        response = self.client.get(
+            ANALYTICS_URL,
+            {"start": yesterday.date().isoformat(), "end": self.today.isoformat()},
+        )
+        self.assertEqual(
+            {day["day"]: day["revenue"] for day in response.data["days"]},
+            {
+                yesterday.date().isoformat(): {"FINE": "5.00"},
+                self.today.isoformat(): {"PAYMENT": "14.00"},
+            },
+        )
+
+    def test_report_reads_only_the_aggregates(self) -> None:
+        refresh_daily_aggregates()
+
+        # watermark, revenue, days, top books
+        with self.assertNumQueries(4):
+            self.client.get(ANALYTICS_URL)
+
+    def test_analytics_validates_the_range(self) -> None:
+        response = self.client.get(
+            ANALYTICS_URL, {"start": "2024-02-01", "end": "2024-01-01"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(
+            ANALYTICS_URL, {"start": "2022-01-01", "end": "2024-01-01"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_analytics_is_staff_only(self) -> None:
+        user = get_user_model().objects.create_user("test@test.com", "pass")
+        self.client.force_authenticate(user)
+
+        response = self.client.get(ANALYTICS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
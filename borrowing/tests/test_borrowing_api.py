@@ -1,22 +1,30 @@
 import datetime
+import uuid
+from decimal import Decimal
+from unittest import mock
 
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 from django.urls import reverse
 from django.conf import settings
+from django.utils import timezone
 from rest_framework import status
 
 from rest_framework.test import APIClient
 
+from book.inventory import reserve_copy
 from book.models import Book
-from borrowing.models import Borrowing, Payment
+from borrowing.models import Borrowing, Notification, Payment
 from borrowing.monitoring import filtering_borrowing
 from borrowing.serializers import (
     BorrowingListSerializer,
     BorrowingDetailSerializer,
 )
+from borrowing.tasks import create_payment_session
 
 BORROWING_URL = reverse("borrowing:borrowing-list")
+CHECKOUT_URL = reverse("borrowing:borrowing-checkout")
+BULK_RETURN_URL = reverse("borrowing:borrowing-bulk-return")
 
 
 def detail_borrowing_url(borrowing_id: int) -> str:
@@ -134,6 +142,86 @@ class AuthenticatedBorrowingApiTests(TestCase):
         )
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # the fine is a new payment, the fee keeps its session
+        fee = Payment.objects.get(borrowing=borrowing, type="PAYMENT")
+        self.assertEqual(fee.session_id, "127")
+        self.assertEqual(fee.money_to_pay, Decimal("3.78"))
+        self.assertTrue(
+            Payment.objects.filter(
+                borrowing=borrowing, type="FINE", status="PENDING"
+            ).exists()
+        )
+
+    def test_cursor_pagination_walks_all_pages(self) -> None:
+        book = sample_book()
+        borrowings = [sample_borrowing(book=book, user=self.user1) for _ in range(7)]
+
+        response = self.client.get(BORROWING_URL, {"pagination": "cursor"})
+        next_page = self.client.get(response.data["next"])
+
+        self.assertNotIn("count", response.data)
+        self.assertEqual(
+            [borrowing["id"] for borrowing in response.data["results"]]
+            + [borrowing["id"] for borrowing in next_page.data["results"]],
+            [borrowing.id for borrowing in reversed(borrowings)],
+        )
+        self.assertIsNone(next_page.data["next"])
+
+    def test_conditional_get_borrowings(self) -> None:
+        borrowing = sample_borrowing(book=sample_book(), user=self.user1)
+        response = self.client.get(BORROWING_URL)
+
+        not_modified = self.client.get(
+            BORROWING_URL, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        Payment.objects.create(
+            status="PENDING", type="PAYMENT", borrowing=borrowing, money_to_pay=1
+        )
+        modified = self.client.get(BORROWING_URL, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(modified.data["results"][0]["payments"]), 1)
+
+    def test_conditional_get_borrowing_detail(self) -> None:
+        borrowing = sample_borrowing(book=sample_book(), user=self.user1)
+        url = detail_borrowing_url(borrowing.id)
+        response = self.client.get(url)
+
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_etag_follows_the_page_only(self) -> None:
+        book = sample_book()
+        borrowings = [sample_borrowing(book=book, user=self.user1) for _ in range(7)]
+        response = self.client.get(BORROWING_URL)
+
+        # the oldest borrowing is on the second page
+        Payment.objects.create(
+            status="PENDING", type="PAYMENT", borrowing=borrowings[0], money_to_pay=1
+        )
+        not_modified = self.client.get(
+            BORROWING_URL, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        second_page = self.client.get(
+            BORROWING_URL, {"page": 2}, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(second_page.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(second_page.data["results"]), 2)
+
+    def test_detail_etag_follows_striped_stock(self) -> None:
+        book = sample_book(inventory=4, inventory_stripes=2)
+        url = detail_borrowing_url(sample_borrowing(book=book, user=self.user1).id)
+        response = self.client.get(url)
+
+        reserve_copy(book)
+        modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+        self.assertEqual(modified.data["book"]["inventory"], 3)
 
     def test_str_method(self) -> None:
         book = sample_book()
@@ -242,6 +330,211 @@ class AdminBorrowingApiTests(TestCase):
         )
 
         self.assertEqual(
-            filtering_borrowing(),
-            f"Book '{book.title}' was borrowed by user admin@admin.com at {datetime.date.today()}. The book must be returned {datetime.date.today() + datetime.timedelta(days=1)}\n",
+            list(filtering_borrowing()),
+            [
+                f"Book '{book.title}' was borrowed by user admin@admin.com at {datetime.date.today()}. The book must be returned {datetime.date.today() + datetime.timedelta(days=1)}\n"
+            ],
+        )
+
+
+@mock.patch("borrowing.telegram_notification.schedule_dispatch")
+class CheckoutApiTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user("test@test.com", "pass")
+        self.client.force_authenticate(self.user)
+        self.expected_return_date = datetime.date.today() + datetime.timedelta(weeks=1)
+
+    def test_checkout_borrows_all_books(self, schedule_dispatch: mock.Mock) -> None:
+        books = [sample_book(title=f"Book {number}") for number in range(3)]
+
+        with mock.patch("borrowing.serializers.enqueue_payment_session") as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    CHECKOUT_URL,
+                    {
+                        "books": [book.id for book in books],
+                        "expected_return_date": self.expected_return_date,
+                    },
+                    format="json",
+                )
+
+        payments = Payment.objects.all()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(Borrowing.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(len({payment.checkout_id for payment in payments}), 1)
+        self.assertEqual(
+            sorted(Book.objects.values_list("inventory", flat=True)), [11, 11, 11]
         )
+        enqueue.assert_called_once()
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_checkout_is_all_or_nothing(self, schedule_dispatch: mock.Mock) -> None:
+        available = sample_book()
+        sold_out = sample_book(title="Sold out", inventory=0)
+
+        response = self.client.post(
+            CHECKOUT_URL,
+            {
+                "books": [available.id, sold_out.id],
+                "expected_return_date": self.expected_return_date,
+            },
+            format="json",
+        )
+        available.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Sold out", response.data["books"])
+        self.assertEqual(available.inventory, 12)
+        self.assertFalse(Borrowing.objects.exists())
+
+    def test_checkout_rejects_invalid_carts(self, schedule_dispatch: mock.Mock) -> None:
+        book = sample_book()
+
+        for books in ([book.id, book.id], [book.id, 999999], []):
+            response = self.client.post(
+                CHECKOUT_URL,
+                {"books": books, "expected_return_date": self.expected_return_date},
+                format="json",
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @mock.patch("borrowing.tasks.create_stripe_session")
+    def test_checkout_payments_share_one_session(
+        self, create_stripe_session: mock.Mock, schedule_dispatch: mock.Mock
+    ) -> None:
+        create_stripe_session.return_value = (
+            "https://checkout.stripe.com",
+            "cs_1",
+            timezone.now(),
+        )
+        checkout_id = uuid.uuid4()
+        payments = [
+            Payment.objects.create(
+                status="PENDING",
+                type="PAYMENT",
+                borrowing=sample_borrowing(book=sample_book(), user=self.user),
+                checkout_id=checkout_id,
+            )
+            for _ in range(2)
+        ]
+
+        create_payment_session(payments[0].id)
+
+        self.assertEqual(len(create_stripe_session.call_args.args[0]), 2)
+        self.assertEqual(
+            list(Payment.objects.values_list("session_id", flat=True)),
+            ["cs_1", "cs_1"],
+        )
+
+
+@mock.patch("borrowing.telegram_notification.schedule_dispatch")
+class BulkReturnApiTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.staff = get_user_model().objects.create_superuser(
+            "admin@admin.com", "test_pass"
+        )
+        self.user = get_user_model().objects.create_user("test@test.com", "pass")
+        self.client.force_authenticate(self.staff)
+        self.return_date = datetime.date.today() + datetime.timedelta(days=1)
+
+    def test_bulk_return_restores_inventory_per_book(
+        self, schedule_dispatch: mock.Mock
+    ) -> None:
+        book = sample_book(inventory=0)
+        other_book = sample_book(inventory=0)
+        borrowings = [
+            sample_borrowing(book=book, user=self.user),
+            sample_borrowing(book=book, user=self.user),
+            sample_borrowing(book=other_book, user=self.user),
+        ]
+        returned = sample_borrowing(
+            book=other_book,
+            user=self.user,
+            actual_return_date=self.return_date,
+        )
+
+        response = self.client.post(
+            BULK_RETURN_URL,
+            {
+                "borrowings": [borrowing.id for borrowing in borrowings]
+                + [returned.id, 999999],
+                "actual_return_date": self.return_date,
+            },
+            format="json",
+        )
+        book.refresh_from_db()
+        other_book.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item["status"] for item in response.data["results"]],
+            ["returned"] * 3 + ["already returned", "not found"],
+        )
+        self.assertEqual(book.inventory, 2)
+        self.assertEqual(other_book.inventory, 1)
+        self.assertFalse(
+            Borrowing.objects.filter(actual_return_date__isnull=True).exists()
+        )
+
+    def test_bulk_return_charges_fines_in_batch(
+        self, schedule_dispatch: mock.Mock
+    ) -> None:
+        overdue = sample_borrowing(book=sample_book(), user=self.user)
+        Borrowing.objects.filter(pk=overdue.pk).update(
+            expected_return_date=datetime.date.today()
+        )
+        on_time = sample_borrowing(book=sample_book(), user=self.user)
+        for borrowing in (overdue, on_time):
+            Payment.objects.create(
+                status="PENDING",
+                type="PAYMENT",
+                borrowing=borrowing,
+                session_id=f"cs_{borrowing.id}",
+                session_state=Payment.EnumSessionState.READY,
+            )
+
+        with mock.patch("borrowing.serializers.enqueue_payment_session") as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    BULK_RETURN_URL,
+                    {
+                        "borrowings": [overdue.id, on_time.id],
+                        "actual_return_date": self.return_date,
+                    },
+                    format="json",
+                )
+
+        fine = Payment.objects.get(borrowing=overdue, type="FINE")
+        self.assertEqual(
+            [item["fine"] for item in response.data["results"]], [True, False]
+        )
+        self.assertEqual(fine.session_state, Payment.EnumSessionState.PENDING)
+        self.assertIsNone(fine.session_id)
+        # the fees keep their sessions
+        self.assertEqual(
+            list(
+                Payment.objects.filter(type="PAYMENT")
+                .order_by("borrowing_id")
+                .values_list("session_id", flat=True)
+            ),
+            [f"cs_{overdue.id}", f"cs_{on_time.id}"],
+        )
+        self.assertFalse(
+            Payment.objects.filter(borrowing=on_time, type="FINE").exists()
+        )
+        enqueue.assert_called_once_with(fine.id)
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_bulk_return_is_staff_only(self, schedule_dispatch: mock.Mock) -> None:
+        self.client.force_authenticate(self.user)
+
+        response = self.client.post(
+            BULK_RETURN_URL,
+            {"borrowings": [1], "actual_return_date": self.return_date},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
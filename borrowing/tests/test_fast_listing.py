@@ -0,0 +1,72 @@
+import datetime
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from borrowing.models import Payment
+from borrowing.views import BorrowingViewSet, PaymentListView
+from .test_borrowing_api import BORROWING_URL, sample_book, sample_borrowing
+
+PAYMENT_URL = reverse("borrowing:payments-list")
+
+
+class FastListingTests(TestCase):
+    """The fast read path must render exactly the serializer output"""
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_superuser(
+            "admin@admin.com", "test_pass"
+        )
+        self.client.force_authenticate(self.user)
+
+        for number in range(7):
+            borrowing = sample_borrowing(
+                book=sample_book(title=f"Book {number}", daily_fee=Decimal("3.5")),
+                user=self.user,
+                actual_return_date=(
+                    datetime.date.today() + datetime.timedelta(days=number)
+                    if number % 2
+                    else None
+                ),
+            )
+            for payment_number in range(number % 3):
+                Payment.objects.create(
+                    status="PENDING" if payment_number else "PAID",
+                    type="FINE" if number % 2 else "PAYMENT",
+                    borrowing=borrowing,
+                    session_url=f"https://checkout.stripe.com/{number}",
+                    session_id=f"cs_{number}_{payment_number}" if number else None,
+                    money_to_pay=Decimal("12.5") * number,
+                )
+
+    def assert_same_content(self, view: type, url: str, params: dict) -> None:
+        fast = self.client.get(url, params)
+        with mock.patch.object(view, "use_fast_list", False):
+            slow = self.client.get(url, params)
+
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+
+    def test_borrowing_pages_are_byte_identical(self) -> None:
+        for params in ({}, {"page": 2}, {"pagination": "cursor", "page_size": 100}):
+            self.assert_same_content(BorrowingViewSet, BORROWING_URL, params)
+
+    def test_filtered_borrowings_are_byte_identical(self) -> None:
+        self.assert_same_content(
+            BorrowingViewSet, BORROWING_URL, {"is_active": "true", "user_id": 1}
+        )
+
+    def test_payment_pages_are_byte_identical(self) -> None:
+        for params in ({}, {"page": 2}, {"pagination": "cursor", "page_size": 100}):
+            self.assert_same_content(PaymentListView, PAYMENT_URL, params)
+
+    def test_fast_path_query_count(self) -> None:
+        # page ids, pagination count, ETag state of the page, borrowings and
+        # payments of the page
+        with self.assertNumQueries(5):
+            self.client.get(BORROWING_URL)
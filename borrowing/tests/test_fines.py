@@ -0,0 +1,102 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from borrowing.fines import accrue_fines
+from borrowing.models import Borrowing, FineSnapshot
+from borrowing.pricing import fine
+from borrowing.stripe import amount_to_pay
+from .test_borrowing_api import sample_book, sample_borrowing
+
+FINES_URL = reverse("borrowing:projected-fines")
+
+
+class FineEngineTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.staff = get_user_model().objects.create_superuser(
+            "admin@admin.com", "test_pass"
+        )
+        self.user = get_user_model().objects.create_user("test@test.com", "pass")
+        self.today = datetime.date.today()
+
+        self.overdue = []
+        for days, fee, user in (
+            (1, Decimal("3.78"), self.user),
+            (9, Decimal("0.33"), self.user),
+            (40, Decimal("12.99"), self.staff),
+        ):
+            borrowing = sample_borrowing(book=sample_book(daily_fee=fee), user=user)
+            Borrowing.objects.filter(pk=borrowing.pk).update(
+                expected_return_date=self.today - datetime.timedelta(days=days)
+            )
+            self.overdue.append(borrowing)
+
+        # not overdue yet, and overdue but returned
+        sample_borrowing(book=sample_book(), user=self.user)
+        returned = sample_borrowing(
+            book=sample_book(),
+            user=self.user,
+            actual_return_date=self.today + datetime.timedelta(days=1),
+        )
+        Borrowing.objects.filter(pk=returned.pk).update(
+            expected_return_date=self.today - datetime.timedelta(days=3)
+        )
+
+    def test_batch_and_per_borrowing_fines_are_identical(self) -> None:
+        self.assertEqual(accrue_fines(self.today), 3)
+
+        for borrowing in Borrowing.objects.filter(
+            pk__in=[borrowing.pk for borrowing in self.overdue]
+        ).select_related("book"):
+            snapshot = FineSnapshot.objects.get(borrowing=borrowing)
+            self.assertEqual(
+                snapshot.fine,
+                fine(
+                    borrowing.expected_return_date,
+                    self.today,
+                    borrowing.book.daily_fee,
+                ),
+            )
+            self.assertEqual(snapshot.fine, amount_to_pay(borrowing, self.today))
+
+    def test_rerun_replaces_the_snapshots_of_the_day(self) -> None:
+        accrue_fines(self.today)
+        Borrowing.objects.filter(pk=self.overdue[0].pk).update(
+            actual_return_date=self.today
+        )
+
+        self.assertEqual(accrue_fines(self.today), 2)
+        self.assertEqual(FineSnapshot.objects.count(), 2)
+
+    def test_projected_fines_in_total_and_per_user(self) -> None:
+        accrue_fines(self.today)
+        self.client.force_authenticate(self.staff)
+
+        response = self.client.get(FINES_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # 2 * (1 * 3.78 + 9 * 0.33 + 40 * 12.99)
+        self.assertEqual(response.data["total"], "1052.70")
+        self.assertEqual(response.data["overdue_borrowings"], 3)
+        self.assertEqual(
+            [(user["email"], user["fine"]) for user in response.data["users"]],
+            [("admin@admin.com", "1039.20"), ("test@test.com", "13.50")],
+        )
+
+    def test_users_see_their_own_projected_fines(self) -> None:
+        accrue_fines(self.today)
+        self.client.force_authenticate(self.user)
+
+        response = self.client.get(FINES_URL, {"user_id": self.staff.id})
+
+        self.assertEqual(response.data["total"], "13.50")
+        self.assertEqual(
+            [borrowing["fine"] for borrowing in response.data["borrowings"]],
+            ["7.56", "5.94"],
+        )
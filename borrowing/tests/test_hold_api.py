@@ -0,0 +1,215 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from book.bulk import import_books
+from borrowing.holds import ALLOCATION_TIMEOUT, claim_hold, expire_allocations
+from borrowing.models import Hold, Notification
+from borrowing.serializers import BorrowingReturnSerializer
+from .test_borrowing_api import sample_book, sample_borrowing
+
+HOLD_URL = reverse("borrowing:hold-list")
+
+
+def cancel_hold_url(hold_id: int) -> str:
+    return reverse("borrowing:hold-cancel", kwargs={"pk": hold_id})
+
+
+@mock.patch("borrowing.telegram_notification.schedule_dispatch")
+class HoldApiTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user("test1@gmail.com", "pass")
+        self.other = get_user_model().objects.create_user("test2@gmail.com", "pass")
+        self.client.force_authenticate(self.user)
+        self.book = sample_book(inventory=0)
+
+    def return_copy(self) -> None:
+        borrowing = sample_borrowing(book=self.book, user=self.other)
+        serializer = BorrowingReturnSerializer(
+            borrowing,
+            data={"actual_return_date": datetime.date.today() + datetime.timedelta(1)},
+        )
+        serializer.is_valid(raise_exception=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save()
+
+    def test_holds_queue_in_order(self, schedule_dispatch: mock.Mock) -> None:
+        Hold.objects.create(book=self.book, user=self.other)
+
+        response = self.client.post(HOLD_URL, {"book": self.book.id})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["status"], Hold.EnumStatus.WAITING)
+        self.assertEqual(response.data["position"], 2)
+
+    def test_second_open_hold_is_rejected(self, schedule_dispatch: mock.Mock) -> None:
+        self.client.post(HOLD_URL, {"book": self.book.id})
+
+        response = self.client.post(HOLD_URL, {"book": self.book.id})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_hold_on_book_in_stock_is_allocated(
+        self, schedule_dispatch: mock.Mock
+    ) -> None:
+        book = sample_book(inventory=1)
+
+        response = self.client.post(HOLD_URL, {"book": book.id})
+        book.refresh_from_db()
+
+        self.assertEqual(response.data["status"], Hold.EnumStatus.ALLOCATED)
+        self.assertEqual(book.inventory, 0)
+
+    def test_return_allocates_copy_to_head_of_queue(
+        self, schedule_dispatch: mock.Mock
+    ) -> None:
+        first = Hold.objects.create(book=self.book, user=self.user)
+        second = Hold.objects.create(book=self.book, user=self.other)
+
+        self.return_copy()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.book.refresh_from_db()
+
+        self.assertEqual(first.status, Hold.EnumStatus.ALLOCATED)
+        self.assertEqual(second.status, Hold.EnumStatus.WAITING)
+        self.assertEqual(self.book.inventory, 0)
+        self.assertEqual(
+            Notification.objects.get().message,
+            f"{self.book.title} is ready to be borrowed by {self.user}.",
+        )
+        schedule_dispatch.assert_called_once()
+
+    def test_return_without_holds_shelves_copy(
+        self, schedule_dispatch: mock.Mock
+    ) -> None:
+        self.return_copy()
+        self.book.refresh_from_db()
+
+        self.assertEqual(self.book.inventory, 1)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_cancelling_allocated_hold_passes_copy_on(
+        self, schedule_dispatch: mock.Mock
+    ) -> None:
+        first = Hold.objects.create(
+            book=self.book, user=self.user, status=Hold.EnumStatus.ALLOCATED
+        )
+        second = Hold.objects.create(book=self.book, user=self.other)
+
+        response = self.client.post(cancel_hold_url(first.id))
+        second.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], Hold.EnumStatus.CANCELLED)
+        self.assertEqual(second.status, Hold.EnumStatus.ALLOCATED)
+
+    def test_borrowing_claims_allocated_copy(
+        self, schedule_dispatch: mock.Mock
+    ) -> None:
+        hold = Hold.objects.create(
+            book=self.book, user=self.user, status=Hold.EnumStatus.ALLOCATED
+        )
+
+        self.assertTrue(claim_hold(self.book, self.user))
+        self.assertFalse(claim_hold(self.book, self.user))
+        hold.refresh_from_db()
+        self.assertEqual(hold.status, Hold.EnumStatus.FULFILLED)
+
+    def test_cannot_cancel_hold_of_another_user(
+        self, schedule_dispatch: mock.Mock
+    ) -> None:
+        hold = Hold.objects.create(book=self.book, user=self.other)
+
+        response = self.client.post(cancel_hold_url(hold.id))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stale_allocation_passes_to_next_in_line(
+        self, schedule_dispatch: mock.Mock
+    ) -> None:
+        stale = Hold.objects.create(
+            book=self.book,
+            user=self.user,
+            status=Hold.EnumStatus.ALLOCATED,
+            allocated_at=timezone.now() - ALLOCATION_TIMEOUT,
+        )
+        fresh = Hold.objects.create(
+            book=sample_book(inventory=0),
+            user=self.user,
+            status=Hold.EnumStatus.ALLOCATED,
+            allocated_at=timezone.now(),
+        )
+        waiting = Hold.objects.create(book=self.book, user=self.other)
+
+        self.assertEqual(expire_allocations(), 1)
+
+        self.assertEqual(
+            [Hold.objects.get(pk=hold.pk).status for hold in (stale, fresh, waiting)],
+            [
+                Hold.EnumStatus.EXPIRED,
+                Hold.EnumStatus.ALLOCATED,
+                Hold.EnumStatus.ALLOCATED,
+            ],
+        )
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+
+    def test_stale_allocation_without_queue_is_shelved(
+        self, schedule_dispatch: mock.Mock
+    ) -> None:
+        Hold.objects.create(
+            book=self.book,
+            user=self.user,
+            status=Hold.EnumStatus.ALLOCATED,
+            allocated_at=timezone.now() - ALLOCATION_TIMEOUT,
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            expire_allocations()
+        self.book.refresh_from_db()
+
+        self.assertEqual(self.book.inventory, 1)
+
+    def test_restock_allocates_waiting_holds(
+        self, schedule_dispatch: mock.Mock
+    ) -> None:
+        first = Hold.objects.create(book=self.book, user=self.user)
+        second = Hold.objects.create(book=self.book, user=self.other)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.inventory = 1
+            self.book.save()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.book.refresh_from_db()
+
+        self.assertEqual(first.status, Hold.EnumStatus.ALLOCATED)
+        self.assertEqual(second.status, Hold.EnumStatus.WAITING)
+        self.assertEqual(self.book.inventory, 0)
+
+    def test_imported_stock_allocates_waiting_holds(
+        self, schedule_dispatch: mock.Mock
+    ) -> None:
+        hold = Hold.objects.create(book=self.book, user=self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            import_books(
+                [
+                    b"id,title,author,cover,inventory,daily_fee\n",
+                    f"{self.book.id},Lion,Dad,hard,3,1.00\n".encode(),
+                ],
+                "csv",
+            )
+        hold.refresh_from_db()
+        self.book.refresh_from_db()
+
+        self.assertEqual(hold.status, Hold.EnumStatus.ALLOCATED)
+        self.assertEqual(self.book.inventory, 2)
@@ -0,0 +1,175 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    skipUnlessDBFeature,
+)
+from django.urls import reverse
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from book.admin import BookAdmin
+from book.inventory import release_copies, reserve_copy
+from book.models import Book
+from borrowing.serializers import BorrowingReturnSerializer
+from .test_borrowing_api import sample_book, sample_borrowing
+
+THREADS = 12
+
+
+def run_concurrently(function: callable, times: int) -> list:
+    """Start ``times`` calls of the function at the same moment"""
+
+    barrier = Barrier(times)
+
+    def call() -> object:
+        barrier.wait()
+        try:
+            return function()
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=times) as executor:
+        return list(executor.map(lambda _: call(), range(times)))
+
+
+# SQLite locks the whole database for a writer, the threads fail instead of
+# queueing on row locks
+@skipUnlessDBFeature("has_select_for_update_skip_locked")
+class InventoryContentionTests(TransactionTestCase):
+    def test_concurrent_reservations_never_oversell(self) -> None:
+        book = sample_book(inventory=5)
+
+        results = run_concurrently(lambda: reserve_copy(book), THREADS)
+        book.refresh_from_db()
+
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(book.inventory, 0)
+
+    def test_concurrent_returns_restore_one_copy(self) -> None:
+        book = sample_book(inventory=0)
+        borrowing = sample_borrowing(
+            book=book,
+            user=get_user_model().objects.create_user("test@test.com", "test_pass"),
+        )
+        return_date = datetime.date.today() + datetime.timedelta(days=1)
+
+        def return_borrowing() -> bool:
+            serializer = BorrowingReturnSerializer(
+                borrowing, data={"actual_return_date": return_date}
+            )
+            serializer.is_valid(raise_exception=True)
+            try:
+                serializer.save()
+            except ValidationError:
+                return False
+            return True
+
+        results = run_concurrently(return_borrowing, THREADS)
+        book.refresh_from_db()
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(book.inventory, 1)
+
+    def test_striped_book_reservations_never_oversell(self) -> None:
+        book = sample_book(inventory=5, inventory_stripes=4)
+
+        results = run_concurrently(lambda: reserve_copy(book), THREADS)
+
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(
+            Book.objects.with_live_inventory().get(pk=book.id).inventory, 0
+        )
+
+
+class StripedInventoryTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        cache.clear()
+        self.user = get_user_model().objects.create_user("test@test.com", "pass")
+        self.client.force_authenticate(self.user)
+
+    def test_enabling_stripes_spreads_inventory(self) -> None:
+        book = sample_book(inventory=10)
+        book.inventory_stripes = 4
+        book.save()
+
+        self.assertEqual(
+            list(book.stripes.order_by("stripe").values_list("inventory", flat=True)),
+            [3, 3, 2, 2],
+        )
+
+    def test_striped_inventory_is_transparent_to_serializers(self) -> None:
+        book = sample_book(inventory=3, inventory_stripes=2)
+        borrowing = sample_borrowing(book=book, user=self.user)
+
+        self.assertTrue(reserve_copy(book))
+        book_response = self.client.get(
+            reverse("library:book-detail", kwargs={"pk": book.id})
+        )
+        borrowing_response = self.client.get(
+            reverse("borrowing:borrowing-detail", kwargs={"pk": borrowing.id})
+        )
+        release_copies(book)
+
+        self.assertEqual(book_response.data["inventory"], 2)
+        self.assertEqual(borrowing_response.data["book"]["inventory"], 2)
+        self.assertEqual(
+            Book.objects.with_live_inventory().get(pk=book.id).inventory, 3
+        )
+
+    def test_changing_inventory_of_striped_book(self) -> None:
+        book = sample_book(inventory=3, inventory_stripes=2)
+        book = Book.objects.with_live_inventory().get(pk=book.id)
+
+        book.inventory = 7
+        book.save()
+
+        self.assertEqual(
+            Book.objects.with_live_inventory().get(pk=book.id).inventory, 7
+        )
+
+    def test_disabling_stripes_folds_inventory_back(self) -> None:
+        book = sample_book(inventory=4, inventory_stripes=2)
+        reserve_copy(book)
+
+        book.inventory_stripes = 1
+        book.save()
+        book.refresh_from_db()
+
+        self.assertEqual(book.inventory, 3)
+        self.assertFalse(book.stripes.exists())
+
+    def test_editing_a_stale_striped_book_adds_to_the_live_stock(self) -> None:
+        book = sample_book(inventory=10, inventory_stripes=2)
+        for _ in range(7):
+            reserve_copy(book)
+
+        # the plain manager reads the inventory column, not the stripes
+        stale = Book.objects.get(pk=book.id)
+        stale.inventory += 5
+        stale.save()
+
+        self.assertEqual(
+            Book.objects.with_live_inventory().get(pk=book.id).inventory, 8
+        )
+
+    def test_admin_edits_the_live_stock(self) -> None:
+        book = sample_book(inventory=10, inventory_stripes=2)
+        reserve_copy(book)
+
+        book_admin = BookAdmin(Book, admin.site)
+        self.assertEqual(
+            book_admin.get_queryset(RequestFactory().get("/"))
+            .get(pk=book.id)
+            .inventory,
+            9,
+        )
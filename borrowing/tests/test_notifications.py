@@ -0,0 +1,177 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from telegram.error import BadRequest, RetryAfter
+
+from borrowing.models import Borrowing, Notification
+from borrowing.monitoring import chunk_lines, filtering_borrowing, overdue_lines
+from borrowing.tasks import run_sync_with_api
+from borrowing.telegram_notification import (
+    CLAIM_TIMEOUT,
+    SEND_SLOT_KEY,
+    TELEGRAM_MESSAGE_LIMIT,
+    dispatch_notifications,
+    merge_notifications,
+    notify,
+    wait_for_send_slot,
+)
+from .test_borrowing_api import sample_book, sample_borrowing
+
+
+@override_settings(TELEGRAM_TOKEN="token", TELEGRAM_CHAT_ID="chat")
+@mock.patch("borrowing.telegram_notification.dispatcher")
+class NotificationOutboxTests(TestCase):
+    @mock.patch("borrowing.telegram_notification.schedule_dispatch")
+    def test_notify_dispatches_after_commit(
+        self, schedule_dispatch: mock.Mock, dispatcher: mock.Mock
+    ) -> None:
+        with self.captureOnCommitCallbacks() as callbacks:
+            notify("Book was borrowed")
+
+            schedule_dispatch.assert_not_called()
+        callbacks[0]()
+
+        self.assertEqual(Notification.objects.get().message, "Book was borrowed")
+        schedule_dispatch.assert_called_once()
+
+    def test_messages_are_merged_within_limit(self, dispatcher: mock.Mock) -> None:
+        notifications = [
+            Notification(id=1, message="a" * 3000),
+            Notification(id=2, message="b" * 1000),
+            Notification(id=3, message="c" * 1000),
+            Notification(id=4, message="d" * (TELEGRAM_MESSAGE_LIMIT + 1)),
+        ]
+
+        merged = list(merge_notifications(notifications))
+
+        self.assertEqual([ids for _, ids in merged], [[1, 2], [3], [4], [4]])
+        self.assertTrue(all(len(text) <= TELEGRAM_MESSAGE_LIMIT for text, _ in merged))
+        self.assertEqual(merged[0][0], "a" * 3000 + "\n" + "b" * 1000)
+
+    def test_dispatch_sends_one_message_per_window(self, dispatcher: mock.Mock) -> None:
+        Notification.objects.create(message="first")
+        Notification.objects.create(message="second")
+
+        self.assertEqual(dispatch_notifications(), 2)
+        dispatcher.send.assert_called_once_with("first\nsecond")
+        self.assertFalse(Notification.objects.filter(sent_at__isnull=True).exists())
+
+    def test_rate_limit_is_retried(self, dispatcher: mock.Mock) -> None:
+        Notification.objects.create(message="first")
+        dispatcher.send.side_effect = RetryAfter(7)
+
+        with mock.patch.object(dispatch_notifications, "retry") as retry:
+            retry.side_effect = RetryAfter(7)
+            with self.assertRaises(RetryAfter):
+                dispatch_notifications()
+
+        self.assertEqual(retry.call_args.kwargs["countdown"], 7)
+        # the claim is handed back for the retry
+        self.assertTrue(
+            Notification.objects.filter(
+                sent_at__isnull=True, claimed_at__isnull=True
+            ).exists()
+        )
+
+    def test_batch_is_claimed_before_sending(self, dispatcher: mock.Mock) -> None:
+        Notification.objects.create(message="first")
+        claimed = []
+        dispatcher.send.side_effect = lambda text: claimed.extend(
+            Notification.objects.values_list("claimed_at", flat=True)
+        )
+
+        dispatch_notifications()
+
+        self.assertEqual(len(claimed), 1)
+        self.assertIsNotNone(claimed[0])
+
+    def test_claims_of_a_dead_worker_are_taken_over(
+        self, dispatcher: mock.Mock
+    ) -> None:
+        Notification.objects.create(message="claimed", claimed_at=timezone.now())
+        Notification.objects.create(
+            message="abandoned", claimed_at=timezone.now() - CLAIM_TIMEOUT
+        )
+
+        self.assertEqual(dispatch_notifications(), 1)
+        dispatcher.send.assert_called_once_with("abandoned")
+
+    def test_rejected_message_does_not_block_queue(self, dispatcher: mock.Mock) -> None:
+        rejected = Notification.objects.create(message="x" * TELEGRAM_MESSAGE_LIMIT)
+        Notification.objects.create(message="next")
+        dispatcher.send.side_effect = [BadRequest("Message is too long"), None]
+
+        dispatch_notifications()
+        rejected.refresh_from_db()
+
+        self.assertEqual(rejected.error, "Message is too long")
+        self.assertTrue(Notification.objects.get(message="next").sent_at)
+
+    @override_settings(TELEGRAM_TOKEN=None)
+    def test_dispatch_waits_for_configured_bot(self, dispatcher: mock.Mock) -> None:
+        Notification.objects.create(message="first")
+
+        self.assertEqual(dispatch_notifications(), 0)
+        dispatcher.send.assert_not_called()
+
+
+class SendSlotTests(TestCase):
+    def setUp(self) -> None:
+        cache.delete(SEND_SLOT_KEY)
+        self.addCleanup(cache.delete, SEND_SLOT_KEY)
+
+    @mock.patch("borrowing.telegram_notification.time.sleep")
+    def test_send_waits_for_the_slot_taken_elsewhere(self, sleep: mock.Mock) -> None:
+        # another worker sent a moment ago, its slot expires while waiting
+        cache.add(SEND_SLOT_KEY, True)
+        sleep.side_effect = lambda seconds: cache.delete(SEND_SLOT_KEY)
+
+        wait_for_send_slot()
+
+        sleep.assert_called_once()
+        self.assertTrue(cache.get(SEND_SLOT_KEY))
+
+
+class OverdueDigestTests(TestCase):
+    def setUp(self) -> None:
+        user = get_user_model().objects.create_user("test@test.com", "pass")
+        for number in range(3):
+            sample_borrowing(
+                book=sample_book(title=f"Book {number}"),
+                user=user,
+                expected_return_date=datetime.date.today() + datetime.timedelta(1),
+            )
+
+    def test_digest_is_read_with_one_query(self) -> None:
+        with self.assertNumQueries(1):
+            lines = list(overdue_lines())
+
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("Book 'Book 0' was borrowed by user"))
+
+    def test_chunks_fit_into_telegram(self) -> None:
+        lines = ["x" * 1000 + "\n"] * 10
+
+        chunks = list(chunk_lines(lines))
+
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(all(len(chunk) <= TELEGRAM_MESSAGE_LIMIT for chunk in chunks))
+        self.assertEqual("".join(chunks), "".join(lines))
+
+    def test_empty_digest(self) -> None:
+        Borrowing.objects.all().delete()
+
+        self.assertEqual(list(filtering_borrowing()), ["No borrowings overdue today!"])
+
+    @mock.patch("borrowing.telegram_notification.schedule_dispatch")
+    def test_task_queues_each_chunk(self, schedule_dispatch: mock.Mock) -> None:
+        with self.captureOnCommitCallbacks(execute=True):
+            run_sync_with_api()
+
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertEqual(Notification.objects.get().message.count("\n"), 3)
+        schedule_dispatch.assert_called_once()
@@ -0,0 +1,85 @@
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from borrowing.models import Borrowing, Payment
+from borrowing.pagination import estimated_count
+from .test_borrowing_api import BORROWING_URL, sample_book, sample_borrowing
+from .test_payment_api import PAYMENT_URL
+
+# the estimates come from the PostgreSQL planner, other backends count
+on_postgresql = skipUnless(
+    connection.vendor == "postgresql", "planner estimates need PostgreSQL"
+)
+
+
+class EstimatedCountPaginationTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user("test@test.com", "pass")
+        self.staff = get_user_model().objects.create_superuser(
+            "admin@admin.com", "test_pass"
+        )
+        self.client.force_authenticate(self.staff)
+
+        book = sample_book()
+        for user in [self.user] * 4 + [self.staff] * 3:
+            Payment.objects.create(
+                status="PENDING",
+                type="PAYMENT",
+                borrowing=sample_borrowing(book=book, user=user),
+                money_to_pay=1,
+            )
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"ANALYZE {Borrowing._meta.db_table}, {Payment._meta.db_table}"
+                )
+
+    def test_small_listings_count_exactly(self) -> None:
+        response = self.client.get(BORROWING_URL)
+
+        self.assertEqual(response.data["count"], 7)
+        self.assertFalse(response.data["count_estimated"])
+        self.assertTrue(response.data["has_next"])
+        self.assertIsNotNone(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 5)
+
+    @on_postgresql
+    @override_settings(PAGINATION_EXACT_COUNT_LIMIT=1)
+    def test_large_listings_use_the_planner_estimate(self) -> None:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(PAYMENT_URL)
+
+        self.assertTrue(response.data["count_estimated"])
+        self.assertEqual(response.data["count"], 7)
+        self.assertTrue(response.data["has_next"])
+        # the only count stops at the limit
+        counts = [query["sql"] for query in queries if "COUNT(" in query["sql"]]
+        self.assertEqual(len(counts), 1)
+        self.assertIn("LIMIT 1", counts[0])
+
+    @override_settings(PAGINATION_EXACT_COUNT_LIMIT=1)
+    def test_last_page_knows_the_exact_count(self) -> None:
+        response = self.client.get(PAYMENT_URL, {"page": 2})
+
+        self.assertFalse(response.data["count_estimated"])
+        self.assertEqual(response.data["count"], 7)
+        self.assertFalse(response.data["has_next"])
+        self.assertIsNone(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_page_past_the_end_is_not_found(self) -> None:
+        response = self.client.get(PAYMENT_URL, {"page": 3})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @on_postgresql
+    def test_filtered_listings_are_estimated_from_explain(self) -> None:
+        self.assertEqual(estimated_count(Borrowing.objects.all()), 7)
+        self.assertGreater(estimated_count(Borrowing.objects.filter(user=self.user)), 0)
@@ -78,3 +78,24 @@ class AuthenticatedPaymentApiTests(TestCase):
 
         self.assertEqual(len(response.data["results"]), 2)
         self.assertEqual(str(payment2), "Payment (Interesting book)")
+
+    def test_cursor_pagination(self) -> None:
+        book = sample_book()
+        borrowing = sample_borrowing(book=book, user=self.user)
+        for session_id in range(6):
+            Payment.objects.create(
+                status="pending",
+                type="payment",
+                borrowing=borrowing,
+                session_id=session_id,
+                money_to_pay=book.daily_fee,
+            )
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                PAYMENT_URL, {"pagination": "cursor", "page_size": 4}
+            )
+
+        self.assertNotIn("count", response.data)
+        self.assertEqual(len(response.data["results"]), 4)
+        self.assertIsNotNone(response.data["next"])
@@ -0,0 +1,128 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+from kombu.exceptions import OperationalError
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from borrowing.models import Payment
+from borrowing.tasks import (
+    PENDING_SESSION_TIMEOUT,
+    create_payment_session,
+    enqueue_payment_session,
+    sweep_pending_payment_sessions,
+)
+from .test_borrowing_api import BORROWING_URL, sample_book, sample_borrowing
+
+EXPIRES_AT = timezone.now() + datetime.timedelta(minutes=30)
+
+
+class PaymentSessionTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user("test@test.com", "pass")
+        self.client.force_authenticate(self.user)
+        self.borrowing = sample_borrowing(book=sample_book(), user=self.user)
+
+    def sample_payment(self, **params: dict) -> Payment:
+        defaults = {
+            "status": "PENDING",
+            "type": "PAYMENT",
+            "borrowing": self.borrowing,
+            "money_to_pay": 1,
+        }
+        defaults.update(params)
+        return Payment.objects.create(**defaults)
+
+    @mock.patch("borrowing.telegram_notification.schedule_dispatch")
+    @mock.patch("borrowing.serializers.enqueue_payment_session")
+    def test_borrowing_commits_with_pending_session(
+        self, enqueue: mock.Mock, schedule_dispatch: mock.Mock
+    ) -> None:
+        payload = {
+            "expected_return_date": datetime.date.today() + datetime.timedelta(weeks=1),
+            "book": sample_book().id,
+        }
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(BORROWING_URL, payload)
+        payment = Payment.objects.first()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(payment.session_state, Payment.EnumSessionState.PENDING)
+        self.assertIsNone(payment.session_url)
+        enqueue.assert_called_once_with(payment.id)
+
+    @mock.patch(
+        "borrowing.tasks.create_stripe_session",
+        return_value=("https://checkout.stripe.com/c/pay/cs_1", "cs_1", EXPIRES_AT),
+    )
+    def test_task_fills_in_session(self, create_stripe_session: mock.Mock) -> None:
+        payment = self.sample_payment()
+
+        create_payment_session(payment.id)
+        create_payment_session(payment.id)
+        payment.refresh_from_db()
+
+        self.assertEqual(payment.session_state, Payment.EnumSessionState.READY)
+        self.assertEqual(payment.session_id, "cs_1")
+        self.assertEqual(payment.session_expires_at, EXPIRES_AT)
+        create_stripe_session.assert_called_once()
+
+    @mock.patch("borrowing.tasks.create_stripe_session")
+    def test_task_passes_return_date_for_fines(
+        self, create_stripe_session: mock.Mock
+    ) -> None:
+        create_stripe_session.return_value = (
+            "https://checkout.stripe.com",
+            "cs_2",
+            EXPIRES_AT,
+        )
+        self.borrowing.actual_return_date = self.borrowing.expected_return_date + (
+            datetime.timedelta(days=2)
+        )
+        self.borrowing.save()
+        payment = self.sample_payment(type="FINE")
+
+        create_payment_session(payment.id)
+
+        create_stripe_session.assert_called_once_with(
+            self.borrowing, act_ret_date=self.borrowing.actual_return_date
+        )
+
+    @mock.patch(
+        "borrowing.tasks.create_stripe_session",
+        return_value=ValidationError("Stripe is unavailable"),
+    )
+    def test_task_marks_session_failed(self, create_stripe_session: mock.Mock) -> None:
+        payment = self.sample_payment()
+
+        create_payment_session(payment.id)
+        payment.refresh_from_db()
+
+        self.assertEqual(payment.session_state, Payment.EnumSessionState.FAILED)
+
+    @mock.patch("borrowing.tasks.create_payment_session.delay")
+    def test_enqueue_survives_broker_outage(self, delay: mock.Mock) -> None:
+        delay.side_effect = OperationalError("connection refused")
+
+        enqueue_payment_session(1)
+
+        delay.assert_called_once_with(1)
+
+    @mock.patch("borrowing.tasks.enqueue_payment_session")
+    def test_sweeper_requeues_stale_sessions(self, enqueue: mock.Mock) -> None:
+        stale = self.sample_payment()
+        self.sample_payment()
+        self.sample_payment(session_state=Payment.EnumSessionState.READY)
+        Payment.objects.filter(pk=stale.pk).update(
+            updated_at=timezone.now() - PENDING_SESSION_TIMEOUT * 2
+        )
+
+        self.assertEqual(sweep_pending_payment_sessions(), 1)
+        enqueue.assert_called_once_with(stale.id)
+        self.assertEqual(sweep_pending_payment_sessions(), 0)
@@ -0,0 +1,154 @@
+import datetime
+from decimal import Decimal
+from unittest import mock
+
+import stripe
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from borrowing.fake_stripe import FakeStripe
+from borrowing.gateway import StripeGateway
+from borrowing.models import Payment, ReconciliationCheckpoint
+from borrowing.payments import (
+    FULL_RECONCILIATION,
+    RECONCILIATION,
+    reconcile_chunk,
+    reconcile_payments,
+)
+from borrowing.stripe import SESSION_LIFETIME
+from user.models import UserBorrowingStats
+from .test_borrowing_api import sample_book, sample_borrowing
+
+
+@mock.patch("borrowing.telegram_notification.schedule_dispatch")
+@mock.patch("borrowing.payments.RECONCILE_CHUNK", 3)
+@mock.patch("borrowing.payments.STRIPE_PAGE_SIZE", 2)
+class ReconciliationTests(TestCase):
+    def setUp(self) -> None:
+        self.fake = FakeStripe().__enter__()
+        self.addCleanup(self.fake.__exit__)
+        self.gateway = StripeGateway(api_key="sk_test_fake", api_base=self.fake.url)
+
+        self.user = get_user_model().objects.create_user("test@test.com", "pass")
+        self.book = sample_book()
+        now = timezone.now()
+        # expired sessions, every other one paid with its webhook lost
+        self.payments = [
+            self.sample_payment(
+                now - datetime.timedelta(minutes=50 - 10 * number),
+                paid=bool(number % 2),
+            )
+            for number in range(5)
+        ]
+        # sessions of other customers share the listing
+        for _ in range(4):
+            self.fake.add_session(payment_status="paid")
+
+    def sample_payment(self, expires_at: datetime.datetime, paid: bool) -> Payment:
+        session = self.fake.add_session(
+            created=int((expires_at - SESSION_LIFETIME).timestamp()),
+            payment_status="paid" if paid else "unpaid",
+        )
+        return Payment.objects.create(
+            status="PENDING",
+            type="PAYMENT",
+            borrowing=sample_borrowing(book=self.book, user=self.user),
+            session_id=session["id"],
+            session_state=Payment.EnumSessionState.READY,
+            session_expires_at=expires_at,
+            money_to_pay=10,
+        )
+
+    def test_pass_settles_paid_sessions(self, *mocks: mock.Mock) -> None:
+        self.assertEqual(reconcile_payments(self.gateway), (5, 2))
+
+        self.assertEqual(
+            [payment.status for payment in Payment.objects.order_by("id")],
+            ["PENDING", "PAID", "PENDING", "PAID", "PENDING"],
+        )
+        self.assertEqual(
+            UserBorrowingStats.objects.get(user=self.user).total_paid,
+            Decimal("20.00"),
+        )
+        # the next pass only checks sessions expiring from now on
+        self.assertEqual(reconcile_payments(self.gateway), (0, 0))
+
+    def test_live_sessions_are_not_checked(self, *mocks: mock.Mock) -> None:
+        live = self.sample_payment(
+            timezone.now() + datetime.timedelta(minutes=5), paid=True
+        )
+
+        self.assertEqual(reconcile_payments(self.gateway), (5, 2))
+
+        self.assertEqual(Payment.objects.get(pk=live.pk).status, "PENDING")
+
+    def test_first_pass_starts_from_the_oldest_pending_session(
+        self, *mocks: mock.Mock
+    ) -> None:
+        stale = self.sample_payment(
+            timezone.now() - datetime.timedelta(days=30), paid=True
+        )
+
+        self.assertEqual(reconcile_payments(self.gateway), (6, 3))
+
+        self.assertEqual(Payment.objects.get(pk=stale.pk).status, "PAID")
+
+    def test_full_walk_checks_sessions_behind_the_checkpoint(
+        self, *mocks: mock.Mock
+    ) -> None:
+        reconcile_payments(self.gateway)
+        # stored before the expiry column, its session was never checked
+        written_at = timezone.now() - datetime.timedelta(days=30)
+        session = self.fake.add_session(
+            created=int(written_at.timestamp()), payment_status="paid"
+        )
+        legacy = self.sample_payment(written_at + SESSION_LIFETIME, paid=False)
+        Payment.objects.filter(pk=legacy.pk).update(
+            session_id=session["id"], session_expires_at=None, updated_at=written_at
+        )
+
+        self.assertEqual(reconcile_payments(self.gateway), (0, 0))
+        with mock.patch(
+            "borrowing.management.commands.reconcile_stripe.gateway", self.gateway
+        ):
+            call_command("reconcile_stripe", stdout=mock.Mock())
+
+        self.assertEqual(Payment.objects.get(pk=legacy.pk).status, "PAID")
+        self.assertTrue(
+            ReconciliationCheckpoint.objects.filter(name=FULL_RECONCILIATION).exists()
+        )
+
+    def test_pass_resumes_from_the_checkpoint(self, *mocks: mock.Mock) -> None:
+        now = timezone.now()
+        self.assertEqual(reconcile_chunk(self.gateway, now), (3, 1))
+        checkpoint = ReconciliationCheckpoint.objects.get(name=RECONCILIATION)
+        self.assertEqual(checkpoint.last_payment_id, self.payments[2].id)
+        self.assertEqual(
+            checkpoint.last_expires_at, self.payments[2].session_expires_at
+        )
+
+        self.fake.pay(self.payments[0].session_id)
+        self.assertEqual(reconcile_chunk(self.gateway, now), (2, 1))
+
+        # a session is checked once, after it expired
+        self.assertEqual(Payment.objects.get(pk=self.payments[0].pk).status, "PENDING")
+        self.assertIsNone(reconcile_chunk(self.gateway, now))
+
+    def test_stripe_outage_keeps_the_checkpoint(self, *mocks: mock.Mock) -> None:
+        gateway = StripeGateway(
+            api_key="sk_test_fake", api_base=self.fake.url, max_retries=0
+        )
+        self.fake.fail_next(1, status=503)
+
+        with self.assertRaises(stripe.error.APIError):
+            reconcile_chunk(gateway)
+
+        self.assertFalse(Payment.objects.filter(status="PAID").exists())
+        self.assertFalse(
+            ReconciliationCheckpoint.objects.filter(
+                last_expires_at__isnull=False
+            ).exists()
+        )
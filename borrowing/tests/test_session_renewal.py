@@ -0,0 +1,222 @@
+import datetime
+from unittest import mock
+
+import stripe
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from borrowing.fake_stripe import FakeStripe
+from borrowing.gateway import StripeGateway
+from borrowing.models import Borrowing, Payment
+from borrowing.payments import (
+    MAX_SESSION_RENEWALS,
+    RENEW_CLAIM_TIMEOUT,
+    claim_expiring_sessions as real_claim_expiring_sessions,
+    renew_expiring_sessions,
+)
+from .test_borrowing_api import sample_book, sample_borrowing
+
+
+class SessionRenewalTests(TestCase):
+    def setUp(self) -> None:
+        self.fake = FakeStripe().__enter__()
+        self.addCleanup(self.fake.__exit__)
+        self.gateway = StripeGateway(api_key="sk_test_fake", api_base=self.fake.url)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user("test@test.com", "pass")
+        self.client.force_authenticate(self.user)
+        self.now = timezone.now()
+
+    def sample_payment(self, expires_in: int, **params: dict) -> Payment:
+        session = self.fake.add_session()
+        defaults = {
+            "status": "PENDING",
+            "type": "PAYMENT",
+            "borrowing": sample_borrowing(book=sample_book(), user=self.user),
+            "session_url": session["url"],
+            "session_id": session["id"],
+            "session_state": Payment.EnumSessionState.READY,
+            "session_expires_at": self.now + datetime.timedelta(minutes=expires_in),
+            "money_to_pay": 10,
+        }
+        defaults.update(params)
+        return Payment.objects.create(**defaults)
+
+    def cancel(self, payment: Payment) -> object:
+        url = reverse(
+            "borrowing:borrowing-borrowing-payment-is-cancelled",
+            args=[payment.borrowing_id],
+        )
+        return self.client.get(url, {"session_id": payment.session_id})
+
+    def test_expiring_session_is_replaced(self) -> None:
+        expiring = self.sample_payment(expires_in=5)
+        later = self.sample_payment(expires_in=25)
+
+        self.assertEqual(renew_expiring_sessions(self.gateway), 1)
+
+        expiring.refresh_from_db()
+        self.assertNotEqual(expiring.session_id, later.session_id)
+        self.assertEqual(expiring.session_renewals, 1)
+        self.assertGreater(
+            expiring.session_expires_at, self.now + datetime.timedelta(minutes=25)
+        )
+        self.assertEqual(
+            expiring.session_url, self.fake.sessions[expiring.session_id]["url"]
+        )
+        # the old session cannot be paid any more
+        self.assertEqual(
+            [session["status"] for session in self.fake.sessions.values()],
+            ["expired", "open", "open"],
+        )
+        later.refresh_from_db()
+        self.assertEqual(later.session_renewals, 0)
+
+    def test_checkout_payments_get_one_new_session(self) -> None:
+        first = self.sample_payment(expires_in=-1)
+        second = self.sample_payment(
+            expires_in=-1, session_id=first.session_id, session_url=first.session_url
+        )
+
+        self.assertEqual(renew_expiring_sessions(self.gateway), 1)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.session_id, second.session_id)
+        self.assertEqual(self.fake.sessions[first.session_id]["amount_total"], 10584)
+
+    def test_fine_session_charges_the_fine(self) -> None:
+        payment = self.sample_payment(expires_in=5, type="FINE")
+        Borrowing.objects.filter(pk=payment.borrowing_id).update(
+            actual_return_date=payment.borrowing.expected_return_date
+            + datetime.timedelta(days=3)
+        )
+
+        renew_expiring_sessions(self.gateway)
+
+        payment.refresh_from_db()
+        # 2 * 3 overdue days * 3.78
+        self.assertEqual(self.fake.sessions[payment.session_id]["amount_total"], 2268)
+
+    def test_paid_and_exhausted_sessions_are_left_alone(self) -> None:
+        paid = self.sample_payment(expires_in=5)
+        self.fake.pay(paid.session_id)
+        self.sample_payment(expires_in=5, session_renewals=MAX_SESSION_RENEWALS)
+
+        self.assertEqual(renew_expiring_sessions(self.gateway), 0)
+        self.assertEqual(len(self.fake.sessions), 2)
+
+    def test_cancel_returns_the_live_session(self) -> None:
+        payment = self.sample_payment(expires_in=20)
+
+        response = self.cancel(payment)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(payment.session_url, response.data["Cancel"])
+        self.assertEqual(self.fake.counters["requests"], 0)
+
+    def test_cancel_picks_the_payment_of_the_session(self) -> None:
+        fee = self.sample_payment(expires_in=20)
+        fine = self.sample_payment(expires_in=20, type="FINE", borrowing=fee.borrowing)
+
+        self.assertIn(fee.session_url, self.cancel(fee).data["Cancel"])
+        self.assertIn(fine.session_url, self.cancel(fine).data["Cancel"])
+
+    def test_cancel_needs_the_session_id(self) -> None:
+        payment = self.sample_payment(expires_in=20)
+        url = reverse(
+            "borrowing:borrowing-borrowing-payment-is-cancelled",
+            args=[payment.borrowing_id],
+        )
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cancel_of_an_expired_session_waits_for_the_sweep(self) -> None:
+        payment = self.sample_payment(expires_in=-5)
+
+        response = self.cancel(payment)
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(renew_expiring_sessions(self.gateway), 1)
+        self.assertEqual(self.cancel(payment).status_code, status.HTTP_200_OK)
+
+    def test_cancel_does_not_renew_exhausted_sessions(self) -> None:
+        payment = self.sample_payment(
+            expires_in=-5, session_renewals=MAX_SESSION_RENEWALS
+        )
+
+        response = self.cancel(payment)
+
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertEqual(renew_expiring_sessions(self.gateway), 0)
+
+    def test_cancel_of_a_failed_session_is_a_conflict(self) -> None:
+        payment = self.sample_payment(
+            expires_in=20, session_state=Payment.EnumSessionState.FAILED
+        )
+
+        response = self.cancel(payment)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    @mock.patch("borrowing.payments.RENEW_BATCH", 1)
+    def test_checkout_is_claimed_as_a_whole(self) -> None:
+        first = self.sample_payment(expires_in=1)
+        second = self.sample_payment(
+            expires_in=9, session_id=first.session_id, session_url=first.session_url
+        )
+        claimed = []
+
+        def claim_expiring_sessions(now: datetime.datetime) -> dict:
+            sessions = real_claim_expiring_sessions(now)
+            claimed.extend(Payment.objects.values_list("session_state", flat=True))
+            return sessions
+
+        with mock.patch(
+            "borrowing.payments.claim_expiring_sessions",
+            side_effect=claim_expiring_sessions,
+        ):
+            self.assertEqual(renew_expiring_sessions(self.gateway), 1)
+
+        self.assertEqual(claimed, [Payment.EnumSessionState.RENEWING] * 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.session_id, second.session_id)
+        self.assertEqual(first.session_state, Payment.EnumSessionState.READY)
+        self.assertEqual(self.fake.sessions[first.session_id]["amount_total"], 10584)
+
+    def test_failed_renewal_hands_the_claim_back(self) -> None:
+        payment = self.sample_payment(expires_in=5)
+
+        with mock.patch(
+            "borrowing.payments.create_stripe_session",
+            side_effect=stripe.error.APIError("Stripe is down"),
+        ), self.assertLogs("borrowing.payments", "WARNING"):
+            self.assertEqual(renew_expiring_sessions(self.gateway), 0)
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.session_state, Payment.EnumSessionState.READY)
+        # the old session is expired on Stripe, its link is not handed out
+        self.assertLessEqual(payment.session_expires_at, timezone.now())
+        self.assertEqual(self.cancel(payment).status_code, status.HTTP_202_ACCEPTED)
+
+        self.assertEqual(renew_expiring_sessions(self.gateway), 1)
+
+    def test_claims_of_a_dead_sweep_are_taken_over(self) -> None:
+        payment = self.sample_payment(
+            expires_in=5, session_state=Payment.EnumSessionState.RENEWING
+        )
+        self.assertEqual(renew_expiring_sessions(self.gateway), 0)
+
+        Payment.objects.filter(pk=payment.pk).update(
+            updated_at=self.now - RENEW_CLAIM_TIMEOUT
+        )
+
+        self.assertEqual(renew_expiring_sessions(self.gateway), 1)
@@ -0,0 +1,114 @@
+import datetime
+from unittest import mock
+
+import stripe
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+
+from borrowing.fake_stripe import FakeStripe
+from borrowing.gateway import CircuitBreaker, CircuitOpenError, StripeGateway
+from borrowing.stripe import create_stripe_session
+from .test_borrowing_api import sample_book, sample_borrowing
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+# the retries of the Stripe client do not wait between attempts
+@mock.patch("stripe.http_client.HTTPClient._sleep_time_seconds", return_value=0)
+class StripeGatewayTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.fake = FakeStripe().__enter__()
+        self.addCleanup(self.fake.__exit__)
+        self.clock = FakeClock()
+
+    def gateway(self, **params: dict) -> StripeGateway:
+        params = {
+            "api_key": "sk_test_fake",
+            "api_base": self.fake.url,
+            "breaker": CircuitBreaker(threshold=2, reset_timeout=30, clock=self.clock),
+            **params,
+        }
+        return StripeGateway(**params)
+
+    def test_sessions_share_pooled_connections(self, sleep: mock.Mock) -> None:
+        gateway = self.gateway()
+
+        sessions = [gateway.create_session(mode="payment") for _ in range(5)]
+        retrieved = gateway.retrieve_session(sessions[0].id)
+
+        self.assertEqual(retrieved.url, sessions[0].url)
+        self.assertEqual(self.fake.counters["requests"], 6)
+        self.assertEqual(self.fake.counters["connections"], 1)
+
+    def test_retries_are_bounded_and_idempotent(self, sleep: mock.Mock) -> None:
+        gateway = self.gateway(max_retries=1)
+
+        self.fake.fail_next(1)
+        gateway.create_session(mode="payment")
+        self.assertEqual(len(self.fake.sessions), 1)
+
+        self.fake.fail_next(2)
+        with self.assertRaises(stripe.error.APIError):
+            gateway.create_session(mode="payment")
+        self.assertEqual(self.fake.counters["requests"], 4)
+
+    def test_slow_stripe_times_out(self, sleep: mock.Mock) -> None:
+        self.fake.latency = 0.5
+        gateway = self.gateway(read_timeout=0.05, max_retries=0)
+
+        with self.assertRaises(stripe.error.APIConnectionError):
+            gateway.create_session(mode="payment")
+
+    def test_breaker_fails_fast_during_an_outage(self, sleep: mock.Mock) -> None:
+        gateway = self.gateway(max_retries=0)
+        self.fake.fail_next(3, status=503)
+
+        for _ in range(2):
+            with self.assertRaises(stripe.error.APIError):
+                gateway.create_session(mode="payment")
+        with self.assertRaises(CircuitOpenError):
+            gateway.create_session(mode="payment")
+        self.assertEqual(self.fake.counters["requests"], 2)
+        self.assertEqual(gateway.breaker.state, "open")
+
+        # the trial call fails and opens the circuit again
+        self.clock.now = 30
+        with self.assertRaises(stripe.error.APIError):
+            gateway.create_session(mode="payment")
+        self.assertEqual(gateway.breaker.state, "open")
+
+        self.clock.now = 60
+        gateway.create_session(mode="payment")
+        self.assertEqual(gateway.breaker.state, "closed")
+
+    def test_rejected_requests_do_not_open_the_circuit(self, sleep: mock.Mock) -> None:
+        gateway = self.gateway()
+
+        for _ in range(3):
+            with self.assertRaises(stripe.error.InvalidRequestError):
+                gateway.retrieve_session("cs_missing")
+        self.assertEqual(gateway.breaker.state, "closed")
+
+
+class CreateStripeSessionTests(TestCase):
+    def test_checkout_session_through_the_gateway(self) -> None:
+        user = get_user_model().objects.create_user("test@test.com", "pass")
+        borrowing = sample_borrowing(
+            book=sample_book(daily_fee=2),
+            user=user,
+            expected_return_date=datetime.date.today() + datetime.timedelta(days=7),
+        )
+
+        with FakeStripe() as fake:
+            gateway = StripeGateway(api_key="sk_test_fake", api_base=fake.url)
+            with mock.patch("borrowing.stripe.gateway", gateway):
+                session_url, session_id, _ = create_stripe_session(borrowing)
+
+        self.assertEqual(fake.sessions[session_id]["url"], session_url)
+        self.assertEqual(fake.sessions[session_id]["amount_total"], 1400)
@@ -0,0 +1,169 @@
+import hashlib
+import hmac
+import os
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from kombu.exceptions import OperationalError
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from borrowing.models import Payment, StripeEvent
+from borrowing.payments import handle_stripe_event
+from user.models import UserBorrowingStats
+from .test_borrowing_api import sample_book, sample_borrowing
+
+WEBHOOK_URL = reverse("borrowing:stripe-webhook")
+WEBHOOK_SECRET = "whsec_test_secret"
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "stripe")
+SESSION_ID = "cs_test_a1Xk9Lz3Rw5UPlT3Q8bPaid"
+
+
+def recorded_event(event_type: str) -> bytes:
+    with open(os.path.join(FIXTURES, f"{event_type}.json"), "rb") as payload:
+        return payload.read()
+
+
+def signature(payload: bytes, secret: str = WEBHOOK_SECRET) -> str:
+    """The Stripe-Signature header of a delivery signed now"""
+
+    timestamp = int(time.time())
+    signed = f"{timestamp}.".encode() + payload
+    digest = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+@mock.patch("borrowing.telegram_notification.schedule_dispatch")
+@mock.patch("borrowing.views.process_stripe_event")
+class StripeWebhookTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user("test@test.com", "pass")
+        self.borrowing = sample_borrowing(book=sample_book(), user=self.user)
+        self.payment = Payment.objects.create(
+            status="PENDING",
+            type="PAYMENT",
+            borrowing=self.borrowing,
+            session_id=SESSION_ID,
+            session_url="https://checkout.stripe.com/c/pay/" + SESSION_ID,
+            session_state=Payment.EnumSessionState.READY,
+            money_to_pay=Decimal("52.92"),
+        )
+
+    def deliver(self, event_type: str, secret: str = WEBHOOK_SECRET) -> object:
+        payload = recorded_event(event_type)
+        return self.client.post(
+            WEBHOOK_URL,
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=signature(payload, secret),
+        )
+
+    def success(self, **params: dict) -> object:
+        self.client.force_authenticate(self.user)
+        url = reverse(
+            "borrowing:borrowing-borrowing-is-successfully-paid",
+            kwargs={"pk": self.borrowing.id},
+        )
+        return self.client.get(url, {"session_id": SESSION_ID, **params})
+
+    def test_completed_session_marks_payment_paid(
+        self, process_stripe_event: mock.Mock, *mocks: mock.Mock
+    ) -> None:
+        self.assertEqual(self.success().status_code, status.HTTP_202_ACCEPTED)
+
+        response = self.deliver("checkout.session.completed")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        process_stripe_event.delay.assert_called_once_with(
+            "evt_1NGqbLIdyvwUPlT3bH4Z0mQa"
+        )
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "PENDING")
+
+        handle_stripe_event("evt_1NGqbLIdyvwUPlT3bH4Z0mQa")
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "PAID")
+        self.assertIsNotNone(self.payment.paid_at)
+        self.assertEqual(self.success().status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            UserBorrowingStats.objects.get(user=self.user).total_paid,
+            Decimal("52.92"),
+        )
+
+    def test_redelivered_event_is_processed_once(
+        self, process_stripe_event: mock.Mock, *mocks: mock.Mock
+    ) -> None:
+        self.deliver("checkout.session.completed")
+        handle_stripe_event("evt_1NGqbLIdyvwUPlT3bH4Z0mQa")
+        handle_stripe_event("evt_1NGqbLIdyvwUPlT3bH4Z0mQa")
+
+        response = self.deliver("checkout.session.completed")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        process_stripe_event.delay.assert_called_once()
+        self.assertEqual(
+            UserBorrowingStats.objects.get(user=self.user).total_paid,
+            Decimal("52.92"),
+        )
+
+    def test_other_events_leave_payments_alone(
+        self, process_stripe_event: mock.Mock, *mocks: mock.Mock
+    ) -> None:
+        self.deliver("checkout.session.expired")
+        handle_stripe_event("evt_1NGs0aIdyvwUPlT3kXv7ExPd")
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "PENDING")
+        self.assertIsNotNone(StripeEvent.objects.get().processed_at)
+
+    def test_unsigned_delivery_is_rejected(
+        self, process_stripe_event: mock.Mock, *mocks: mock.Mock
+    ) -> None:
+        response = self.deliver("checkout.session.completed", secret="whsec_other")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+        process_stripe_event.delay.assert_not_called()
+
+    @override_settings(STRIPE_WEBHOOK_SECRET=None)
+    def test_delivery_without_a_secret_is_refused(
+        self, process_stripe_event: mock.Mock, *mocks: mock.Mock
+    ) -> None:
+        response = self.deliver("checkout.session.completed")
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_success_needs_a_session_of_the_borrowing(
+        self, process_stripe_event: mock.Mock, *mocks: mock.Mock
+    ) -> None:
+        # a payment of another borrowing without a session yet
+        Payment.objects.create(
+            status="PAID",
+            type="PAYMENT",
+            borrowing=sample_borrowing(book=sample_book(), user=self.user),
+        )
+
+        self.assertEqual(
+            self.success(session_id="").status_code, status.HTTP_400_BAD_REQUEST
+        )
+        self.assertEqual(
+            self.success(session_id="cs_other").status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    def test_unreachable_broker_asks_stripe_to_redeliver(
+        self, process_stripe_event: mock.Mock, *mocks: mock.Mock
+    ) -> None:
+        process_stripe_event.delay.side_effect = OperationalError
+
+        response = self.deliver("checkout.session.completed")
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
@@ -2,18 +2,26 @@ from django.urls import path, include
 from rest_framework import routers
 
 from borrowing.views import (
+    AnalyticsView,
     BorrowingViewSet,
+    HoldViewSet,
     PaymentListView,
     PaymentDetailView,
+    ProjectedFinesView,
+    StripeWebhookView,
 )
 
 router = routers.DefaultRouter()
 router.register("borrowings", BorrowingViewSet, basename="borrowing")
+router.register("holds", HoldViewSet, basename="hold")
 
 
 urlpatterns = [
     path("", include(router.urls)),
     path("payments/", PaymentListView.as_view(), name="payments-list"),
     path("payments/<int:pk>/", PaymentDetailView.as_view(), name="payment-detail"),
+    path("payments/webhook/", StripeWebhookView.as_view(), name="stripe-webhook"),
+    path("analytics/", AnalyticsView.as_view(), name="analytics"),
+    path("fines/", ProjectedFinesView.as_view(), name="projected-fines"),
 ]
 app_name = "borrowing"
@@ -1,46 +1,93 @@
-import asyncio
-from typing import Type, Optional
+from typing import List, Type, Optional
 
 import stripe
-from django.db.models import QuerySet
+from django.conf import settings
+from django.db.models import (
+    Case,
+    Count,
+    OuterRef,
+    Prefetch,
+    QuerySet,
+    Subquery,
+    When,
+)
+from django.http import Http404, HttpResponse
+from django.utils import timezone
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from rest_framework import viewsets, mixins, status, generics
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404
+from kombu.exceptions import OperationalError
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.serializers import Serializer
-
-from borrowing.models import Borrowing, Payment
-from borrowing.pagination import OrderPagination
+from rest_framework.views import APIView
+
+from book.conditional import ConditionalGetMixin
+from book.models import Book
+from borrowing.analytics import analytics_report
+from borrowing.fines import projected_fines
+from borrowing.holds import cancel_hold
+from borrowing.models import Borrowing, Hold, Payment
+from borrowing.pagination import (
+    CursorPaginationMixin,
+    EstimatedCountPagination,
+    OrderPagination,
+)
+from borrowing.payments import MAX_SESSION_RENEWALS, receive_stripe_event
 from borrowing.permissions import IsOwnerOrReadOnly
 from borrowing.serializers import (
+    BORROWING_LIST_VALUES,
+    AnalyticsQuerySerializer,
+    borrowing_list_rows,
+    payment_rows,
     BorrowingSerializer,
+    BorrowingBulkReturnSerializer,
+    BorrowingCheckoutSerializer,
     BorrowingListSerializer,
     BorrowingCreateSerializer,
     BorrowingDetailSerializer,
     BorrowingReturnSerializer,
+    HoldCreateSerializer,
+    HoldSerializer,
     PaymentSerializer,
     PaymentCreateSerializer,
 )
-from borrowing.telegram_notification import send_message
+from borrowing.tasks import process_stripe_event
 
 
 class BorrowingViewSet(
+    ConditionalGetMixin,
+    CursorPaginationMixin,
     mixins.ListModelMixin,
     mixins.CreateModelMixin,
     mixins.RetrieveModelMixin,
     viewsets.GenericViewSet,
 ):
     serializer_class = BorrowingSerializer
-    pagination_class = OrderPagination
+    pagination_class = EstimatedCountPagination
+    # set to False to list through the DRF serializers
+    use_fast_list = True
+    conditional_timestamps = (
+        "updated_at",
+        "payments__updated_at",
+        "book__updated_at",
+    )
+    conditional_counts = ("pk", "payments")
 
     def get_queryset(self) -> QuerySet:
-        queryset = Borrowing.objects.select_related("book", "user").prefetch_related(
-            "payments"
-        )
+        queryset = Borrowing.objects.select_related("user").prefetch_related("payments")
+
+        if self.action == "retrieve":
+            # the detail view nests the book, show the live stock of striped books
+            queryset = queryset.prefetch_related(
+                Prefetch("book", queryset=Book.objects.with_live_inventory())
+            )
+        else:
+            queryset = queryset.select_related("book")
 
         user_id = self.request.query_params.get("user_id")
         is_active = self.request.query_params.get("is_active")
@@ -84,6 +131,45 @@ class BorrowingViewSet(
         serializer.save()
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @action(
+        methods=["POST"],
+        detail=False,
+        url_path="checkout",
+        serializer_class=BorrowingCheckoutSerializer,
+    )
+    def checkout(self, request: Request) -> Response:
+        """Borrow several books in one request with a single payment session"""
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        borrowings = (
+            Borrowing.objects.filter(
+                id__in=[
+                    borrowing.id for borrowing in serializer.save(user=request.user)
+                ]
+            )
+            .select_related("book", "user")
+            .prefetch_related("payments")
+        )
+        return Response(
+            BorrowingListSerializer(borrowings, many=True).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+    @action(
+        methods=["POST"],
+        detail=False,
+        url_path="bulk-return",
+        permission_classes=[IsAdminUser],
+        serializer_class=BorrowingBulkReturnSerializer,
+    )
+    def bulk_return(self, request: Request) -> Response:
+        """Staff check-in of many borrowings with a per-item result"""
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({"results": serializer.save()}, status=status.HTTP_200_OK)
+
     @action(
         methods=["GET"],
         detail=True,
@@ -97,21 +183,27 @@ class BorrowingViewSet(
 
         borrowing = self.get_object()
         session_id = request.query_params.get("session_id")
-        payment = Payment.objects.get(session_id=session_id)
-        session = stripe.checkout.Session.retrieve(session_id)
-
-        if session["payment_status"] == "paid":
-            payment.status = "PAID"
-            payment.save()
+        if not session_id:
+            raise ValidationError({"session_id": "This parameter is required."})
+
+        # the Stripe webhook marks the payments paid, the redirect may come
+        # before it does
+        statuses = set(
+            borrowing.payments.filter(session_id=session_id).values_list(
+                "status", flat=True
+            )
+        )
+        if not statuses:
+            raise Http404
 
-            message = f"{payment.borrowing.book.title} was paid."
-            asyncio.run(send_message(message=message))
+        if "PENDING" not in statuses:
             serializer = self.get_serializer(borrowing)
 
             return Response(serializer.data, status=status.HTTP_200_OK)
 
         return Response(
-            {"Fail": "Payment wasn't successful."}, status=status.HTTP_400_BAD_REQUEST
+            {"Pending": "The payment is not confirmed yet, check again later."},
+            status=status.HTTP_202_ACCEPTED,
         )
 
     @action(
@@ -126,13 +218,48 @@ class BorrowingViewSet(
 
         borrowing = self.get_object()
         session_id = request.query_params.get("session_id")
-        session = stripe.checkout.Session.retrieve(session_id)
+        if not session_id:
+            raise ValidationError({"session_id": "This parameter is required."})
+
+        # the fee and a fine may both be pending, the session of the redirect
+        # tells them apart unless it has been renewed since
+        payments = borrowing.payments.filter(status="PENDING")
+        payment = payments.filter(session_id=session_id).first() or payments.first()
+        if payment is None:
+            raise Http404
+
+        if payment.session_state == Payment.EnumSessionState.FAILED:
+            return Response(
+                {
+                    "Cancel": "The payment link could not be created, "
+                    "please contact the library."
+                },
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        expires_at = payment.session_expires_at
+        expired = expires_at is not None and expires_at <= timezone.now()
+        if expired and payment.session_renewals >= MAX_SESSION_RENEWALS:
+            return Response(
+                {"Cancel": "The payment link expired, please contact the library."},
+                status=status.HTTP_410_GONE,
+            )
+
+        if payment.session_state != Payment.EnumSessionState.READY or expired:
+            # the session task or the renewal sweeper prepares the link
+            return Response(
+                {
+                    "Pending": "A new payment link is being prepared, "
+                    "check again in a few minutes."
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
 
         return Response(
             {
                 "Cancel": f"The payment for the {borrowing} is cancelled. "
                 f"Make sure to pay during 24 hours. Payment url: "
-                f"{session.url}. Thanks!"
+                f"{payment.session_url}. Thanks!"
             },
             status=status.HTTP_200_OK,
         )
@@ -149,19 +276,152 @@ class BorrowingViewSet(
                 type=OpenApiTypes.NUMBER,
                 description="Filtering by specified user (ex. ?user_id=4)",
             ),
+            OpenApiParameter(
+                "pagination",
+                type=OpenApiTypes.STR,
+                description="Keyset pagination without counts (ex. ?pagination=cursor)",
+            ),
         ]
     )
-    def list(self, request: Request, *args: tuple, **kwargs: dict) -> Response:
-        return super().list(request, *args, **kwargs)
+    def list(
+        self, request: Request, *args: tuple, **kwargs: dict
+    ) -> Response | HttpResponse:
+        queryset = self.filter_queryset(self.get_queryset())
+        key = [request.user.id, sorted(request.query_params.lists())]
+
+        # the state of the requested page, not of the whole history: the ids
+        # on the page and whether another page follows
+        page_ids = None
+        rows = self.paginate_queryset(queryset.prefetch_related(None).values("id"))
+        if rows is not None:
+            page_ids = [row["id"] for row in rows]
+            queryset = Borrowing.objects.filter(pk__in=page_ids)
+            key += [page_ids, self.paginator.get_next_link()]
+
+        etag = self.get_conditional_state(queryset, *key)
+        return self.conditional_response(
+            request,
+            etag,
+            lambda: (
+                self.fast_list(request, page_ids)
+                if self.use_fast_list
+                else super(BorrowingViewSet, self).list(request, *args, **kwargs)
+            ),
+        )
+
+    def fast_list(self, request: Request, page_ids: Optional[List[int]]) -> Response:
+        """The BorrowingListSerializer output built from ``.values()`` rows"""
+
+        queryset = (
+            self.filter_queryset(self.get_queryset())
+            .prefetch_related(None)
+            .values(*BORROWING_LIST_VALUES)
+        )
+        if page_ids is not None:
+            # the page is already paginated for the ETag, both in -id order
+            rows = queryset.filter(pk__in=page_ids)
+            return self.get_paginated_response(borrowing_list_rows(rows))
+        return Response(borrowing_list_rows(queryset))
+
+    def retrieve(
+        self, request: Request, *args: tuple, **kwargs: dict
+    ) -> Response | HttpResponse:
+        try:
+            queryset = self.get_queryset().filter(pk=kwargs["pk"])
+        except (TypeError, ValueError):
+            raise Http404
+
+        # striped stock moves without touching book.updated_at
+        stock = list(
+            Book.objects.filter(borrowings__in=queryset)
+            .with_live_inventory()
+            .values_list("live_inventory", flat=True)
+        )
+        etag = self.get_conditional_state(queryset, request.user.id, stock)
+        return self.conditional_response(
+            request,
+            etag,
+            lambda: super(BorrowingViewSet, self).retrieve(request, *args, **kwargs),
+        )
 
     def perform_create(self, serializer: Serializer) -> None:
         serializer.save(user=self.request.user)
 
 
-class PaymentListView(generics.ListCreateAPIView):
+class HoldViewSet(
+    mixins.ListModelMixin,
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
+):
+    """Queue up for out of stock books"""
+
+    serializer_class = HoldSerializer
+    pagination_class = OrderPagination
+
+    def get_queryset(self) -> QuerySet:
+        # the place in line of a waiting hold, counted over the partial queue index
+        ahead = (
+            Hold.objects.filter(
+                book=OuterRef("book"),
+                status=Hold.EnumStatus.WAITING,
+                id__lte=OuterRef("id"),
+            )
+            .order_by()
+            .values("book")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        queryset = (
+            Hold.objects.select_related("book")
+            .annotate(
+                position=Case(
+                    When(status=Hold.EnumStatus.WAITING, then=Subquery(ahead)),
+                    default=None,
+                )
+            )
+            .order_by("-id")
+        )
+
+        if self.request.user.is_staff:
+            return queryset
+        return queryset.filter(user=self.request.user)
+
+    def get_serializer_class(self) -> Type[Serializer]:
+        if self.action == "create":
+            return HoldCreateSerializer
+
+        return super().get_serializer_class()
+
+    def create(self, request: Request, *args: tuple, **kwargs: dict) -> Response:
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        hold = serializer.save(user=request.user)
+        return Response(
+            HoldSerializer(self.get_queryset().get(pk=hold.pk)).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+    @action(
+        methods=["POST"],
+        detail=True,
+        url_path="cancel",
+        permission_classes=[IsOwnerOrReadOnly],
+    )
+    def cancel(self, request: Request, pk: Optional[int] = None) -> Response:
+        """Leave the queue, an allocated copy goes to the next in line"""
+
+        hold = self.get_object()
+        cancel_hold(hold)
+        return Response(HoldSerializer(self.get_queryset().get(pk=hold.pk)).data)
+
+
+class PaymentListView(CursorPaginationMixin, generics.ListCreateAPIView):
     queryset = Payment.objects.select_related("borrowing__user", "borrowing__book")
     serializer_class = PaymentCreateSerializer
-    pagination_class = OrderPagination
+    pagination_class = EstimatedCountPagination
+    # set to False to list through PaymentSerializer
+    use_fast_list = True
 
     def get_queryset(self):
         if self.request.user.is_staff:
@@ -192,6 +452,14 @@ class PaymentListView(generics.ListCreateAPIView):
 
     def list(self, request: Request, *args: tuple, **kwargs: dict) -> Response:
         queryset = self.filter_queryset(self.get_queryset())
+
+        if self.use_fast_list:
+            rows = queryset.values(*PaymentSerializer.Meta.fields)
+            page = self.paginate_queryset(rows)
+            if page is not None:
+                return self.get_paginated_response(payment_rows(page))
+            return Response(payment_rows(rows))
+
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = PaymentSerializer(page, many=True)
@@ -213,3 +481,81 @@ class PaymentDetailView(generics.RetrieveAPIView):
                 super().get_queryset().filter(borrowing__user_id=self.request.user.id)
             )
         return super().get_queryset()
+
+
+class StripeWebhookView(APIView):
+    """Receiver of the signed Stripe events, the work is left to Celery"""
+
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    @extend_schema(request=None, responses=None)
+    def post(self, request: Request) -> Response:
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            # deliveries cannot be verified, Stripe retries them later
+            return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        try:
+            event = receive_stripe_event(
+                request.body, request.META.get("HTTP_STRIPE_SIGNATURE", "")
+            )
+        except (ValueError, stripe.error.SignatureVerificationError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        if event.processed_at is None:
+            try:
+                process_stripe_event.delay(event.event_id)
+            except OperationalError:
+                # Stripe delivers the event again later
+                return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(status=status.HTTP_200_OK)
+
+
+class AnalyticsView(generics.GenericAPIView):
+    """Staff dashboard figures read from the daily aggregate tables"""
+
+    serializer_class = AnalyticsQuerySerializer
+    permission_classes = (IsAdminUser,)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "start",
+                type=OpenApiTypes.DATE,
+                description="First day, 30 days before the end by default",
+            ),
+            OpenApiParameter(
+                "end", type=OpenApiTypes.DATE, description="Last day, today by default"
+            ),
+        ]
+    )
+    def get(self, request: Request) -> Response:
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(analytics_report(**serializer.validated_data))
+
+
+class ProjectedFinesView(APIView):
+    """Fines the active overdue borrowings accrued by the latest nightly
+    snapshot, users see their own"""
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "user_id",
+                type=OpenApiTypes.INT,
+                description="Staff only, fines of one user (ex. ?user_id=4)",
+            ),
+        ],
+        responses=OpenApiTypes.OBJECT,
+    )
+    def get(self, request: Request) -> Response:
+        user_id = request.user.id
+        if request.user.is_staff:
+            user_id = request.query_params.get("user_id")
+            if user_id is not None:
+                try:
+                    user_id = int(user_id)
+                except ValueError:
+                    raise ValidationError({"user_id": "A valid integer is required."})
+        return Response(projected_fines(user_id))
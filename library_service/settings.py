@@ -13,6 +13,7 @@ import os
 import socket
 from datetime import timedelta
 from pathlib import Path
+from celery.schedules import crontab
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "django_celery_beat",
     "debug_toolbar",
@@ -155,6 +157,10 @@ REST_FRAMEWORK = {
     "DEFAULT_THROTTLE_RATES": {"anon": "100/day", "user": "1000/day"},
 }
 
+# listings estimated above this many rows report the planner estimate
+# instead of an exact COUNT(*)
+PAGINATION_EXACT_COUNT_LIMIT = int(os.getenv("PAGINATION_EXACT_COUNT_LIMIT", 10_000))
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "Library Service API",
     "DESCRIPTION": "Book borrowing management",
@@ -179,13 +185,68 @@ SIMPLE_JWT = {
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
+# cache settings
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+
+if CACHE_REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
 # celery settings
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
 CELERY_TIMEZONE = "Europe/Kiev"
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+CELERY_BEAT_SCHEDULE = {
+    "sweep-pending-payment-sessions": {
+        "task": "borrowing.tasks.sweep_pending_payment_sessions",
+        "schedule": timedelta(minutes=5),
+    },
+    "dispatch-notifications": {
+        "task": "borrowing.telegram_notification.dispatch_notifications",
+        "schedule": timedelta(minutes=1),
+    },
+    "renew-payment-sessions": {
+        "task": "borrowing.tasks.renew_payment_sessions",
+        "schedule": timedelta(minutes=5),
+    },
+    "reconcile-stripe-payments": {
+        "task": "borrowing.tasks.reconcile_stripe_payments",
+        "schedule": timedelta(minutes=5),
+    },
+    "accrue-overdue-fines": {
+        "task": "borrowing.tasks.accrue_overdue_fines",
+        "schedule": crontab(hour=0, minute=30),
+    },
+    "refresh-analytics": {
+        "task": "borrowing.tasks.refresh_analytics",
+        "schedule": timedelta(minutes=15),
+    },
+    "expire-hold-allocations": {
+        "task": "borrowing.tasks.expire_hold_allocations",
+        "schedule": timedelta(minutes=15),
+    },
+}
 
 # stripe settings
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY")
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "https://api.stripe.com")
+STRIPE_CONNECT_TIMEOUT = float(os.getenv("STRIPE_CONNECT_TIMEOUT", 3))
+STRIPE_READ_TIMEOUT = float(os.getenv("STRIPE_READ_TIMEOUT", 10))
+STRIPE_MAX_RETRIES = int(os.getenv("STRIPE_MAX_RETRIES", 2))
+STRIPE_POOL_SIZE = int(os.getenv("STRIPE_POOL_SIZE", 10))
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "library_service.settings")
 
 application = get_wsgi_application()
+
+from book.autocomplete import warm_up_book_index  # noqa: E402
+
+warm_up_book_index()
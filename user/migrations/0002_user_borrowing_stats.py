@@ -0,0 +1,75 @@
+# Generated by Django 4.2 on 2026-10-18 02:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_stats(apps, schema_editor) -> None:
+    """Fill the counters from the existing borrowings and payments"""
+
+    Borrowing = apps.get_model("borrowing", "Borrowing")
+    Payment = apps.get_model("borrowing", "Payment")
+    UserBorrowingStats = apps.get_model("user", "UserBorrowingStats")
+
+    stats = {}
+
+    def stats_of(user_id: int):
+        if user_id not in stats:
+            stats[user_id] = UserBorrowingStats(user_id=user_id)
+        return stats[user_id]
+
+    active = Borrowing.objects.filter(actual_return_date__isnull=True)
+    for user_id in active.values_list("user_id", flat=True).iterator():
+        stats_of(user_id).active_loans += 1
+
+    totals = Payment.objects.values("borrowing__user_id").annotate(
+        paid=models.Sum("money_to_pay", filter=models.Q(status="PAID")),
+        outstanding=models.Sum(
+            "money_to_pay", filter=models.Q(type="FINE") & ~models.Q(status="PAID")
+        ),
+    )
+    for total in totals.iterator():
+        user_stats = stats_of(total["borrowing__user_id"])
+        user_stats.total_paid = total["paid"] or 0
+        user_stats.outstanding_fines = total["outstanding"] or 0
+
+    UserBorrowingStats.objects.bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("user", "0001_initial"),
+        ("borrowing", "0012_payment_checkout"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserBorrowingStats",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="borrowing_stats",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("active_loans", models.PositiveIntegerField(default=0)),
+                (
+                    "total_paid",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                (
+                    "outstanding_fines",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "user borrowing stats",
+            },
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def recount_totals(apps, schema_editor) -> None:
+    """Sum the totals again over the amounts charged, the backfill summed
+    the daily fees the payments stored before"""
+
+    Payment = apps.get_model("borrowing", "Payment")
+    UserBorrowingStats = apps.get_model("user", "UserBorrowingStats")
+
+    totals = {
+        total["borrowing__user_id"]: total
+        for total in Payment.objects.values("borrowing__user_id").annotate(
+            paid=models.Sum("money_to_pay", filter=models.Q(status="PAID")),
+            outstanding=models.Sum(
+                "money_to_pay",
+                filter=models.Q(type="FINE") & ~models.Q(status="PAID"),
+            ),
+        )
+    }
+    stats = []
+    for user_stats in UserBorrowingStats.objects.iterator(chunk_size=BATCH_SIZE):
+        total = totals.get(user_stats.user_id, {})
+        user_stats.total_paid = total.get("paid") or 0
+        user_stats.outstanding_fines = total.get("outstanding") or 0
+        stats.append(user_stats)
+    UserBorrowingStats.objects.bulk_update(
+        stats, ["total_paid", "outstanding_fines"], batch_size=BATCH_SIZE
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("user", "0002_user_borrowing_stats"),
+        ("borrowing", "0023_payment_amount_charged"),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_totals, migrations.RunPython.noop),
+    ]
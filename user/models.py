@@ -63,3 +63,24 @@ class User(AbstractUser):
     REQUIRED_FIELDS = []
 
     objects = UserManager()
+
+
+class UserBorrowingStats(models.Model):
+    """Dashboard counters of a user, kept up to date by the borrow, return
+    and payment code paths in the same transactions"""
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="borrowing_stats",
+    )
+    active_loans = models.PositiveIntegerField(default=0)
+    total_paid = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    outstanding_fines = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self) -> str:
+        return f"Borrowing stats of {self.user}"
+
+    class Meta:
+        verbose_name_plural = "user borrowing stats"
@@ -1,7 +1,7 @@
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
-from user.models import User
+from user.models import User, UserBorrowingStats
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -24,3 +24,11 @@ class UserSerializer(serializers.ModelSerializer):
             user.save()
 
         return user
+
+
+class UserBorrowingStatsSerializer(serializers.ModelSerializer):
+    overdue_loans = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = UserBorrowingStats
+        fields = ("active_loans", "overdue_loans", "total_paid", "outstanding_fines")
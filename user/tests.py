@@ -1,8 +1,25 @@
+import datetime
+from decimal import Decimal
+from unittest import mock
+
 from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
 
+from borrowing.models import Borrowing, Payment
+from borrowing.payments import mark_session_paid
+from borrowing.tests.test_borrowing_api import (
+    BORROWING_URL,
+    sample_book,
+    sample_borrowing,
+)
+from user.models import UserBorrowingStats
 from user.serializers import UserSerializer
 
+STATS_URL = reverse("user:stats")
+
 
 class UserApiTests(TestCase):
     def test_create_superuser_and_user(self) -> None:
@@ -29,3 +46,79 @@ class UserApiTests(TestCase):
         )
 
         self.assertEquals(test_user.check_password("new_password"), True)
+
+
+@mock.patch("borrowing.serializers.enqueue_payment_session")
+@mock.patch("borrowing.telegram_notification.schedule_dispatch")
+class UserBorrowingStatsApiTests(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user("test@test.com", "pass")
+        self.client.force_authenticate(self.user)
+
+    def test_stats_of_a_new_user_are_zero(self, *mocks: mock.Mock) -> None:
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data,
+            {
+                "active_loans": 0,
+                "overdue_loans": 0,
+                "total_paid": "0.00",
+                "outstanding_fines": "0.00",
+            },
+        )
+
+    def test_stats_follow_borrow_return_and_payment(self, *mocks: mock.Mock) -> None:
+        book = sample_book(daily_fee=2)
+        self.client.post(
+            BORROWING_URL,
+            {
+                "expected_return_date": datetime.date.today()
+                + datetime.timedelta(days=7),
+                "book": book.id,
+            },
+        )
+        borrowing = Borrowing.objects.get(user=self.user)
+        self.assertEqual(self.client.get(STATS_URL).data["active_loans"], 1)
+
+        self.client.post(
+            reverse(
+                "borrowing:borrowing-return-borrowing", kwargs={"pk": borrowing.id}
+            ),
+            {"actual_return_date": datetime.date.today() + datetime.timedelta(10)},
+        )
+        stats = UserBorrowingStats.objects.get(user=self.user)
+        self.assertEqual(stats.active_loans, 0)
+        self.assertEqual(stats.outstanding_fines, Decimal("12.00"))
+
+        # the fine is charged next to the borrowing fee
+        self.assertEqual(
+            sorted(Payment.objects.filter(borrowing=borrowing).values_list("type")),
+            [("FINE",), ("PAYMENT",)],
+        )
+        Payment.objects.filter(borrowing=borrowing, type="FINE").update(
+            session_id="cs_paid"
+        )
+        mark_session_paid("cs_paid")
+        # a repeated confirmation of the session counts nothing twice
+        mark_session_paid("cs_paid")
+
+        stats.refresh_from_db()
+        self.assertEqual(stats.total_paid, Decimal("12.00"))
+        self.assertEqual(stats.outstanding_fines, Decimal("0.00"))
+
+    def test_overdue_loans_are_counted_on_read(self, *mocks: mock.Mock) -> None:
+        book = sample_book()
+        sample_borrowing(book=book, user=self.user)
+        overdue = sample_borrowing(book=book, user=self.user)
+        Borrowing.objects.filter(pk=overdue.pk).update(
+            expected_return_date=datetime.date.today() - datetime.timedelta(days=1)
+        )
+        UserBorrowingStats.objects.create(user=self.user, active_loans=2)
+
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.data["active_loans"], 2)
+        self.assertEqual(response.data["overdue_loans"], 1)
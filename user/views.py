@@ -1,8 +1,11 @@
+import datetime
+
 from rest_framework import generics
 from rest_framework.permissions import AllowAny
 
-from user.models import User
-from user.serializers import UserSerializer
+from borrowing.models import Borrowing
+from user.models import User, UserBorrowingStats
+from user.serializers import UserBorrowingStatsSerializer, UserSerializer
 
 
 class CreateUserView(generics.CreateAPIView):
@@ -19,3 +22,27 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
 
     def get_object(self) -> User:
         return self.request.user
+
+
+class UserBorrowingStatsView(generics.RetrieveAPIView):
+    """Dashboard counters of the user witch already login"""
+
+    serializer_class = UserBorrowingStatsSerializer
+
+    def get_object(self) -> UserBorrowingStats:
+        user = self.request.user
+        try:
+            stats = user.borrowing_stats
+        except UserBorrowingStats.DoesNotExist:
+            stats = UserBorrowingStats(user=user)
+
+        # a loan turns overdue with time rather than with a write, so it is
+        # counted here from the partial index of active borrowings
+        stats.overdue_loans = 0
+        if stats.active_loans:
+            stats.overdue_loans = Borrowing.objects.filter(
+                user=user,
+                actual_return_date__isnull=True,
+                expected_return_date__lt=datetime.date.today(),
+            ).count()
+        return stats